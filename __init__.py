@@ -8,6 +8,7 @@ from tinyAPI.base.data_store.memcache import Memcache
 from tinyAPI.base.data_store.exception import ColumnCannotBeNullException
 from tinyAPI.base.data_store.exception import DataStoreDuplicateKeyException
 from tinyAPI.base.data_store.provider import DataStoreMySQL
+from tinyAPI.base.data_store.SQLLiteral import SQLLiteral
 from tinyAPI.base.services.table_builder.mysql import Table, RefTable, View
 from tinyAPI.base.services.table_builder.reference import refv
 
@@ -10,16 +10,23 @@ import tinyAPI_config
 
 __all__ = ['ConfigManager']
 
+# ----- Private Data ----------------------------------------------------------
+
+_required = object()
+
 # ----- Public Classes --------------------------------------------------------
 
 class ConfigManager(object):
     '''Handles retrieval and validation of configuration settings.'''
 
     @staticmethod
-    def value(key):
-        '''Retrieves the configuration value named by key.'''
+    def value(key, default=_required):
+        '''Retrieves the configuration value named by key.  If a default is
+           provided it is returned when the key is not configured.'''
         if key in tinyAPI_config.values:
             return tinyAPI_config.values[key]
+        elif default is not _required:
+            return default
         else:
             raise ConfigurationException(
                 '"' + key + '" is not configured in tinyAPI_config')
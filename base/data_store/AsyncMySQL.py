@@ -0,0 +1,140 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .AsyncRDBMSBase import AsyncRDBMSBase
+from collections import OrderedDict
+from .exception import DataStoreException
+from .exception import DataStoreDuplicateKeyException
+from .exception import DataStoreForeignKeyException
+from .exception import IllegalMixOfCollationsException
+
+import pymysql
+
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# ----- Public Classes --------------------------------------------------------
+
+class AsyncMySQL(AsyncRDBMSBase):
+    '''
+    Manages asynchronous interactions with configured MySQL servers.
+    Requires aiomysql.
+    '''
+
+    def __init__(self):
+        if aiomysql is None:
+            raise DataStoreException(
+                'aiomysql must be installed to use AsyncMySQL'
+            )
+
+        super(AsyncMySQL, self).__init__()
+
+    async def _begin(self, connection):
+        pass
+
+    def _can_fail_over(self, error):
+        return isinstance(error, pymysql.err.OperationalError) and \
+               error.args[0] == 2003
+
+    async def _create_pool(self, host, db, settings):
+        conversions = pymysql.converters.conversions.copy()
+        conversions[pymysql.FIELD_TYPE.TIME] = \
+            pymysql.converters.convert_time
+
+        pool = \
+            await aiomysql.create_pool(
+                minsize=max(1, settings.get('min size', 1)),
+                maxsize=settings.get('max size', 16),
+                pool_recycle=settings.get('max idle', -1),
+                host=host[0],
+                user=host[1],
+                password=host[2],
+                db=db,
+                charset=self._charset,
+                conv=conversions,
+                autocommit=False
+            )
+
+        return pool
+
+    async def _end(self, connection, commit):
+        if commit:
+            await connection.commit()
+        else:
+            await connection.rollback()
+
+    async def _execute(self, connection, sql, binds, fetch):
+        cursor_class = aiomysql.DictCursor
+        if self._result_mode is not None:
+            cursor_class = aiomysql.Cursor
+        elif self._ordered_dict_cursor is True:
+            cursor_class = OrderedDictCursor
+
+        cursor = await connection.cursor(cursor_class)
+        try:
+            try:
+                await cursor.execute(sql, binds)
+            except (pymysql.err.IntegrityError,
+                    pymysql.err.InternalError) as e:
+                errno, message = e.args
+
+                if errno == 1062:
+                    raise DataStoreDuplicateKeyException(message)
+                elif errno == 1271:
+                    raise IllegalMixOfCollationsException(sql, binds)
+                elif errno == 1452:
+                    raise DataStoreForeignKeyException(message)
+                else:
+                    raise
+            except pymysql.err.ProgrammingError as e:
+                errno, message = e.args
+
+                raise \
+                    DataStoreException(
+                        self.__format_query_execution_error(
+                            sql, message, binds
+                        )
+                    )
+
+            results = None
+            if fetch is True:
+                results = await cursor.fetchall()
+            elif fetch:
+                results = await cursor.fetchmany(fetch)
+
+            if fetch:
+                if self._result_mode is not None:
+                    results = \
+                        self._shape_results(cursor.description, results)
+                else:
+                    results = list(results)
+
+            return results, cursor.rowcount, cursor.lastrowid
+        finally:
+            await cursor.close()
+
+    def __format_query_execution_error(self, sql, message, binds=tuple()):
+        return ('execution of this query:\n\n'
+                + sql
+                + "\n\n"
+                + (repr(binds) if binds is not None else '')
+                + '\n\nproduced this error:\n\n'
+                + message)
+
+    def _pool_key(self, settings):
+        return \
+            ('mysql',
+             self._db,
+             self._charset,
+             tuple((host[0], host[1]) for host in settings['hosts']))
+
+# ----- Private Classes -------------------------------------------------------
+
+if aiomysql is not None:
+    class OrderedDictCursor(aiomysql.DictCursor):
+        dict_type = OrderedDict
@@ -0,0 +1,121 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .AsyncRDBMSBase import AsyncRDBMSBase
+from .exception import DataStoreException
+from .exception import DataStoreDuplicateKeyException
+from .exception import DataStoreForeignKeyException
+
+import psycopg2
+import psycopg2.extras
+
+try:
+    import aiopg
+except ImportError:
+    aiopg = None
+
+# ----- Public Classes --------------------------------------------------------
+
+class AsyncPostgreSQL(AsyncRDBMSBase):
+    '''
+    Manages asynchronous interactions with configured PostgreSQL servers.
+    Requires aiopg, which always runs connections in autocommit mode, so a
+    transaction is started explicitly when a connection is acquired.
+    '''
+
+    def __init__(self):
+        if aiopg is None:
+            raise DataStoreException(
+                'aiopg must be installed to use AsyncPostgreSQL'
+            )
+
+        super(AsyncPostgreSQL, self).__init__()
+
+    async def _begin(self, connection):
+        cursor = await connection.cursor()
+        try:
+            await cursor.execute('begin')
+        finally:
+            cursor.close()
+
+    def _can_fail_over(self, error):
+        return isinstance(error, psycopg2.OperationalError)
+
+    async def _create_pool(self, host, db, settings):
+        pool = \
+            await aiopg.create_pool(
+                minsize=max(1, settings.get('min size', 1)),
+                maxsize=settings.get('max size', 16),
+                pool_recycle=settings.get('max idle', -1),
+                host=host[0],
+                user=host[1],
+                password=host[2],
+                database=db
+            )
+
+        return pool
+
+    async def _end(self, connection, commit):
+        cursor = await connection.cursor()
+        try:
+            await cursor.execute('commit' if commit else 'rollback')
+        finally:
+            cursor.close()
+
+    async def _execute(self, connection, sql, binds, fetch):
+        cursor_factory = psycopg2.extras.RealDictCursor
+        if self._result_mode is not None:
+            cursor_factory = None
+
+        cursor = await connection.cursor(cursor_factory=cursor_factory)
+        try:
+            try:
+                await cursor.execute(sql, binds)
+            except psycopg2.IntegrityError as e:
+                if e.pgcode == '23505':
+                    raise DataStoreDuplicateKeyException(e.pgerror)
+                elif e.pgcode == '23503':
+                    raise DataStoreForeignKeyException(e.pgerror)
+                else:
+                    raise
+            except psycopg2.ProgrammingError as e:
+                raise \
+                    DataStoreException(
+                        self.__format_query_execution_error(
+                            sql, e.pgerror, binds
+                        )
+                    )
+
+            results = None
+            if fetch is True:
+                results = await cursor.fetchall()
+            elif fetch:
+                results = await cursor.fetchmany(fetch)
+
+            if fetch:
+                if self._result_mode is not None:
+                    results = \
+                        self._shape_results(cursor.description, results)
+                else:
+                    results = list(results)
+
+            return results, cursor.rowcount, cursor.lastrowid
+        finally:
+            cursor.close()
+
+    def __format_query_execution_error(self, sql, message, binds=tuple()):
+        return ('execution of this query:\n\n'
+                + sql
+                + "\n\n"
+                + (repr(binds) if binds is not None else '')
+                + '\n\nproduced this error:\n\n'
+                + message)
+
+    def _pool_key(self, settings):
+        return \
+            ('postgresql',
+             self._db,
+             tuple((host[0], host[1]) for host in settings['hosts']))
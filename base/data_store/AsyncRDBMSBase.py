@@ -0,0 +1,538 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+from .QueryStats import query_stats
+from .RDBMSBase import RDBMSBase
+
+import asyncio
+import contextvars
+import os
+import time
+import tinyAPI.base.context as Context
+import weakref
+
+# ----- Process Data ----------------------------------------------------------
+
+_inherited_pools = []
+_pools = weakref.WeakKeyDictionary()
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    # The connections in the parent's pools share sockets with the parent, so
+    # they are kept referenced rather than closed by this process.
+    _inherited_pools.extend(_pools.values())
+    _pools.clear()
+
+# ----- Public Classes --------------------------------------------------------
+
+class AsyncRDBMSBase(RDBMSBase):
+    '''
+    Defines a data store whose methods are coroutines so that a single event
+    loop can serve many concurrent requests.  Connections come from a pool
+    shared by every handle running on the same event loop.  A handle keeps
+    its connections from the first statement until it is committed, rolled
+    back or closed.
+    '''
+
+    def __init__(self):
+        super(AsyncRDBMSBase, self).__init__()
+
+        self.__connections = {}
+        self.__row_count = None
+        self.__last_row_id = None
+
+        # Waiting for another caller to compute a result set would tie up a
+        # thread of the executor that Memcache calls are run in.
+        self._memcache_can_wait = False
+
+    async def __acquire(self, is_read):
+        group = self._route(is_read)
+
+        connection = self.__connections.get(group)
+        if connection is None:
+            pool = await self.__get_pool(group)
+
+            wait_timeout = \
+                self._settings[group].get('pool', {}).get('wait timeout', 10)
+            try:
+                connection = \
+                    await asyncio.wait_for(pool.acquire(), wait_timeout)
+            except asyncio.TimeoutError:
+                raise DataStoreException(
+                    'timed out after {} seconds waiting for a connection '
+                    .format(wait_timeout)
+                    + 'from the pool'
+                )
+
+            try:
+                await self._begin(connection)
+            except Exception:
+                await pool.release(connection)
+                raise
+
+            self.__connections[group] = connection
+
+        return connection
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def __blocking(self, function, *args):
+        '''
+        Run a call that may wait on Memcached in the default executor, in a
+        copy of the caller's context, so that the event loop is not blocked.
+        '''
+
+        return \
+            await asyncio.get_running_loop().run_in_executor(
+                None, contextvars.copy_context().run, function, *args
+            )
+
+    def bulk_load(self, target, rows=tuple(), columns=tuple()):
+        raise DataStoreException(
+            'bulk_load() is not supported by asynchronous handles'
+        )
+
+    async def close(self):
+        await self.__release(False)
+        await self.__reset_memcache()
+        self._invalidate_written(False)
+
+    async def commit(self, ignore_exceptions=False):
+        if len(self.__connections) == 0:
+            if not ignore_exceptions:
+                raise DataStoreException(
+                    'transaction cannot be committed because a database '
+                    + 'connection has not been established yet'
+                )
+        else:
+            if Context.env_unit_test():
+                return
+
+            started = time.time()
+
+            try:
+                await self.__release(True)
+            except Exception:
+                self._invalidate_written(False)
+                raise
+
+            if len(self._written_tables) > 0:
+                await self.__blocking(self._invalidate_written, True)
+
+            self._record_statement('commit', 'commit', started)
+
+    def configure(self, settings, db, group):
+        if len(self.__connections) > 0:
+            raise DataStoreException(
+                'an asynchronous handle cannot be configured while it holds '
+                + 'connections; commit, roll back or close it first'
+            )
+
+        self._check_settings(settings, group)
+
+        self._settings = settings
+        self._db = db
+        self._group = group
+        self._routing = settings.get('routing')
+        return self
+
+    async def count(self, sql, binds=tuple()):
+        record = await self.nth(0, sql, binds)
+        if record is None:
+            return None
+
+        return list(record.values())[0]
+
+    async def create(self, target, data=tuple(), return_insert_id=True):
+        if len(data) == 0:
+            return None
+
+        keys = tuple(data.keys())
+        binds, vals = self._get_binds_and_values(data.values())
+
+        template_key = ('create', target, keys, tuple(binds))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql  = 'insert into ' + target + '('
+            sql += ', '.join(keys)
+            sql += ')'
+            sql += ' values ('
+            sql += ', '.join(binds)
+            sql += ')'
+
+            self._template_cache.put(template_key, sql)
+
+        started = time.time()
+
+        connection = await self.__acquire(False)
+
+        results, self.__row_count, self.__last_row_id = \
+            await self._execute(connection, sql, vals, False)
+
+        self._record_statement('create', sql, started, self.__row_count)
+
+        await self.__invalidate_tables(sql)
+
+        return self.__last_row_id if return_insert_id else None
+
+    def create_many(self, target, rows=tuple(), chunk_size=1000,
+                    return_insert_id=True):
+        raise DataStoreException(
+            'create_many() is not supported by asynchronous handles'
+        )
+
+    async def delete(self, target, data=tuple()):
+        keys = tuple(data.keys())
+
+        binds = None
+        where = tuple()
+        if len(data) > 0:
+            where, binds = self._get_binds_and_values(data.values())
+
+        template_key = ('delete', target, keys, tuple(where))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql = 'delete from ' + target
+            if len(data) > 0:
+                sql += ' where ' \
+                       + ' and '.join(
+                            [key + ' = ' + where[index]
+                             for index, key in enumerate(keys)]
+                         )
+
+            self._template_cache.put(template_key, sql)
+
+        started = time.time()
+
+        connection = await self.__acquire(False)
+
+        results, self.__row_count, last_row_id = \
+            await self._execute(connection, sql, binds, False)
+
+        self._record_statement('delete', sql, started, self.__row_count)
+
+        if self._memcache_key is not None:
+            await self.__blocking(self.memcache_purge)
+        await self.__invalidate_tables(sql)
+        await self.__reset_memcache()
+
+        return True
+
+    def delete_many(self, target, rows=tuple(), chunk_size=1000):
+        raise DataStoreException(
+            'delete_many() is not supported by asynchronous handles'
+        )
+
+    async def _fetch_rows(self, sql, binds, count):
+        # nth(), one() and count() always return dicts.
+        self._result_mode = None
+
+        if self._memcache_key is not None:
+            return (await self.query(sql, binds))[:count]
+
+        started = time.time()
+
+        sql = self._limit(sql, count)
+
+        connection = await self.__acquire(self._is_read(sql))
+
+        records, self.__row_count, self.__last_row_id = \
+            await self._execute(connection, sql, binds, count)
+
+        self._record_statement('query', sql, started, len(records), records)
+
+        return records
+
+    async def gather(self, queries):
+        '''
+        Run independent queries concurrently and return their results in
+        order.  See RDBMSBase.gather() for the format of the queries.
+        '''
+
+        if any(len(query) > 2 for query in queries):
+            results, pending, states = \
+                await self.__blocking(self._gather_from_cache, queries)
+        else:
+            results, pending, states = self._gather_from_cache(queries)
+
+        if len(pending) > 1 and len(self.__connections) == 0 and \
+           all(self._is_read(queries[index][0]) for index in pending):
+            group = self._route(True)
+
+            gathered = \
+                await asyncio.gather(
+                    *[self.__gather_query(
+                        group, queries[index][0], queries[index][1]
+                      )
+                      for index in pending]
+                )
+
+            for index, records in zip(pending, gathered):
+                if len(queries[index]) > 2:
+                    records = \
+                        await self.__blocking(
+                            self._gather_store,
+                            queries[index],
+                            records,
+                            states.get(index)
+                        )
+
+                results[index] = records
+        else:
+            for index in pending:
+                query = queries[index]
+                if len(query) > 2:
+                    self.memcache(*query[2:])
+                results[index] = await self.query(query[0], query[1])
+
+        return results
+
+    async def __gather_query(self, group, sql, binds):
+        pool = await self.__get_pool(group)
+
+        started = time.time()
+
+        connection = await pool.acquire()
+        try:
+            await self._begin(connection)
+            try:
+                results, row_count, last_row_id = \
+                    await self._execute(connection, sql, binds, True)
+            finally:
+                await self._end(connection, False)
+        except Exception:
+            connection.close()
+            raise
+        finally:
+            await pool.release(connection)
+
+        self._record_stats('query', sql, started, row_count, results)
+
+        return results
+
+    def get_last_row_id(self):
+        return self.__last_row_id
+
+    async def __get_pool(self, group):
+        '''
+        Return the pool for the group on the running event loop, creating it
+        if necessary.  Concurrent callers wait on the same pool creation.
+        '''
+
+        settings = self._settings[group]
+
+        pools = _pools.setdefault(asyncio.get_running_loop(), {})
+
+        key = self._pool_key(settings)
+        if key not in pools:
+            pools[key] = \
+                asyncio.ensure_future(self.__open_pool(settings))
+
+        try:
+            return await asyncio.shield(pools[key])
+        except Exception:
+            pools.pop(key, None)
+            raise
+
+    def get_row_count(self):
+        return self.__row_count
+
+    async def __invalidate_tables(self, sql):
+        tables = self._write_tables(sql)
+        if len(tables) > 0:
+            await self.__blocking(self._invalidate_tables, tables)
+
+    async def nth(self, index, sql, binds=tuple()):
+        records = await self._fetch_rows(sql, binds, index + 1)
+
+        if index < len(records):
+            return records[index]
+        else:
+            return None
+
+    async def one(self, sql, binds=tuple(), obj=None):
+        records = await self._fetch_rows(sql, binds, 2)
+        if len(records) > 1:
+            query_stats().warn(sql, 'one() had more than one record')
+
+        record = records[0] if len(records) > 0 else None
+        if obj is None:
+            return record
+
+        if record is None:
+            raise RuntimeError('no data is present to assign to object')
+
+        for key, value in record.items():
+            setattr(obj, key, value)
+
+        return record
+
+    async def __open_pool(self, settings):
+        durability = self._get_durability(settings)
+
+        while True:
+            host = durability.next()
+
+            started = time.time()
+            try:
+                pool = \
+                    await self._create_pool(
+                        host, self._db, settings.get('pool', {})
+                    )
+            except Exception as e:
+                if not self._can_fail_over(e):
+                    raise
+
+                durability.failed(host)
+                continue
+
+            durability.connected(host, pool, time.time() - started)
+
+            return pool
+
+    async def query(self, sql, binds=tuple()):
+        started = time.time()
+
+        cache_hit = None
+        if self._memcache_key is not None:
+            results_from_cache = \
+                await self.__blocking(self.memcache_retrieve, sql)
+            if results_from_cache is not None:
+                await self.__reset_memcache()
+                self._result_mode = None
+                self._record_statement(
+                    'query', sql, started, None, results_from_cache, True
+                )
+                return results_from_cache
+
+            cache_hit = False
+
+        is_select = self._is_select(sql)
+
+        connection = await self.__acquire(self._is_read(sql))
+
+        results, self.__row_count, self.__last_row_id = \
+            await self._execute(connection, sql, binds, is_select)
+
+        if is_select:
+            if self._memcache_key is not None:
+                results = await self.__blocking(self.memcache_store, results)
+
+            self._record_statement(
+                'query', sql, started, self.__row_count, results, cache_hit
+            )
+        else:
+            results = True
+
+            self._record_statement(
+                'query', sql, started, self.__row_count, None, cache_hit
+            )
+
+            await self.__invalidate_tables(sql)
+
+        await self.__reset_memcache()
+        self._result_mode = None
+
+        return results
+
+    async def __release(self, commit):
+        '''
+        End the transaction on every connection held by this handle and
+        return them to their pools.  Connections whose transaction cannot be
+        ended are closed instead and once one commit fails the remaining
+        connections are rolled back.
+        '''
+
+        connections = self.__connections
+        self.__connections = {}
+        self._reset_routing()
+
+        pools = _pools.get(asyncio.get_running_loop(), {})
+
+        error = None
+        for group, connection in connections.items():
+            try:
+                await self._end(connection, commit and error is None)
+            except Exception as e:
+                connection.close()
+                if error is None:
+                    error = e
+
+            future = pools.get(self._pool_key(self._settings[group]))
+            if future is None:
+                connection.close()
+            else:
+                await future.result().release(connection)
+
+        if error is not None:
+            raise error
+
+    async def __reset_memcache(self):
+        if self._memcache_lease is True:
+            # Releasing the lease is a request to Memcached.
+            await self.__blocking(self._reset_memcache)
+        else:
+            self._reset_memcache()
+
+    async def rollback(self, ignore_exceptions=False):
+        if len(self.__connections) == 0:
+            if not ignore_exceptions:
+                raise DataStoreException(
+                    'transaction cannot be rolled back because a database '
+                    + 'connection has not been established yet'
+                )
+        else:
+            await self.__release(False)
+            self._invalidate_written(False)
+
+    def stream(self, sql, binds=tuple(), batch_size=1000):
+        raise DataStoreException(
+            'stream() is not supported by asynchronous handles'
+        )
+
+    def transaction(self, retries=0, backoff=0.05):
+        raise DataStoreException(
+            'transaction() is not supported by asynchronous handles'
+        )
+
+    def update_many(self, target, rows=tuple(), key_cols=tuple(),
+                    chunk_size=1000):
+        raise DataStoreException(
+            'update_many() is not supported by asynchronous handles'
+        )
+
+    def upsert_many(self, target, rows=tuple(), conflict_cols=tuple(),
+                    update_cols=None, chunk_size=1000):
+        raise DataStoreException(
+            'upsert_many() is not supported by asynchronous handles'
+        )
+
+# ----- Public Functions ------------------------------------------------------
+
+async def close_async_pools():
+    '''
+    Close every pool opened on the running event loop.
+    '''
+
+    pools = _pools.pop(asyncio.get_running_loop(), {})
+    for future in pools.values():
+        try:
+            pool = await future
+        except Exception:
+            continue
+
+        pool.close()
+        await pool.wait_closed()
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,204 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+
+import hashlib
+import os
+import pickle
+import struct
+import zlib
+
+__all__ = [
+    'Codec'
+]
+
+# ----- Private Data ----------------------------------------------------------
+
+_FLAG_CHUNKED = 4
+_FLAG_LZ4 = 2
+_FLAG_ZLIB = 1
+_HEADER = struct.Struct('>3sBB')
+_MAGIC = b'\x00tA'
+_MANIFEST = struct.Struct('>I16s')
+_MAX_KEY_LENGTH = 250
+_VERSION = 1
+
+# ----- Private Classes -------------------------------------------------------
+
+class _Columns(object):
+    '''Holds a list of dicts that share the same keys as one tuple of keys
+       and one list of values per key.  It unpickles as the list of dicts.'''
+
+    __slots__ = ('keys', 'columns')
+
+    def __init__(self, keys, columns):
+        self.keys = keys
+        self.columns = columns
+
+
+    def __reduce__(self):
+        return (_rows, (self.keys, self.columns))
+
+# ----- Private Functions -----------------------------------------------------
+
+def _chunk_key(key, index):
+    suffix = ':chunk:{}'.format(index)
+
+    # Memcached rejects keys longer than 250 bytes.
+    if len(key.encode('utf-8')) + len(suffix) > _MAX_KEY_LENGTH:
+        key = hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    return key + suffix
+
+
+def _columnar(value):
+    from .memcache import CacheEntry
+
+    if type(value) is list:
+        if len(value) < 2 or type(value[0]) is not dict:
+            return value
+
+        keys = tuple(value[0].keys())
+        for row in value:
+            if type(row) is not dict or tuple(row.keys()) != keys:
+                return value
+
+        return _Columns(
+            keys, [[row[key] for row in value] for key in keys])
+    elif type(value) is tuple:
+        return tuple(_columnar(item) for item in value)
+    elif type(value) is CacheEntry:
+        return CacheEntry(_columnar(value.data), value.expires, value.delta)
+    else:
+        return value
+
+
+def _rows(keys, columns):
+    return [dict(zip(keys, values)) for values in zip(*columns)]
+
+# ----- Public Classes --------------------------------------------------------
+
+class Codec(object):
+    '''Encodes the values stored in Memcached.  Lists of records are stored
+       by column so that column names are not repeated for every record,
+       values at least threshold bytes long are compressed and values longer
+       than chunk_size bytes are split across several keys.  Every blob
+       starts with a version header so the format can change safely.'''
+
+    def __init__(self, compression='zlib', threshold=16384, level=1,
+                 chunk_size=1000000):
+        if compression not in (None, 'lz4', 'zlib'):
+            raise DataStoreException(
+                'unrecognized compression "{}"'.format(compression))
+
+        if compression == 'lz4':
+            try:
+                import lz4.frame
+            except ImportError:
+                raise DataStoreException(
+                    'lz4 must be installed to use lz4 compression')
+
+            self.__lz4 = lz4.frame
+
+        self.compression = compression
+        self.threshold = threshold
+        self.level = level
+        self.chunk_size = chunk_size
+
+
+    def chunk_keys(self, key, blob):
+        '''Returns the keys that hold the chunks of a blob stored at key, or
+           an empty list if the blob is not split.'''
+        if not self.__is_blob(blob) or \
+           not blob[_HEADER.size - 1] & _FLAG_CHUNKED:
+            return []
+
+        count, chunk_id = _MANIFEST.unpack_from(blob, _HEADER.size)
+
+        return [_chunk_key(key, index) for index in range(count)]
+
+
+    def decode(self, blob, chunks=None):
+        '''Returns the value encoded in blob.  The chunks fetched from the
+           keys returned by chunk_keys must be passed in for a split value.
+           None is returned if a chunk is missing or the blob was written in
+           a version this codec does not understand.  Values that were not
+           written by a codec are returned unchanged.'''
+        if not self.__is_blob(blob):
+            return blob
+
+        magic, version, flags = _HEADER.unpack_from(blob)
+        if version != _VERSION:
+            return None
+
+        if flags & _FLAG_CHUNKED:
+            if chunks is None or any(chunk is None for chunk in chunks):
+                return None
+
+            # The chunks of an older or newer value may have been read along
+            # with this manifest.
+            chunk_id = _MANIFEST.unpack_from(blob, _HEADER.size)[1]
+            if any(chunk[:len(chunk_id)] != chunk_id for chunk in chunks):
+                return None
+
+            return self.decode(
+                b''.join(chunk[len(chunk_id):] for chunk in chunks))
+
+        payload = blob[_HEADER.size:]
+        if flags & _FLAG_ZLIB:
+            payload = zlib.decompress(payload)
+        elif flags & _FLAG_LZ4:
+            payload = self.__lz4.decompress(payload)
+
+        return pickle.loads(payload)
+
+
+    def encode(self, key, value):
+        '''Returns a dict of the keys and blobs that must be stored to store
+           value at key.'''
+        payload = pickle.dumps(_columnar(value), pickle.HIGHEST_PROTOCOL)
+
+        flags = 0
+        if self.compression is not None and len(payload) >= self.threshold:
+            if self.compression == 'zlib':
+                compressed = zlib.compress(payload, self.level)
+                flag = _FLAG_ZLIB
+            else:
+                compressed = \
+                    self.__lz4.compress(
+                        payload, compression_level=self.level)
+                flag = _FLAG_LZ4
+
+            if len(compressed) < len(payload):
+                payload = compressed
+                flags |= flag
+
+        blob = _HEADER.pack(_MAGIC, _VERSION, flags) + payload
+        if len(blob) <= self.chunk_size:
+            return {key: blob}
+
+        # Chunks are stored at the same keys every time so that a new value
+        # overwrites the chunks of the old one instead of leaving them behind.
+        # Each chunk starts with the id of the value it belongs to.
+        chunk_id = os.urandom(16)
+        size = self.chunk_size - len(chunk_id)
+        chunks = [chunk_id + blob[offset:offset + size]
+                  for offset in range(0, len(blob), size)]
+
+        blobs = {
+            key:
+                _HEADER.pack(_MAGIC, _VERSION, _FLAG_CHUNKED)
+                + _MANIFEST.pack(len(chunks), chunk_id)
+        }
+        for index, chunk in enumerate(chunks):
+            blobs[_chunk_key(key, index)] = chunk
+
+        return blobs
+
+
+    def __is_blob(self, blob):
+        return isinstance(blob, bytes) and blob[:len(_MAGIC)] == _MAGIC
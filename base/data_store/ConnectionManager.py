@@ -5,28 +5,49 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 # ----- Imports ---------------------------------------------------------------
 
 from tinyAPI.base.config import ConfigManager
+from tinyAPI.base.data_store.AsyncMySQL import AsyncMySQL
+from tinyAPI.base.data_store.AsyncPostgreSQL import AsyncPostgreSQL
+from tinyAPI.base.data_store.ConnectionPool import pool_stats
 from tinyAPI.base.data_store.MySQL import MySQL
 from tinyAPI.base.data_store.PostgreSQL import PostgreSQL
+from tinyAPI.base.data_store.QueryStats import query_stats
+from tinyAPI.base.data_store.RDBMSBase import warm_up_templates
 
 import builtins
+import gc
 import os
+import sys
 import threading
+import tinyAPI
 
 # ----- Thread Local Data -----------------------------------------------------
 
 _thread_local_data = threading.local()
 
+# ----- Process Data ----------------------------------------------------------
+
+_inherited_handles = []
+
 # ----- Public Classes --------------------------------------------------------
 
 class ConnectionManager(object):
     '''
     Manages connectivity and persistence for data store connections.
+
+    Groups configured with "pool" settings always receive a handle per thread
+    and share connections through a process wide pool instead of sharing a
+    single persistent handle.
+
+    Asynchronous handles are not tied to a thread; acquire_async() returns a
+    new handle backed by a pool per event loop.
+
+    Handles are never shared with a forked child.  The child acquires new
+    handles that connect the first time they are used.
     '''
 
     __persistent = {}
 
     def __init__(self):
-        self.pid = os.getpid()
         self.config = ConfigManager.value('data store config')
 
     def acquire(self, server, db, group, persistent=False):
@@ -34,12 +55,13 @@ class ConnectionManager(object):
             self.__persistent[server] = {}
 
         if not hasattr(_thread_local_data, server):
-            if persistent is True:
-                if self.pid not in self.__persistent[server]:
-                    self.__persistent[server][self.pid] = \
+            if persistent is True and not self.__is_pooled(server, group):
+                pid = os.getpid()
+                if pid not in self.__persistent[server]:
+                    self.__persistent[server][pid] = \
                         self.__get_data_store_handle(server)
 
-                dsh = self.__persistent[server][self.pid]
+                dsh = self.__persistent[server][pid]
                 setattr(_thread_local_data, server, dsh)
             else:
                 dsh = \
@@ -53,7 +75,20 @@ class ConnectionManager(object):
 
         return dsh.configure(self.config[server], db, group)
 
-    def __get_data_store_handle(self, server):
+    def acquire_async(self, server, db, group):
+        '''
+        Return a new asynchronous handle.  Every handle running on the same
+        event loop shares a connection pool so a handle should be acquired
+        for each request and closed when the request is complete.  Memcache
+        is called from the default executor; stream(), bulk_load() and the
+        *_many() methods are not supported.
+        '''
+
+        return \
+            self.__get_data_store_handle(server, True) \
+                .configure(self.config[server], db, group)
+
+    def __get_data_store_handle(self, server, asynchronous=False):
         if server not in self.config:
             raise RuntimeError(
                 'server "{}" is not configured in "data store config"'
@@ -67,17 +102,100 @@ class ConnectionManager(object):
             )
 
         if self.config[server]['type'] == 'mysql':
-            return MySQL()
+            return AsyncMySQL() if asynchronous else MySQL()
         elif self.config[server]['type'] == 'postgresql':
-            return PostgreSQL()
+            return AsyncPostgreSQL() if asynchronous else PostgreSQL()
         else:
             raise RuntimeError(
                 'unrecognized data store type "{}"'
                     .format(self.config[server]['type'])
             )
 
+    def __is_pooled(self, server, group):
+        if server not in self.config:
+            return False
+
+        groups = [group]
+        if 'routing' in self.config[server]:
+            groups.extend(self.config[server]['routing'].values())
+
+        for group in groups:
+            if isinstance(self.config[server].get(group), dict) and \
+               'pool' in self.config[server][group]:
+                return True
+
+        return False
+
+    def pool_stats(self):
+        '''
+        Return the checkout and wait time metrics for every connection pool
+        in use by this process.
+        '''
+
+        return pool_stats()
+
+    def query_counters(self):
+        '''
+        Return the counters, like the number of transactions retried after a
+        deadlock, recorded by every data store handle in this process.
+        '''
+
+        return query_stats().counters()
+
+    def query_stats(self, top=10, order_by='total time'):
+        '''
+        Return the timing percentiles, rows, bytes and cache usage for the
+        most expensive query shapes executed by this process.
+        '''
+
+        return query_stats().snapshot(top, order_by)
+
+    @classmethod
+    def _retire_inherited(cls):
+        '''
+        Stop handing out the persistent handles of other processes.
+        '''
+
+        pid = os.getpid()
+        for handles in cls.__persistent.values():
+            for owner in [owner for owner in handles if owner != pid]:
+                _inherited_handles.append(handles.pop(owner))
+
+    def warm_up(self, statements=tuple()):
+        '''
+        Prepare a prefork server's master process, such as uWSGI or gunicorn
+        with preload, to fork its workers.  Loads the configuration and the
+        reference definitions, compiles templates for the statements the
+        workers will execute and moves everything loaded so far out of the
+        garbage collector's reach so that workers share it instead of copying
+        it.  No connections are opened.
+        '''
+
+        self.config = ConfigManager.value('data store config')
+
+        ref_defs_file = ConfigManager.value('reference definition file', None)
+        if ref_defs_file is not None and \
+           'reference_definition' not in sys.modules:
+            tinyAPI.load_reference_definitions(ref_defs_file)
+
+        warm_up_templates(statements)
+
+        gc.freeze()
+
+        return self
+
 # ----- Protected Functions ---------------------------------------------------
 
+def _after_fork_in_child():
+    # Handles inherited from the parent share its sockets.  They are kept
+    # referenced, because closing them here would end the parent's sessions,
+    # and new handles are created when they are next acquired.
+    _inherited_handles.extend(_thread_local_data.__dict__.values())
+    _thread_local_data.__dict__.clear()
+
+    ConnectionManager._retire_inherited()
+
+
 def _configure_dsh_builtins(dsh):
     builtins._c = dsh.count
     builtins._cr = dsh.create
@@ -92,3 +210,4 @@ def _configure_dsh_builtins(dsh):
 
 builtins._dscm = ConnectionManager()
 builtins._ds = builtins._dscm.acquire
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,403 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+
+import collections
+import os
+import threading
+import time
+
+__all__ = [
+    'ConnectionPool',
+    'get_pool',
+    'pool_stats',
+    'validate_idle_pools'
+]
+
+# ----- Process Data ----------------------------------------------------------
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    global _pools_lock
+
+    # Pools are keyed by process id so the parent's pools are never handed
+    # out here.  They stay referenced so that their connections, which share
+    # sockets with the parent, are not closed by this process.
+    _pools_lock = threading.Lock()
+
+# ----- Public Classes --------------------------------------------------------
+
+class ConnectionPool(object):
+    '''
+    Manages a bounded set of connections to a single data store group so that
+    many threads can share a small number of connections.  A connection is
+    checked out for the duration of a request and checked back in when the
+    data store handle is closed.
+    '''
+
+    def __init__(self,
+                 connect,
+                 min_size=0,
+                 max_size=16,
+                 max_idle=300,
+                 wait_timeout=10,
+                 validate=None,
+                 validate_after=0):
+        if max_size < 1:
+            raise DataStoreException('pool "max size" must be at least 1')
+
+        if min_size < 0 or min_size > max_size:
+            raise DataStoreException(
+                'pool "min size" must be between 0 and "max size"'
+            )
+
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.wait_timeout = wait_timeout
+        self.validate = validate
+        self.validate_after = validate_after
+
+        self.__condition = threading.Condition()
+        self.__idle = collections.deque()
+        self.__size = 0
+        self.__stats = {
+            'checkouts': 0,
+            'created': 0,
+            'discarded': 0,
+            'evicted': 0,
+            'timeouts': 0,
+            'wait time max': 0.0,
+            'wait time total': 0.0,
+            'waits': 0
+        }
+
+    def checkin(self, connection, discard=False):
+        '''
+        Return a connection to the pool.  If discard is True the connection
+        is closed and its slot is freed instead.
+        '''
+
+        with self.__condition:
+            if discard is True:
+                self.__size -= 1
+                self.__stats['discarded'] += 1
+            else:
+                now = time.time()
+                self.__idle.append((connection, now, now))
+
+            self.__condition.notify()
+
+        if discard is True:
+            self.__disconnect(connection)
+
+    def checkout(self, timeout=None):
+        '''
+        Retrieve a connection from the pool, opening a new one if the pool has
+        not reached its maximum size and waiting for one to be checked in if
+        it has.
+        '''
+
+        if timeout is None:
+            timeout = self.wait_timeout
+
+        started = time.time()
+        waited = False
+        timed_out = False
+        connection = None
+        validated = None
+        evicted = []
+
+        with self.__condition:
+            while True:
+                evicted.extend(self.__evict_idle(time.time()))
+
+                if len(self.__idle) > 0:
+                    connection, last_used, validated = self.__idle.pop()
+                    break
+
+                if self.__size < self.max_size:
+                    self.__size += 1
+                    break
+
+                waited = True
+                if timeout is None:
+                    self.__condition.wait()
+                else:
+                    remaining = timeout - (time.time() - started)
+                    if remaining <= 0:
+                        self.__stats['timeouts'] += 1
+                        timed_out = True
+                        break
+
+                    self.__condition.wait(remaining)
+
+            if timed_out is False:
+                wait_time = time.time() - started
+
+                self.__stats['checkouts'] += 1
+                if waited is True:
+                    self.__stats['waits'] += 1
+                    self.__stats['wait time total'] += wait_time
+                    if wait_time > self.__stats['wait time max']:
+                        self.__stats['wait time max'] = wait_time
+
+        for stale in evicted:
+            self.__disconnect(stale)
+
+        if timed_out is True:
+            raise DataStoreException(
+                'timed out after {} seconds waiting for a connection from '
+                    .format(timeout)
+                + 'the pool'
+            )
+
+        if connection is not None and self.validate is not None:
+            if time.time() - validated >= self.validate_after:
+                try:
+                    self.validate(connection)
+                except Exception:
+                    self.__disconnect(connection)
+                    connection = None
+
+                    with self.__condition:
+                        self.__stats['discarded'] += 1
+
+        if connection is None:
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.__condition:
+                    self.__size -= 1
+                    self.__condition.notify()
+                raise
+
+            with self.__condition:
+                self.__stats['created'] += 1
+
+        return connection
+
+    def close(self):
+        '''
+        Close every idle connection.  Connections that are checked out are
+        closed when they are checked back in with discard set to True or are
+        returned to the pool as usual.
+        '''
+
+        with self.__condition:
+            idle = [entry[0] for entry in self.__idle]
+            self.__idle.clear()
+            self.__size -= len(idle)
+            self.__condition.notify_all()
+
+        for connection in idle:
+            self.__disconnect(connection)
+
+    def __disconnect(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def evict(self):
+        '''
+        Close idle connections that have exceeded the maximum idle time while
+        keeping at least the minimum number of connections open.
+        '''
+
+        with self.__condition:
+            evicted = self.__evict_idle(time.time())
+
+        for connection in evicted:
+            self.__disconnect(connection)
+
+        return len(evicted)
+
+    def __evict_idle(self, now):
+        evicted = []
+        if self.max_idle is None:
+            return evicted
+
+        while len(self.__idle) > 0 and self.__size > self.min_size:
+            connection, last_used, validated = self.__idle[0]
+            if now - last_used < self.max_idle:
+                break
+
+            self.__idle.popleft()
+            self.__size -= 1
+            self.__stats['evicted'] += 1
+            evicted.append(connection)
+
+        return evicted
+
+    def fill(self):
+        '''
+        Open connections until the pool holds at least its minimum size.
+        '''
+
+        while True:
+            with self.__condition:
+                if self.__size >= self.min_size:
+                    return self
+
+                self.__size += 1
+
+            try:
+                connection = self.connect()
+            except Exception:
+                with self.__condition:
+                    self.__size -= 1
+                raise
+
+            with self.__condition:
+                now = time.time()
+                self.__stats['created'] += 1
+                self.__idle.append((connection, now, now))
+                self.__condition.notify()
+
+    def __return_validated(self, entry):
+        # Idle connections are kept in the order they were last used so that
+        # eviction can stop at the first one that has not been idle too long.
+        index = len(self.__idle)
+        while index > 0 and self.__idle[index - 1][1] > entry[1]:
+            index -= 1
+
+        self.__idle.insert(index, entry)
+        self.__condition.notify()
+
+    def stats(self):
+        '''
+        Return the size of the pool and its checkout and wait time metrics.
+        '''
+
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats['idle'] = len(self.__idle)
+            stats['in use'] = self.__size - len(self.__idle)
+            stats['max size'] = self.max_size
+            stats['min size'] = self.min_size
+            stats['size'] = self.__size
+
+        if stats['waits'] > 0:
+            stats['wait time avg'] = \
+                stats['wait time total'] / stats['waits']
+        else:
+            stats['wait time avg'] = 0.0
+
+        return stats
+
+    def validate_idle(self, idle_after):
+        '''
+        Validate the idle connections that have not been used or validated
+        for idle_after seconds and replace the ones that fail so that a
+        checkout does not have to.  Connections that have been idle longer
+        than the maximum idle time are evicted first.  Returns the number of
+        connections that failed.
+        '''
+
+        now = time.time()
+        with self.__condition:
+            evicted = self.__evict_idle(now)
+
+            due = []
+            if self.validate is not None:
+                due = [entry for entry in self.__idle
+                       if now - entry[2] >= idle_after]
+                for entry in due:
+                    self.__idle.remove(entry)
+
+        for stale in evicted:
+            self.__disconnect(stale)
+
+        failed = 0
+        for connection, last_used, validated in due:
+            try:
+                self.validate(connection)
+            except Exception:
+                self.__disconnect(connection)
+                failed += 1
+
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self.__condition:
+                        self.__size -= 1
+                        self.__stats['discarded'] += 1
+                        self.__condition.notify()
+                    continue
+
+                with self.__condition:
+                    self.__stats['discarded'] += 1
+                    self.__stats['created'] += 1
+
+            with self.__condition:
+                self.__return_validated((connection, last_used, time.time()))
+
+        return failed
+
+# ----- Public Functions ------------------------------------------------------
+
+def get_pool(key, connect, settings, validate=None, validate_after=0):
+    '''
+    Return the process wide pool identified by key, creating it from the
+    "pool" settings of a data store group if it does not exist yet.
+    '''
+
+    key = (os.getpid(),) + tuple(key)
+
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = \
+                ConnectionPool(
+                    connect,
+                    settings.get('min size', 0),
+                    settings.get('max size', 16),
+                    settings.get('max idle', 300),
+                    settings.get('wait timeout', 10),
+                    validate,
+                    settings.get('validate after', validate_after)
+                )
+
+        return _pools[key]
+
+
+def pool_stats():
+    '''
+    Return the metrics for every pool created by the current process.
+    '''
+
+    pid = os.getpid()
+
+    with _pools_lock:
+        pools = \
+            [(key[1:], pool) for key, pool in _pools.items() if key[0] == pid]
+
+    return {key: pool.stats() for key, pool in pools}
+
+
+def validate_idle_pools(idle_after):
+    '''
+    Validate the idle connections of every pool created by the current
+    process.  See ConnectionPool.validate_idle().
+    '''
+
+    pid = os.getpid()
+
+    with _pools_lock:
+        pools = [pool for key, pool in _pools.items() if key[0] == pid]
+
+    for pool in pools:
+        pool.validate_idle(idle_after)
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,133 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+from .HostHealth import host_health
+
+import random
+
+# ----- Public Classes --------------------------------------------------------
+
+class Durability(object):
+    '''
+    Defines the base level class for durability algorithms.  Each call to
+    next() returns a host that has not been tried yet, preferring hosts that
+    the shared health table has not marked dead.  Subclasses decide which of
+    the candidate hosts to return.
+    '''
+
+    def __init__(self, settings, options=None, health=None):
+        if options is None:
+            options = {}
+
+        self.settings = list(settings)
+        self.failures = options.get('failures', 3)
+        self.cooldown = options.get('cooldown', 30)
+        self.health = health if health is not None else host_health()
+
+        self.__remaining = list(range(len(self.settings)))
+
+    def connected(self, host, connection, elapsed):
+        self.health.succeeded(host[0], connection, elapsed)
+
+    def failed(self, host):
+        self.health.failed(host[0], self.failures, self.cooldown)
+
+    def next(self):
+        if len(self.__remaining) == 0:
+            raise DataStoreException('no more hosts remain')
+
+        candidates = \
+            [index
+             for index in self.__remaining
+             if self.health.available(self.settings[index][0])]
+        if len(candidates) == 0:
+            candidates = self.__remaining
+
+        index = self._select(candidates)
+        self.__remaining.remove(index)
+
+        return self.settings[index]
+
+    def _select(self, candidates):
+        '''
+        Return one of the candidate indexes into settings.
+        '''
+
+        return random.choice(candidates)
+
+class CircuitBreaker(Durability):
+    '''
+    Implements the circuit breaker durability algorithm.  A host is selected
+    at random from those that have not been marked dead.
+    '''
+
+    pass
+
+class LatencyAware(Durability):
+    '''
+    Implements the latency aware durability algorithm.  Two hosts are picked
+    at random and the one with the lower average connect latency is selected.
+    Hosts that have never been connected to are preferred.
+    '''
+
+    def _select(self, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+
+        first, second = random.sample(candidates, 2)
+
+        first_latency = self.health.latency(self.settings[first][0])
+        second_latency = self.health.latency(self.settings[second][0])
+
+        if first_latency is None:
+            return first
+        elif second_latency is None:
+            return second
+
+        return first if first_latency <= second_latency else second
+
+class LeastOutstanding(Durability):
+    '''
+    Implements the least outstanding durability algorithm.  The host with the
+    fewest connections open from this process is selected.
+    '''
+
+    def _select(self, candidates):
+        outstanding = \
+            [self.health.outstanding(self.settings[index][0])
+             for index in candidates]
+        fewest = min(outstanding)
+
+        return random.choice(
+            [index
+             for index, count in zip(candidates, outstanding)
+             if count == fewest]
+        )
+
+class WeightedRandom(Durability):
+    '''
+    Implements the weighted random durability algorithm.  Hosts are selected
+    at random in proportion to the "weights" option, which lists one weight
+    per host.
+    '''
+
+    def __init__(self, settings, options=None, health=None):
+        super(WeightedRandom, self).__init__(settings, options, health)
+
+        if options is None:
+            options = {}
+
+        self.weights = options.get('weights', [1] * len(self.settings))
+        if len(self.weights) != len(self.settings):
+            raise DataStoreException(
+                'exactly one weight must be configured for each host'
+            )
+
+    def _select(self, candidates):
+        return random.choices(
+            candidates, [self.weights[index] for index in candidates]
+        )[0]
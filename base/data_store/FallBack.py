@@ -4,16 +4,19 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 
 # ----- Imports ---------------------------------------------------------------
 
+from .Durability import Durability
 from .exception import DataStoreException
 
 # ----- Public Classes --------------------------------------------------------
 
-class FallBack(object):
+class FallBack(Durability):
     '''
     Implements the fall back durability algorithm.
     '''
 
-    def __init__(self, settings):
+    def __init__(self, settings, options=None, health=None):
+        super(FallBack, self).__init__(settings, options, health)
+
         self.__selected_host = None
 
         if len(settings) != 2:
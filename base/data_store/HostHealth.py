@@ -0,0 +1,124 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+import threading
+import time
+import weakref
+
+# ----- Public Classes --------------------------------------------------------
+
+class HostHealth(object):
+    '''
+    Tracks consecutive connection failures, connect latency and the number of
+    open connections for every database host.  A host that fails too many
+    times in a row is marked dead for a cooldown period.
+    '''
+
+    def __init__(self, decay=0.3):
+        self.decay = decay
+
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+
+    def available(self, host):
+        '''
+        Return False while the host is marked dead.
+        '''
+
+        with self.__lock:
+            state = self.__hosts.get(host)
+            return state is None or state['dead until'] <= time.time()
+
+    def __closed(self, host):
+        with self.__lock:
+            state = self.__hosts.get(host)
+            if state is not None and state['outstanding'] > 0:
+                state['outstanding'] -= 1
+
+    def failed(self, host, failures=3, cooldown=30):
+        '''
+        Record a failed connection attempt.  Once the host has failed the
+        given number of times in a row it is marked dead for cooldown
+        seconds.
+        '''
+
+        with self.__lock:
+            state = self.__get_state(host)
+            state['failures'] += 1
+            if state['failures'] >= failures:
+                state['dead until'] = time.time() + cooldown
+
+    def __get_state(self, host):
+        state = self.__hosts.get(host)
+        if state is None:
+            state = {
+                'dead until': 0,
+                'failures': 0,
+                'latency': None,
+                'outstanding': 0
+            }
+            self.__hosts[host] = state
+
+        return state
+
+    def latency(self, host):
+        '''
+        Return the moving average of the time taken to connect to the host,
+        or None if a connection has never been made to it.
+        '''
+
+        with self.__lock:
+            state = self.__hosts.get(host)
+            return None if state is None else state['latency']
+
+    def outstanding(self, host):
+        '''
+        Return the number of connections to the host that are still open.
+        '''
+
+        with self.__lock:
+            state = self.__hosts.get(host)
+            return 0 if state is None else state['outstanding']
+
+    def reset(self):
+        with self.__lock:
+            self.__hosts = {}
+
+    def stats(self):
+        with self.__lock:
+            return {host: dict(state) for host, state in self.__hosts.items()}
+
+    def succeeded(self, host, connection, elapsed):
+        '''
+        Record a successful connection.  The connection counts as outstanding
+        until it is garbage collected.
+        '''
+
+        with self.__lock:
+            state = self.__get_state(host)
+            state['dead until'] = 0
+            state['failures'] = 0
+            state['outstanding'] += 1
+
+            if state['latency'] is None:
+                state['latency'] = elapsed
+            else:
+                state['latency'] += self.decay * (elapsed - state['latency'])
+
+        weakref.finalize(connection, self.__closed, host)
+
+# ----- Process Data ----------------------------------------------------------
+
+_health = HostHealth()
+
+# ----- Public Functions ------------------------------------------------------
+
+def host_health():
+    '''
+    Return the health table shared by every handle in this process.
+    '''
+
+    return _health
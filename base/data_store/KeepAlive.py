@@ -0,0 +1,109 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .ConnectionPool import validate_idle_pools
+from tinyAPI.base.config import ConfigManager
+
+import os
+import threading
+import time
+import weakref
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    global _keep_alive
+
+    # The parent's thread was not copied into this process.
+    _keep_alive = KeepAlive()
+
+# ----- Public Classes --------------------------------------------------------
+
+class KeepAlive(object):
+    '''
+    Validates idle connections on a background thread so that requests do
+    not pay for pinging connections that may have timed out, replacing the
+    ones that fail before a request can use them.  It covers every
+    connection pool in the process and every persistent handle that has been
+    watched.  The thread only runs if "data store keep alive" is configured.
+    '''
+
+    def __init__(self):
+        self.__handles = weakref.WeakSet()
+        self.__lock = threading.Lock()
+        self.__thread = None
+
+    def __run(self, interval):
+        while True:
+            time.sleep(interval)
+            self.validate(interval)
+
+    def start(self):
+        '''
+        Start the thread if it is configured and not already running.
+        '''
+
+        if self.__thread is not None:
+            return self
+
+        settings = ConfigManager.value('data store keep alive', None)
+        if settings is None:
+            return self
+
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = \
+                    threading.Thread(
+                        target=self.__run,
+                        args=(settings.get('interval', 60),),
+                        name='tinyapi-keep-alive',
+                        daemon=True
+                    )
+                self.__thread.start()
+
+        return self
+
+    def validate(self, idle_after):
+        '''
+        Validate the connections that have been idle for at least idle_after
+        seconds.
+        '''
+
+        validate_idle_pools(idle_after)
+
+        with self.__lock:
+            handles = list(self.__handles)
+
+        for handle in handles:
+            try:
+                handle.keep_alive(idle_after)
+            except Exception:
+                # The handle will find out for itself the next time it is
+                # used.
+                pass
+
+    def watch(self, handle):
+        '''
+        Keep the connections of a persistent handle alive while it is idle.
+        '''
+
+        with self.__lock:
+            self.__handles.add(handle)
+
+        return self.start()
+
+# ----- Process Data ----------------------------------------------------------
+
+_keep_alive = KeepAlive()
+
+# ----- Public Functions ------------------------------------------------------
+
+def keep_alive():
+    return _keep_alive
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,148 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from collections import OrderedDict
+from types import MappingProxyType
+
+import heapq
+import itertools
+import sys
+import time
+
+__all__ = [
+    'LocalCache'
+]
+
+# ----- Public Classes --------------------------------------------------------
+
+class LocalCache(object):
+    '''Implements a least recently used cache bounded by both the number of
+       entries and their approximate size in bytes.  Entries with a TTL are
+       expired actively as the cache is used rather than only when read.'''
+
+    def __init__(self, max_entries=1000, max_bytes=16777216, negative_ttl=5):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.negative_ttl = negative_ttl
+
+        self.__entries = OrderedDict()
+        self.__expiries = []
+        self.__sequence = itertools.count()
+        self.__bytes = 0
+        self.stats = {
+            'evictions': 0,
+            'expirations': 0,
+            'hits': 0,
+            'misses': 0,
+            'negative hits': 0
+        }
+
+
+    def __delete(self, key):
+        data, expires, size = self.__entries.pop(key)
+        self.__bytes -= size
+
+
+    def __expire(self, now):
+        while len(self.__expiries) > 0 and self.__expiries[0][0] <= now:
+            expires, sequence, key = heapq.heappop(self.__expiries)
+
+            entry = self.__entries.get(key)
+            if entry is not None and entry[1] == expires:
+                self.__delete(key)
+                self.stats['expirations'] += 1
+
+
+    def lookup(self, key):
+        '''Returns a tuple of whether the key was found and the data stored
+           at it.  A key that was stored as missing is found with None as its
+           data.'''
+        now = time.time()
+        self.__expire(now)
+
+        entry = self.__entries.get(key)
+        if entry is None:
+            self.stats['misses'] += 1
+            return False, None
+
+        self.__entries.move_to_end(key)
+
+        if entry[0] is None:
+            self.stats['negative hits'] += 1
+        else:
+            self.stats['hits'] += 1
+
+        return True, entry[0]
+
+
+    def purge(self, key):
+        '''Removes the key from the cache.'''
+        if key in self.__entries:
+            self.__delete(key)
+
+
+    def set(self, key, data, ttl=None):
+        '''Stores data at the key.  Storing None records that the key does not
+           exist for the negative TTL.'''
+        now = time.time()
+        self.__expire(now)
+
+        if data is None:
+            ttl = self.negative_ttl
+            size = sys.getsizeof(key)
+        else:
+            size = sys.getsizeof(key) + _approximate_size(data)
+
+        if key in self.__entries:
+            self.__delete(key)
+
+        if size > self.max_bytes:
+            return
+
+        expires = None
+        if ttl is not None:
+            expires = now + ttl
+            heapq.heappush(
+                self.__expiries, (expires, next(self.__sequence), key))
+
+        self.__entries[key] = (data, expires, size)
+        self.__bytes += size
+
+        while len(self.__entries) > self.max_entries or \
+              self.__bytes > self.max_bytes:
+            oldest = next(iter(self.__entries))
+            self.__delete(oldest)
+            self.stats['evictions'] += 1
+
+        if len(self.__expiries) > 2 * self.max_entries:
+            self.__expiries = \
+                [expiry
+                 for expiry in self.__expiries
+                 if expiry[2] in self.__entries and
+                    self.__entries[expiry[2]][1] == expiry[0]]
+            heapq.heapify(self.__expiries)
+
+
+    def size(self):
+        '''Returns the number of entries and their approximate size.'''
+        return len(self.__entries), self.__bytes
+
+# ----- Private Functions -----------------------------------------------------
+
+def _approximate_size(data):
+    size = sys.getsizeof(data)
+
+    if isinstance(data, (list, tuple)):
+        for item in data:
+            size += sys.getsizeof(item)
+            if isinstance(item, (dict, MappingProxyType)):
+                for value in item.values():
+                    size += sys.getsizeof(value)
+    elif isinstance(data, (dict, MappingProxyType)):
+        for value in data.values():
+            size += sys.getsizeof(value)
+
+    return size
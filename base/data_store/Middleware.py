@@ -0,0 +1,409 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.ConnectionManager import ConnectionManager
+from tinyAPI.base.data_store.QueryStats import query_stats
+from tinyAPI.base.stats_logger import StatsLogger
+
+import contextvars
+import itertools
+import threading
+
+__all__ = [
+    'AsyncDataStoreMiddleware',
+    'DataStoreMiddleware',
+    'request_metrics',
+    'RequestMetrics'
+]
+
+# ----- Private Data ----------------------------------------------------------
+
+_COMMIT_FAILED_HEADERS = [('Content-Type', 'text/plain; charset=utf-8')]
+_COMMIT_FAILED_STATUS = '500 Internal Server Error'
+
+_request_metrics = \
+    contextvars.ContextVar('tinyapi_request_metrics', default=None)
+
+# ----- Private Functions -----------------------------------------------------
+
+def _close(iterable):
+    if hasattr(iterable, 'close'):
+        iterable.close()
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers]
+
+
+def _record(record):
+    metrics = _request_metrics.get()
+    if metrics is not None:
+        metrics.record(record)
+
+
+def _status_code(status):
+    try:
+        return int(str(status).split(' ', 1)[0])
+    except ValueError:
+        return None
+
+# ----- Private Classes -------------------------------------------------------
+
+class _ClosingIterable(object):
+    '''
+    Wraps the iterable returned by a WSGI application so that the request
+    can be finished once the server has sent the response and closed it.
+    The body is read from chunks, which starts with anything that had to be
+    read from the iterable before the response could be started.
+    '''
+
+    def __init__(self, iterable, chunks, finish):
+        self.__iterable = iterable
+        self.__chunks = chunks
+        self.__finish = finish
+
+    def close(self):
+        try:
+            _close(self.__iterable)
+        finally:
+            self.__finish()
+
+    def __iter__(self):
+        return self.__chunks
+
+# ----- Public Classes --------------------------------------------------------
+
+class RequestMetrics(object):
+    '''
+    Accumulates the time spent executing statements, the number executed and
+    the results served from Memcache instead for a single request.
+    '''
+
+    def __init__(self):
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.db_time = 0.0
+        self.queries = 0
+
+        self.__lock = threading.Lock()
+
+    def cache_hit_ratio(self):
+        '''
+        Return the fraction of cacheable queries answered by Memcache or None
+        if nothing was looked up.
+        '''
+
+        lookups = self.cache_hits + self.cache_misses
+        if lookups == 0:
+            return None
+
+        return self.cache_hits / lookups
+
+    def headers(self):
+        '''
+        Return the metrics as a list of response headers.
+        '''
+
+        headers = [
+            ('Server-Timing', 'db;dur={0:.3f}'.format(self.db_time * 1000)),
+            ('X-DB-Queries', str(self.queries))
+        ]
+
+        ratio = self.cache_hit_ratio()
+        if ratio is not None:
+            headers.append(('X-Cache-Hit-Ratio', '{0:.2f}'.format(ratio)))
+
+        return headers
+
+    def record(self, record):
+        '''
+        Add a statement recorded by the query statistics.
+        '''
+
+        with self.__lock:
+            if record['cache hit'] is True:
+                self.cache_hits += 1
+                return
+
+            if record['cache hit'] is False:
+                self.cache_misses += 1
+
+            self.db_time += record['elapsed']
+            self.queries += 1
+
+
+class AsyncDataStoreMiddleware(object):
+    '''
+    ASGI middleware that gives each HTTP request its own asynchronous handle,
+    available to the application as scope['tinyapi.dsh'].  Before the end
+    of the response body is sent the handle is committed, or rolled back if
+    the application responded with a 5xx status, and the start of the
+    response is held back until then so that a commit that fails can be
+    reported as a 500.  When the application finishes the handle is rolled
+    back if it did not send the end of the body and its connections are
+    returned to the pool.  The time spent executing statements, the
+    number executed and the Memcache hit ratio are added to the response
+    headers and, if log is True, written to the application log.
+    '''
+
+    def __init__(self, app, server, db, group, headers=True, log=False):
+        self.app = app
+        self.server = server
+        self.db = db
+        self.group = group
+        self.headers = headers
+        self.log = log
+
+        self.__manager = ConnectionManager()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        metrics = RequestMetrics()
+        token = _request_metrics.set(metrics)
+
+        dsh = self.__manager.acquire_async(self.server, self.db, self.group)
+
+        scope = dict(scope)
+        scope['tinyapi.dsh'] = dsh
+
+        status = []
+        start = []
+        ended = []
+
+        async def scoped_send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+                start.append(message)
+                return
+
+            if message['type'] == 'http.response.body' and \
+               message.get('more_body', False) is False and len(ended) == 0:
+                ended.append(True)
+
+                if not await self.__end(dsh, status[0]):
+                    if len(start) == 0:
+                        # The response was already started, so the client
+                        # can only be told by not finishing it.
+                        raise RuntimeError(
+                            'the transaction could not be committed'
+                        )
+
+                    status[0] = 500
+                    start[0] = {
+                        'type': 'http.response.start',
+                        'status': status[0],
+                        'headers': _encode_headers(_COMMIT_FAILED_HEADERS)
+                    }
+                    message = {'type': 'http.response.body', 'body': b''}
+
+            if len(start) > 0:
+                message_start = dict(start.pop())
+                if self.headers:
+                    message_start['headers'] = \
+                        list(message_start.get('headers', [])) \
+                        + _encode_headers(metrics.headers())
+
+                await send(message_start)
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, scoped_send)
+        finally:
+            try:
+                if len(ended) == 0:
+                    await dsh.rollback(True)
+            finally:
+                await dsh.close()
+
+                _request_metrics.reset(token)
+
+                if self.log:
+                    StatsLogger().request(
+                        scope.get('method', '') + ' ' + scope.get('path', ''),
+                        status[0] if len(status) > 0 else None,
+                        metrics
+                    )
+
+    async def __end(self, dsh, status):
+        '''
+        End the transaction for a response with status and return False if
+        it could not be committed.
+        '''
+
+        if status >= 500:
+            await dsh.rollback(True)
+            return True
+
+        try:
+            await dsh.commit(True)
+        except Exception:
+            await dsh.rollback(True)
+            return False
+
+        return True
+
+
+class DataStoreMiddleware(object):
+    '''
+    WSGI middleware that scopes a data store handle to each request.  The
+    handle is acquired from the ConnectionManager before the application is
+    called and is available to it as environ['tinyapi.dsh'] as well as
+    through _ds().  When the application returns, and before the response
+    is started, the handle is committed, or rolled back if the application
+    raised or responded with a 5xx status; a commit that fails turns the
+    response into a 500.  Once the server has sent the response the handle
+    is closed, which rolls back anything written while the body was being
+    produced, returns pooled connections to the pool, resets the handle's
+    routing, result mode and Memcache settings and lets the keep-alive
+    thread validate it; a persistent handle keeps its connection open.
+    Handles are not persistent by default because an unpooled persistent
+    handle is shared by every thread in the process; only ask for one if
+    the server runs a single thread per process.
+
+    The time spent executing statements, the number executed and the
+    Memcache hit ratio are added to the response headers and, if log is
+    True, the totals are written to the application log.
+    '''
+
+    def __init__(self, app, server, db, group, persistent=False, headers=True,
+                 log=False):
+        self.app = app
+        self.server = server
+        self.db = db
+        self.group = group
+        self.persistent = persistent
+        self.headers = headers
+        self.log = log
+
+        self.__manager = ConnectionManager()
+
+    def __call__(self, environ, start_response):
+        metrics = RequestMetrics()
+        _request_metrics.set(metrics)
+
+        try:
+            dsh = \
+                self.__manager.acquire(
+                    self.server, self.db, self.group, self.persistent
+                )
+        except Exception:
+            _request_metrics.set(None)
+            raise
+
+        environ['tinyapi.dsh'] = dsh
+
+        response = []
+        written = []
+
+        # The response is started once the transaction has ended, so the
+        # body written through the legacy write() callable is held until
+        # then as well.
+        def scoped_start_response(status_line, headers, exc_info=None):
+            response[:] = [status_line, list(headers), exc_info]
+            return written.append
+
+        result = None
+        try:
+            result = self.app(environ, scoped_start_response)
+
+            chunks = iter(result)
+            read = []
+            if len(response) == 0:
+                # A generator calls start_response once it is first resumed.
+                for chunk in chunks:
+                    read.append(chunk)
+                    if len(response) > 0:
+                        break
+
+            if len(response) == 0:
+                raise RuntimeError(
+                    'the application did not call start_response'
+                )
+
+            status_line, headers, exc_info = response
+
+            if not self.__end(dsh, _status_code(status_line)):
+                _close(result)
+
+                result = None
+                status_line = _COMMIT_FAILED_STATUS
+                headers = list(_COMMIT_FAILED_HEADERS)
+                exc_info = None
+                chunks = iter([])
+                written = []
+                read = []
+        except BaseException:
+            try:
+                _close(result)
+            finally:
+                try:
+                    dsh.rollback(True)
+                finally:
+                    self.__finish(dsh, metrics, environ, None)
+            raise
+
+        if self.headers:
+            headers = headers + metrics.headers()
+
+        start_response(status_line, headers, exc_info)
+
+        return \
+            _ClosingIterable(
+                result,
+                itertools.chain(written, read, chunks),
+                lambda: self.__finish(dsh, metrics, environ, status_line)
+            )
+
+    def __end(self, dsh, code):
+        '''
+        End the transaction for a response with the status code and return
+        False if it could not be committed.
+        '''
+
+        if code is not None and code >= 500:
+            dsh.rollback(True)
+            return True
+
+        try:
+            dsh.commit(True)
+        except Exception:
+            dsh.rollback(True)
+            return False
+
+        return True
+
+    def __finish(self, dsh, metrics, environ, status_line):
+        try:
+            dsh.close()
+        finally:
+            _request_metrics.set(None)
+
+            if self.log:
+                StatsLogger().request(
+                    environ.get('REQUEST_METHOD', '') + ' '
+                    + environ.get('PATH_INFO', ''),
+                    _status_code(status_line)
+                        if status_line is not None else None,
+                    metrics
+                )
+
+# ----- Public Functions ------------------------------------------------------
+
+def request_metrics():
+    '''
+    Return the metrics of the request being served or None outside of one.
+    '''
+
+    return _request_metrics.get()
+
+# ----- Instructions ----------------------------------------------------------
+
+query_stats().add_hook(_record)
@@ -5,21 +5,85 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 # ----- Imports ---------------------------------------------------------------
 
 from collections import OrderedDict
+from .ConnectionPool import get_pool
 from .exception import DataStoreException
 from .exception import DataStoreDuplicateKeyException
 from .exception import DataStoreForeignKeyException
 from .exception import IllegalMixOfCollationsException
-from .FallBack import FallBack
-from pymysql.cursors import DictCursorMixin, Cursor
-from .Randomizer import Randomizer
+from .KeepAlive import keep_alive
+from pymysql.cursors import DictCursorMixin, Cursor, SSCursor
 from .RDBMSBase import RDBMSBase
-from tinyAPI.base.data_store.memcache import Memcache
+from tinyAPI.base.data_store.memcache import clear_local_cache
 
+import functools
+import itertools
+import os
 import pymysql
-import re
+import threading
 import time
 import tinyAPI.base.context as Context
 
+# ----- Private Functions -----------------------------------------------------
+
+def _feed_pipe(fd, lines, errors):
+    '''
+    Write lines into a pipe and close it so that the reader sees the end of
+    the data.  An error raised while producing the lines is added to errors.
+    '''
+
+    try:
+        with open(fd, 'wb', buffering=65536) as pipe:
+            for line in lines:
+                pipe.write(line)
+    except BrokenPipeError:
+        # The reader stopped early and reports why itself.
+        pass
+    except Exception as e:
+        errors.append(e)
+
+
+def _open_connection(settings, db, charset):
+    '''
+    Connect to one of a group's hosts, failing over to the next host the
+    durability algorithm picks if one cannot be reached.  Pools are given
+    this rather than a method so that they do not keep the handle that
+    created them alive.
+    '''
+
+    durability = RDBMSBase._get_durability(settings)
+
+    while True:
+        host = durability.next()
+
+        config = {
+            'user': host[1],
+            'passwd': host[2],
+            'host': host[0],
+            'database': db,
+            'charset': charset,
+            'autocommit': False,
+            'local_infile': settings.get('local infile', False)
+        }
+
+        started = time.time()
+        try:
+            connection = \
+                pymysql.connect(**config)
+            connection.decoders[pymysql.FIELD_TYPE.TIME] = \
+                pymysql.converters.convert_time
+        except pymysql.err.OperationalError as e:
+            errno, message = e.args
+
+            if errno == 2003:
+                durability.failed(host)
+                continue
+            else:
+                raise
+
+        durability.connected(host, connection, time.time() - started)
+
+        return connection
+
 # ----- Public Classes --------------------------------------------------------
 
 class MySQL(RDBMSBase):
@@ -31,90 +95,186 @@ class MySQL(RDBMSBase):
         super(MySQL, self).__init__()
 
         self.__mysql = None
+        self.__pool = None
+        self.__max_allowed_packet = None
+        self.__active_group = None
+        self.__inactive_connections = {}
         self.__cursor = None
         self.__row_count = None
         self.__last_row_id = None
+        self.__open_stream = None
+
+    def bulk_load(self, target, rows=tuple(), columns=tuple()):
+        group = self._route(False)
+        if self._settings[group].get('local infile', False) is not True:
+            raise DataStoreException(
+                'bulk loading requires "local infile" to be enabled for the '
+                + '"{}" group'.format(group)
+            )
+
+        lines = self._bulk_load_lines(rows, columns)
+
+        self.__use_group(group)
+        self.connect()
+
+        # pymysql opens the file named by the statement itself, so the rows
+        # are written into a pipe by another thread as the pipe is read.
+        read_fd, write_fd = os.pipe()
+        errors = []
+        feeder = \
+            threading.Thread(
+                target=_feed_pipe,
+                args=(write_fd, lines, errors),
+                name='tinyapi-bulk-load',
+                daemon=True
+            )
+
+        sql  = "load data local infile '/dev/fd/" + str(read_fd) + "'"
+        sql += ' into table ' + target
+        sql += ' character set utf8mb4 ('
+        sql += ', '.join(columns)
+        sql += ')'
+
+        started = time.time()
+
+        cursor = self.__get_cursor()
+
+        feeder.start()
+        try:
+            self.__execute(cursor, sql, None)
+        finally:
+            # The thread is blocked on a full pipe if the server did not read
+            # all of the rows; closing the read end releases it.
+            os.close(read_fd)
+            feeder.join()
+
+        if len(errors) > 0:
+            raise errors[0]
+
+        self.__row_count = cursor.rowcount
+
+        self.__close_cursor()
+
+        return self._record_bulk_load(target, sql, started, self.__row_count)
 
     def close(self):
+        self._mark_busy()
+
+        self.__close_stream()
         self.__close_cursor()
-        Memcache().clear_local_cache()
+        clear_local_cache()
 
-        if self.__mysql:
-            if self.persistent is False:
-                self.__mysql.close()
-                self.__mysql = None
+        self.__close_connection()
+        for group in list(self.__inactive_connections.keys()):
+            self.__use_group(group)
+            self.__close_connection()
+
+        if self._group is not None:
+            self.__use_group(self._group)
+        self._reset_routing()
+        self._invalidate_written(False)
+        self._reset_memcache()
+        self._result_mode = None
 
         if self._memcache is not None:
             if self.persistent is False:
                 self._memcache.close()
                 self._memcache = None
 
+        self._mark_idle()
+
+    def __close_connection(self):
+        if self.__mysql:
+            if self.__pool is not None:
+                self.__release_to_pool()
+            elif self.persistent is False:
+                self.__mysql.close()
+                self.__mysql = None
+
     def __close_cursor(self):
         if self.__cursor is not None:
             self.__cursor.close()
             self.__cursor = None
 
+    def __close_stream(self, connection=None):
+        # The unbuffered result of a stream that was not read to its end has
+        # to be read before its connection can run another statement.
+        stream = self.__open_stream
+        if stream is None or \
+           (connection is not None and stream['connection'] is not connection):
+            return
+
+        self.__open_stream = None
+        try:
+            stream['cursor'].close()
+        finally:
+            self._record_stats(
+                'query', stream['sql'], stream['started'], stream['rows']
+            )
+
     def commit(self, ignore_exceptions=False):
-        if self.__mysql is None:
-            if not ignore_exceptions:
-                raise DataStoreException(
-                    'transaction cannot be committed because a database '
-                    + 'connection has not been established yet'
-                )
-        else:
-            if Context.env_unit_test():
-                return
+        self._mark_busy()
+
+        try:
+            self.__close_stream()
+
+            connections = self.__get_open_connections()
+            if len(connections) == 0:
+                if not ignore_exceptions:
+                    raise DataStoreException(
+                        'transaction cannot be committed because a database '
+                        + 'connection has not been established yet'
+                    )
             else:
-                self.connect()
-                self.__mysql.commit()
+                if Context.env_unit_test():
+                    return
+                else:
+                    started = time.time()
+
+                    if self.__mysql:
+                        self.connect()
+
+                    for connection in connections:
+                        connection.commit()
+
+                    self._in_transaction = False
+                    self._invalidate_written(True)
+
+                    self._record_statement('commit', 'commit', started)
+        finally:
+            self._mark_idle()
 
     def connect(self):
+        self._mark_busy()
+
         if self.__mysql:
-            if self.should_ping() is True:
+            self.__close_stream(self.__mysql)
+
+            if self.__pool is None and self.should_ping() is True:
                 self.__mysql.ping(True)
             return
 
+        self.__connect()
+
+    def __connect(self):
         if self._settings is None or self._db is None or self._group is None:
             raise DataStoreException(
                 'cannot connect to MySQL because data store '
                 + 'has not been configured'
             )
 
-        if self._settings[self._group]['durability'] == 'randomizer':
-            durability = Randomizer(self._settings[self._group]['hosts'])
-        elif self._settings[self._group]['durability'] == 'fall back':
-            durability = FallBack(self._settings[self._group]['hosts'])
-        else:
-            raise DataStoreException(
-                'unrecognized durability algorithm "{}"'
-                    .format(self._settings[self._group]['durability'])
-            )
-
-        while True:
-            host, user, password = durability.next()
+        self.__max_allowed_packet = None
 
-            config = {
-                'user': user,
-                'passwd': password,
-                'host': host,
-                'database': self._db,
-                'charset': self._charset,
-                'autocommit': False
-            }
-
-            try:
-                self.__mysql = \
-                    pymysql.connect(**config)
-                self.__mysql.decoders[pymysql.FIELD_TYPE.TIME] = \
-                    pymysql.converters.convert_time
-                break
-            except pymysql.err.OperationalError as e:
-                errno, message = e.args
-
-                if errno == 2003:
-                    durability.next()
-                else:
-                    raise
+        settings = self._settings[self.__get_active_group()]
+        if 'pool' in settings:
+            self.__pool = self.__get_pool(settings)
+            self.__mysql = self.__pool.checkout()
+            keep_alive().start()
+        else:
+            self.__mysql = \
+                _open_connection(settings, self._db, self._charset)
+            if self.persistent is True:
+                keep_alive().watch(self)
 
         self._inactive_since = time.time()
 
@@ -122,11 +282,9 @@ class MySQL(RDBMSBase):
         self.connect()
         return self.__mysql.thread_id()
 
-    def __convert_to_prepared(self, separator, data=tuple()):
-        binds = self.__get_binds(data)
-
+    def __convert_to_prepared(self, separator, keys, binds):
         clause = []
-        for index, key in enumerate(data.keys()):
+        for index, key in enumerate(keys):
             assignment = ''
             assignment += key + ' = '
             assignment += binds[index]
@@ -134,28 +292,28 @@ class MySQL(RDBMSBase):
 
         return separator.join(clause)
 
-    def count(self, sql, binds=tuple()):
-        record = self.nth(0, sql, binds)
-        if record is None:
-            return None
-
-        return list(record.values())[0]
-
     def create(self, target, data=tuple(), return_insert_id=True):
         if len(data) == 0:
             return None
 
-        keys = list(data.keys())
-        binds = self.__get_binds(data)
-        vals = self.__get_values(data.values())
+        keys = tuple(data.keys())
+        binds, vals = self._get_binds_and_values(data.values())
 
-        sql  = 'insert into ' + target + '('
-        sql += ', '.join(keys)
-        sql += ')'
-        sql += ' values ('
-        sql += ', '.join(binds)
-        sql += ')'
+        template_key = ('create', target, keys, tuple(binds))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql  = 'insert into ' + target + '('
+            sql += ', '.join(keys)
+            sql += ')'
+            sql += ' values ('
+            sql += ', '.join(binds)
+            sql += ')'
 
+            self._template_cache.put(template_key, sql)
+
+        started = time.time()
+
+        self.__use_group(self._route(False))
         self.connect()
 
         cursor = self.__get_cursor()
@@ -183,6 +341,10 @@ class MySQL(RDBMSBase):
 
         self.__row_count = cursor.rowcount
 
+        self._record_statement('create', sql, started, self.__row_count)
+
+        self._invalidate_tables(self._write_tables(sql))
+
         id = None
         if return_insert_id:
             id = cursor.lastrowid
@@ -191,14 +353,34 @@ class MySQL(RDBMSBase):
 
         return id
 
+    def create_many(self, target, rows=tuple(), chunk_size=1000,
+                    return_insert_id=True):
+        return \
+            self.__insert_many(
+                'create', target, rows, chunk_size, return_insert_id
+            )
+
     def delete(self, target, data=tuple()):
-        sql = 'delete from ' + target
+        keys = tuple(data.keys())
 
         binds = None
+        where = tuple()
         if len(data) > 0:
-            sql += ' where ' + self.__convert_to_prepared(', ', data)
-            binds = list(data.values())
+            where, binds = self._get_binds_and_values(data.values())
+
+        template_key = ('delete', target, keys, tuple(where))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql = 'delete from ' + target
+            if len(data) > 0:
+                sql += ' where ' \
+                       + self.__convert_to_prepared(' and ', keys, where)
+
+            self._template_cache.put(template_key, sql)
+
+        started = time.time()
 
+        self.__use_group(self._route(False))
         self.connect()
 
         cursor = self.__get_cursor()
@@ -207,13 +389,81 @@ class MySQL(RDBMSBase):
 
         self.__row_count = cursor.rowcount
 
+        self._record_statement('delete', sql, started, self.__row_count)
+
         self.memcache_purge()
+        self._invalidate_tables(self._write_tables(sql))
 
         self.__close_cursor()
         self._reset_memcache()
 
         return True
 
+    def delete_many(self, target, rows=tuple(), chunk_size=1000):
+        self.__use_group(self._route(False))
+        self.connect()
+
+        row_count = 0
+        for keys, chunk in \
+            self._chunk_rows(
+                rows, chunk_size, self.__get_max_allowed_packet()
+            ):
+            sql, vals = self._render_delete_many(target, keys, chunk)
+
+            row_count += self.__execute_write('delete', sql, vals)
+
+        self.__row_count = row_count
+
+        self.memcache_purge()
+        self._reset_memcache()
+
+        return row_count
+
+    def __execute(self, cursor, sql, binds=tuple()):
+        try:
+            cursor.execute(sql, binds)
+        except (pymysql.err.IntegrityError, pymysql.err.InternalError) as e:
+            errno, message = e.args
+
+            if errno == 1062:
+                raise DataStoreDuplicateKeyException(message)
+            elif errno == 1271:
+                raise IllegalMixOfCollationsException(sql, binds)
+            elif errno == 1452:
+                raise DataStoreForeignKeyException(message)
+            else:
+                raise
+        except pymysql.err.ProgrammingError as e:
+            errno, message = e.args
+
+            raise \
+                DataStoreException(
+                    self.__format_query_execution_error(
+                        sql, message, binds
+                    )
+                )
+
+    def __execute_write(self, kind, sql, vals):
+        # Recording the previous chunk of a batch marked the handle idle, so
+        # the keep-alive thread has to be kept away again.
+        self._mark_busy()
+
+        started = time.time()
+
+        cursor = self.__get_cursor()
+
+        self.__execute(cursor, sql, vals)
+
+        self._record_statement(kind, sql, started, cursor.rowcount)
+
+        self._invalidate_tables(self._write_tables(sql))
+
+        row_count = cursor.rowcount
+
+        self.__close_cursor()
+
+        return row_count
+
     def __format_query_execution_error(self, sql, message, binds=tuple()):
         return ('execution of this query:\n\n'
                 + sql
@@ -222,129 +472,466 @@ class MySQL(RDBMSBase):
                 + '\n\nproduced this error:\n\n'
                 + message)
 
-    def __get_binds(self, data=tuple()):
-        if len(data) == 0:
-            return tuple()
+    def _fetch_rows(self, sql, binds, count):
+        # nth(), one() and count() always return dicts.
+        self._result_mode = None
 
-        binds = []
-        for value in list(data.values()):
-            str_value = str(value)
+        if self._memcache_key is not None:
+            return self.query(sql, binds)[:count]
 
-            if re.match('current_timestamp', str_value) is not None or \
-               str_value == 'current_date':
-                binds.append(value)
-            else:
-                binds.append('%s')
+        started = time.time()
 
-        return binds
+        sql = self._limit(sql, count)
 
-    def __get_cursor(self):
-        if self.__cursor is not None:
-            return self.__cursor
+        self.__use_group(self._route(self._is_read(sql)))
+        self.connect()
 
-        self.__cursor = \
+        cursor = \
             self.__mysql.cursor(
-                pymysql.cursors.DictCursor
+                pymysql.cursors.SSDictCursor
                     if self._ordered_dict_cursor is False else
-                OrderedDictCursor
+                OrderedSSDictCursor
             )
 
+        try:
+            self.__execute(cursor, sql, binds)
+
+            records = cursor.fetchmany(count)
+        finally:
+            cursor.close()
+
+        self.__row_count = len(records)
+
+        self._record_statement('query', sql, started, len(records), records)
+
+        return records
+
+    def _gather_capacity(self, group):
+        if 'pool' not in self._settings[group]:
+            return 0
+
+        # This handle's own connection is checked out first so that it is
+        # not counted as free.
+        self.__use_group(group)
+        self.connect()
+
+        stats = self.__pool.stats()
+
+        return stats['max size'] - stats['in use']
+
+    def _gather_query(self, group, sql, binds):
+        pool = self.__get_pool(self._settings[group])
+
+        started = time.time()
+
+        connection = pool.checkout()
+        try:
+            cursor = \
+                connection.cursor(
+                    pymysql.cursors.DictCursor
+                        if self._ordered_dict_cursor is False else
+                    OrderedDictCursor
+                )
+
+            try:
+                self.__execute(cursor, sql, binds)
+
+                results = cursor.fetchall()
+                if results == ():
+                    results = []
+            finally:
+                cursor.close()
+        finally:
+            discard = not connection.open
+            if discard is False:
+                try:
+                    connection.rollback()
+                except pymysql.err.Error:
+                    discard = True
+
+            pool.checkin(connection, discard)
+
+        self._record_stats('query', sql, started, len(results), results)
+
+        return results
+
+    def __get_active_group(self):
+        if self.__active_group is None:
+            return self._group
+
+        return self.__active_group
+
+    def __get_cursor(self):
+        if self.__cursor is not None:
+            return self.__cursor
+
+        if self._result_mode is not None:
+            self.__cursor = self.__mysql.cursor(pymysql.cursors.Cursor)
+        else:
+            self.__cursor = \
+                self.__mysql.cursor(
+                    pymysql.cursors.DictCursor
+                        if self._ordered_dict_cursor is False else
+                    OrderedDictCursor
+                )
+
         return self.__cursor
 
     def get_last_row_id(self):
         return self.__last_row_id
 
+    def __get_max_allowed_packet(self):
+        if self.__max_allowed_packet is None:
+            cursor = self.__mysql.cursor()
+            try:
+                cursor.execute('select @@max_allowed_packet')
+                server_limit = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+
+            self.__max_allowed_packet = \
+                int(min(server_limit, self.__mysql.max_allowed_packet) * 0.75)
+
+        return self.__max_allowed_packet
+
+    def __get_pool(self, settings):
+        return get_pool(
+            (
+                'mysql',
+                self._db,
+                self._charset,
+                tuple((host[0], host[1]) for host in settings['hosts'])
+            ),
+            functools.partial(
+                _open_connection, settings, self._db, self._charset
+            ),
+            settings['pool'],
+            lambda connection: connection.ping(False),
+            self._ping_interval - 3
+        )
+
+    def __get_open_connections(self):
+        connections = []
+        if self.__mysql:
+            connections.append(self.__mysql)
+
+        for connection, pool, max_allowed_packet in \
+            self.__inactive_connections.values():
+            if connection:
+                connections.append(connection)
+
+        return connections
+
     def get_row_count(self):
         return self.__row_count
 
-    def __get_values(self, data=tuple()):
-        if len(data) == 0:
-            return tuple()
+    def __insert_many(self, kind, target, rows, chunk_size, return_insert_id,
+                      clause=None):
+        self.__use_group(self._route(False))
+        self.connect()
 
-        values = []
-        for value in data:
-            str_value = str(value)
+        first_id = None
+        row_count = 0
+        for keys, chunk in \
+            self._chunk_rows(
+                rows, chunk_size, self.__get_max_allowed_packet()
+            ):
+            row_binds = []
+            vals = []
+            for row in chunk:
+                binds, values = \
+                    self._get_binds_and_values([row[key] for key in keys])
 
-            if re.match('current_timestamp', str_value) is None and \
-               str_value != 'current_date':
-                values.append(value)
+                template_key = ('values', tuple(binds))
+                row_bind = self._template_cache.get(template_key)
+                if row_bind is None:
+                    row_bind = \
+                        self._template_cache.put(
+                            template_key, '(' + ', '.join(binds) + ')'
+                        )
 
-        return values
+                row_binds.append(row_bind)
+                vals.extend(values)
 
-    def nth(self, index, sql, binds=tuple()):
-        records = self.query(sql, binds)
+            sql  = 'insert into ' + target + '('
+            sql += ', '.join(keys)
+            sql += ') values '
+            sql += ', '.join(row_binds)
+            if clause is not None:
+                sql += ' ' + clause(keys)
 
-        if index < len(records):
-            return records[index]
-        else:
-            return None
+            self._mark_busy()
 
-    def query(self, sql, binds=tuple()):
-        results_from_cache = self.memcache_retrieve()
-        if results_from_cache is not None:
-            self._reset_memcache()
-            return results_from_cache
+            started = time.time()
 
-        self.connect()
+            cursor = self.__get_cursor()
 
-        is_select = False
-        if re.match('^\(?select ', sql) or re.match('^show ', sql):
-            is_select = True
+            self.__execute(cursor, sql, vals)
 
-        cursor = self.__get_cursor()
+            self._record_statement(kind, sql, started, cursor.rowcount)
 
-        try:
-            cursor.execute(sql, binds)
-        except (pymysql.err.IntegrityError, pymysql.err.InternalError) as e:
-            errno, message = e.args
+            self._invalidate_tables(self._write_tables(sql))
 
-            if errno == 1062:
-                raise DataStoreDuplicateKeyException(message)
-            elif errno == 1271:
-                raise IllegalMixOfCollationsException(sql, binds)
-            elif errno == 1452:
-                raise DataStoreForeignKeyException(message)
-            else:
-                raise
-        except pymysql.err.ProgrammingError as e:
-            errno, message = e.args
+            row_count += cursor.rowcount
+            if return_insert_id and first_id is None:
+                first_id = cursor.lastrowid
 
-            raise \
-                DataStoreException(
-                    self.__format_query_execution_error(
-                        sql, message, binds
-                    )
+            self.__close_cursor()
+
+        self.__row_count = row_count
+
+        return (first_id, row_count)
+
+    def _is_retryable(self, error):
+        return isinstance(error, pymysql.err.MySQLError) and \
+               len(error.args) > 0 and \
+               error.args[0] in (1205, 1213)
+
+    def query(self, sql, binds=tuple()):
+        started = time.time()
+
+        cache_hit = None
+        if self._memcache_key is not None:
+            results_from_cache = self.memcache_retrieve(sql)
+            if results_from_cache is not None:
+                self._reset_memcache()
+                self._result_mode = None
+                self._record_statement(
+                    'query', sql, started, None, results_from_cache, True
                 )
+                return results_from_cache
+
+            cache_hit = False
+
+        self.__use_group(self._route(self._is_read(sql)))
+        self.connect()
+
+        is_select = self._is_select(sql)
+
+        cursor = self.__get_cursor()
+
+        self.__execute(cursor, sql, binds)
 
         self.__row_count = cursor.rowcount
         self.__last_row_id = cursor.lastrowid
 
         if is_select:
             results = cursor.fetchall()
-            if results == ():
+            if self._result_mode is not None:
+                results = \
+                    self._shape_results(cursor.description, results)
+            elif results == ():
                 results = []
 
-            self.memcache_store(results)
+            results = self.memcache_store(results)
+
+            self._record_statement(
+                'query', sql, started, self.__row_count, results, cache_hit
+            )
         else:
             results = True
 
+            self._record_statement(
+                'query', sql, started, self.__row_count, None, cache_hit
+            )
+
+            self._invalidate_tables(self._write_tables(sql))
+
         self.__close_cursor()
         self._reset_memcache()
+        self._result_mode = None
 
         return results
 
+    def __release_to_pool(self):
+        discard = not self.__mysql.open
+        if discard is False:
+            try:
+                self.__mysql.rollback()
+            except pymysql.err.Error:
+                discard = True
+
+        self.__pool.checkin(self.__mysql, discard)
+        self.__mysql = None
+        self.__pool = None
+
     def rollback(self, ignore_exceptions=False):
-        if self.__mysql is None:
-            if not ignore_exceptions:
-                raise DataStoreException(
-                    'transaction cannot be rolled back because a database '
-                    + 'connection has not been established yet'
+        self._mark_busy()
+
+        try:
+            self.__close_stream()
+
+            connections = self.__get_open_connections()
+            if len(connections) == 0:
+                if not ignore_exceptions:
+                    raise DataStoreException(
+                        'transaction cannot be rolled back because a database '
+                        + 'connection has not been established yet'
+                    )
+            else:
+                if self.__mysql:
+                    self.connect()
+
+                for connection in connections:
+                    connection.rollback()
+
+                self._in_transaction = False
+                self._invalidate_written(False)
+        finally:
+            self._mark_idle()
+
+    def update_many(self, target, rows=tuple(), key_cols=tuple(),
+                    chunk_size=1000):
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            self.__row_count = 0
+            return 0
+
+        self.__use_group(self._route(False))
+        self.connect()
+
+        # The keys are rendered again for every column that is updated.
+        max_bytes = self.__get_max_allowed_packet() // len(first)
+
+        row_count = 0
+        for keys, chunk in \
+            self._chunk_rows(
+                itertools.chain([first], rows), chunk_size, max_bytes
+            ):
+            sql, vals = \
+                self._render_update_many(target, keys, key_cols, chunk)
+
+            row_count += self.__execute_write('update', sql, vals)
+
+        self.__row_count = row_count
+
+        return row_count
+
+    def upsert_many(self, target, rows=tuple(), conflict_cols=tuple(),
+                    update_cols=None, chunk_size=1000):
+        first_id, row_count = \
+            self.__insert_many(
+                'upsert', target, rows, chunk_size, False,
+                lambda keys: self.__upsert_clause(
+                    keys, conflict_cols, update_cols
                 )
-        else:
-            self.connect()
-            self.__mysql.rollback()
+            )
+
+        return row_count
+
+    def __upsert_clause(self, keys, conflict_cols, update_cols):
+        update_cols = self._upsert_columns(keys, conflict_cols, update_cols)
+        if len(update_cols) == 0:
+            # Assigning a column to itself leaves colliding rows unchanged.
+            return \
+                'on duplicate key update ' \
+                + conflict_cols[0] + ' = ' + conflict_cols[0]
+
+        return \
+            'on duplicate key update ' \
+            + ', '.join(col + ' = values(' + col + ')' for col in update_cols)
+
+    def __use_group(self, group):
+        active_group = self.__get_active_group()
+        if group == active_group:
+            return
+
+        self.__close_cursor()
+
+        self.__inactive_connections[active_group] = \
+            (self.__mysql, self.__pool, self.__max_allowed_packet)
+
+        self.__mysql, self.__pool, self.__max_allowed_packet = \
+            self.__inactive_connections.pop(group, (None, None, None))
+        self.__active_group = group
+
+    def stream(self, sql, binds=tuple(), batch_size=1000):
+        self._result_mode = None
+
+        if self._memcache_key is not None:
+            self._reset_memcache()
+            raise DataStoreException(
+                'the results of a streamed query cannot be cached'
+            )
+
+        return self.__stream(sql, binds, batch_size)
+
+    def __stream(self, sql, binds, batch_size):
+        started = time.time()
+
+        self.__use_group(self._route(self._is_read(sql)))
+        self.connect()
+
+        cursor = \
+            self.__mysql.cursor(
+                pymysql.cursors.SSDictCursor
+                    if self._ordered_dict_cursor is False else
+                OrderedSSDictCursor
+            )
+
+        stream = {
+            'connection': self.__mysql,
+            'cursor': cursor,
+            'sql': sql,
+            'started': started,
+            'rows': 0
+        }
+        self.__open_stream = stream
+
+        try:
+            self.__execute(cursor, sql, binds)
+
+            while True:
+                records = cursor.fetchmany(batch_size)
+                if not records:
+                    break
+
+                for record in records:
+                    stream['rows'] += 1
+                    yield record
+
+                    if self.__open_stream is not stream:
+                        raise DataStoreException(
+                            'the stream was closed because another '
+                            + 'statement was run before it was read to its '
+                            + 'end'
+                        )
+        finally:
+            if self.__open_stream is stream:
+                self.__open_stream = None
+                cursor.close()
+
+                # Recorded once the stream ends so that the handle stays busy
+                # while records are still being read.
+                self._record_statement('query', sql, started, stream['rows'])
+
+    def _validate_connections(self):
+        active_group = self.__get_active_group()
+
+        groups = [active_group] + list(self.__inactive_connections.keys())
+        for group in groups:
+            self.__use_group(group)
+
+            # Pooled connections are validated by their pool.
+            if self.__mysql and self.__pool is None:
+                try:
+                    self.__mysql.ping(True)
+                except Exception:
+                    self.__mysql = None
+                    try:
+                        self.__connect()
+                    except Exception:
+                        # The next request will connect and fail over.
+                        pass
+
+        self.__use_group(active_group)
 
 # ----- Private Classes -------------------------------------------------------
 
 class OrderedDictCursor(DictCursorMixin, Cursor):
     dict_type = OrderedDict
+
+
+class OrderedSSDictCursor(DictCursorMixin, SSCursor):
+    dict_type = OrderedDict
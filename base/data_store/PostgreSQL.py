@@ -7,16 +7,67 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 from .exception import DataStoreException
 from .exception import DataStoreDuplicateKeyException
 from .exception import DataStoreForeignKeyException
-from .Randomizer import Randomizer
+from .KeepAlive import keep_alive
 from .RDBMSBase import RDBMSBase
-from tinyAPI.base.data_store.memcache import Memcache
+from tinyAPI.base.data_store.memcache import clear_local_cache
 
+import itertools
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-import re
 import time
 import tinyAPI.base.context as Context
 
+# ----- Private Data ----------------------------------------------------------
+
+_MAX_INSERT_BYTES = 16777216
+
+# ----- Process Data ----------------------------------------------------------
+
+_prepared_ids = itertools.count(1)
+_stream_ids = itertools.count(1)
+
+# ----- Private Functions -----------------------------------------------------
+
+def _number_placeholders(sql):
+    parts = sql.split('%s')
+
+    numbered = parts[0]
+    for index, part in enumerate(parts[1:], 1):
+        numbered += '$' + str(index) + part
+
+    return numbered
+
+# ----- Private Classes -------------------------------------------------------
+
+class _LineReader(object):
+    '''
+    Presents a generator of lines as a file that copy_expert() can read so
+    that only the lines for the next read are held in memory.
+    '''
+
+    def __init__(self, lines):
+        self.__lines = lines
+        self.__buffer = b''
+
+    def read(self, size=-1):
+        chunks = [self.__buffer]
+        length = len(self.__buffer)
+        if size < 0 or length < size:
+            for line in self.__lines:
+                chunks.append(line)
+                length += len(line)
+                if size >= 0 and length >= size:
+                    break
+
+        data = b''.join(chunks)
+        if size < 0:
+            self.__buffer = b''
+            return data
+
+        self.__buffer = data[size:]
+        return data[:size]
+
 # ----- Public Classes --------------------------------------------------------
 
 class PostgreSQL(RDBMSBase):
@@ -28,79 +79,150 @@ class PostgreSQL(RDBMSBase):
         super(PostgreSQL, self).__init__()
 
         self.__postgresql = None
+        self.__prepared_names = {}
+        self.__active_group = None
+        self.__inactive_connections = {}
         self.__cursor = None
         self.__row_count = None
         self.__last_row_id = None
 
+    def _bulk_load_binary(self, value):
+        # COPY reads bytea values in the hex format.
+        return b'\\\\x' + value.hex().encode('ascii')
+
+    def bulk_load(self, target, rows=tuple(), columns=tuple()):
+        reader = _LineReader(self._bulk_load_lines(rows, columns))
+
+        self.__use_group(self._route(False))
+        self.connect()
+
+        sql  = 'copy ' + target + ' ('
+        sql += ', '.join(columns)
+        sql += ") from stdin with (encoding 'utf8')"
+
+        started = time.time()
+
+        cursor = self.__get_cursor()
+
+        self.__execute(cursor, sql, None, reader)
+
+        self.__row_count = cursor.rowcount
+
+        self.__close_cursor()
+
+        return self._record_bulk_load(target, sql, started, self.__row_count)
+
     def close(self):
+        self._mark_busy()
+
         self.__close_cursor()
-        Memcache().clear_local_cache()
+        clear_local_cache()
 
-        if self.__postgresql:
-            if self.persistent is False:
-                self.__postgresql.close()
-                self.__postgresql = None
+        self.__close_connection()
+        for group in list(self.__inactive_connections.keys()):
+            self.__use_group(group)
+            self.__close_connection()
+
+        if self._group is not None:
+            self.__use_group(self._group)
+        self._reset_routing()
+        self._invalidate_written(False)
+        self._reset_memcache()
+        self._result_mode = None
 
         if self._memcache is not None:
             if self.persistent is False:
                 self._memcache.close()
                 self._memcache = None
 
+        self._mark_idle()
+
+    def __close_connection(self):
+        if self.__postgresql:
+            if self.persistent is False:
+                self.__postgresql.close()
+                self.__postgresql = None
+
     def __close_cursor(self):
         if self.__cursor is not None:
             self.__cursor.close()
             self.__cursor = None
 
     def commit(self, ignore_exceptions=False):
-        if self.__postgresql is None:
-            if not ignore_exceptions:
-                raise DataStoreException(
-                    'transaction cannot be committed because a database '
-                    + 'connection has not been established yet'
-                )
-        else:
-            if Context.env_unit_test():
-                return
+        self._mark_busy()
+
+        try:
+            connections = self.__get_open_connections()
+            if len(connections) == 0:
+                if not ignore_exceptions:
+                    raise DataStoreException(
+                        'transaction cannot be committed because a database '
+                        + 'connection has not been established yet'
+                    )
             else:
-                self.connect()
-                self.__postgresql.commit()
+                if Context.env_unit_test():
+                    return
+                else:
+                    started = time.time()
+
+                    if self.__postgresql:
+                        self.connect()
+
+                    for connection in connections:
+                        connection.commit()
+
+                    self._in_transaction = False
+                    self._invalidate_written(True)
+
+                    self._record_statement('commit', 'commit', started)
+        finally:
+            self._mark_idle()
 
     def connect(self):
+        self._mark_busy()
+
         if self.__postgresql:
             if self.should_ping() is True:
-                self.query('select 1')
-                self.commit()
+                self.__ping(self.__postgresql)
             return
 
+        self.__connect()
+
+    def __connect(self):
         if self._settings is None or self._db is None or self._group is None:
             raise DataStoreException(
                 'cannot connect to PostgreSQL because data store '
                 + 'has not been configured'
             )
 
-        if self._settings[self._group]['durability'] == 'randomizer':
-            durability = Randomizer(self._settings[self._group]['hosts'])
-        else:
-            raise DataStoreException(
-                'unrecognized durability algorithm "{}"'
-                    .format(self._settings[self._group]['durability'])
-            )
+        settings = self._settings[self.__get_active_group()]
+        durability = self._get_durability(settings)
 
         while True:
-            host, user, password = durability.next()
+            host = durability.next()
 
             config = {
-                'user': user,
-                'password': password,
-                'host': host,
+                'user': host[1],
+                'password': host[2],
+                'host': host[0],
                 'database': self._db
             }
 
+            started = time.time()
             try:
                 self.__postgresql = psycopg2.connect(**config)
-                break
+                self.__prepared_names = {}
             except psycopg2.OperationalError as e:
-                durability.next()
+                durability.failed(host)
+                continue
+
+            durability.connected(
+                host, self.__postgresql, time.time() - started
+            )
+            break
+
+        if self.persistent is True:
+            keep_alive().watch(self)
 
         self._inactive_since = time.time()
 
@@ -108,11 +230,9 @@ class PostgreSQL(RDBMSBase):
         self.connect()
         return self.__postgresql.thread_id()
 
-    def __convert_to_prepared(self, separator, data=tuple()):
-        binds = self.__get_binds(data)
-
+    def __convert_to_prepared(self, separator, keys, binds):
         clause = []
-        for index, key in enumerate(data.keys()):
+        for index, key in enumerate(keys):
             assignment = ''
             assignment += key + ' = '
             assignment += binds[index]
@@ -120,34 +240,114 @@ class PostgreSQL(RDBMSBase):
 
         return separator.join(clause)
 
-    def count(self, sql, binds=tuple()):
-        record = self.nth(0, sql, binds)
-        if record is None:
-            return None
-
-        return list(record.values())[0]
-
     def create(self, target, data=tuple(), return_insert_id=True):
         if len(data) == 0:
             return None
 
-        keys = list(data.keys())
-        binds = self.__get_binds(data)
-        vals = self.__get_values(data.values())
+        keys = tuple(data.keys())
+        binds, vals = self._get_binds_and_values(data.values())
+
+        template_key = ('create', target, keys, tuple(binds))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql  = 'insert into ' + target + '('
+            sql += ', '.join(keys)
+            sql += ')'
+            sql += ' values ('
+            sql += ', '.join(binds)
+            sql += ')'
+
+            self._template_cache.put(template_key, sql)
+
+        started = time.time()
+
+        self.__use_group(self._route(False))
+        self.connect()
+
+        cursor = self.__get_cursor()
+
+        self.__execute_template(cursor, sql, vals)
+
+        self.__row_count = cursor.rowcount
+
+        self._record_statement('create', sql, started, self.__row_count)
+
+        self._invalidate_tables(self._write_tables(sql))
+
+        id = None
+        if return_insert_id:
+            id = cursor.lastrowid
+
+        self.__close_cursor()
+
+        return id
+
+    def create_many(self, target, rows=tuple(), chunk_size=1000,
+                    return_insert_id=True):
+        return self.__insert_many('create', target, rows, chunk_size)
+
+    def delete(self, target, data=tuple()):
+        keys = tuple(data.keys())
+
+        binds = None
+        where = tuple()
+        if len(data) > 0:
+            where, binds = self._get_binds_and_values(data.values())
+
+        template_key = ('delete', target, keys, tuple(where))
+        sql = self._template_cache.get(template_key)
+        if sql is None:
+            sql = 'delete from ' + target
+            if len(data) > 0:
+                sql += ' where ' \
+                       + self.__convert_to_prepared(' and ', keys, where)
 
-        sql  = 'insert into ' + target + '('
-        sql += ', '.join(keys)
-        sql += ')'
-        sql += ' values ('
-        sql += ', '.join(binds)
-        sql += ')'
+            self._template_cache.put(template_key, sql)
 
+        started = time.time()
+
+        self.__use_group(self._route(False))
         self.connect()
 
         cursor = self.__get_cursor()
 
+        self.__execute_template(cursor, sql, binds)
+
+        self.__row_count = cursor.rowcount
+
+        self._record_statement('delete', sql, started, self.__row_count)
+
+        self.memcache_purge()
+        self._invalidate_tables(self._write_tables(sql))
+
+        self.__close_cursor()
+        self._reset_memcache()
+
+        return True
+
+    def delete_many(self, target, rows=tuple(), chunk_size=1000):
+        self.__use_group(self._route(False))
+        self.connect()
+
+        row_count = 0
+        for keys, chunk in self._chunk_rows(rows, chunk_size):
+            sql, vals = self._render_delete_many(target, keys, chunk)
+
+            row_count += self.__execute_write('delete', sql, vals)
+
+        self.__row_count = row_count
+
+        self.memcache_purge()
+        self._reset_memcache()
+
+        return row_count
+
+    def __execute(self, cursor, sql, binds=tuple(), stream=None):
         try:
-            cursor.execute(sql, vals)
+            if stream is None:
+                cursor.execute(sql, binds)
+            else:
+                cursor.copy_expert(sql, stream)
         except psycopg2.IntegrityError as e:
             if e.pgcode == '23505':
                 raise DataStoreDuplicateKeyException(e.pgerror)
@@ -163,38 +363,88 @@ class PostgreSQL(RDBMSBase):
                     )
                 )
 
-        self.__row_count = cursor.rowcount
+    def __execute_template(self, cursor, sql, binds=None):
+        if self._prepared_statements is False:
+            self.__execute(cursor, sql, binds)
+            return
 
-        id = None
-        if return_insert_id:
-            id = cursor.lastrowid
+        name = self.__prepared_names.get(sql)
+        if name is None:
+            if len(self.__prepared_names) >= self._template_cache.max_size:
+                self.__execute(cursor, 'deallocate all', None)
+                self.__prepared_names = {}
+
+            name = 'tinyapi_{}'.format(next(_prepared_ids))
+            self.__execute(
+                cursor,
+                'prepare ' + name + ' as ' + _number_placeholders(sql),
+                None
+            )
+            self.__prepared_names[sql] = name
+
+        if binds:
+            self.__execute(
+                cursor,
+                'execute ' + name + '(' + ', '.join(['%s'] * len(binds)) + ')',
+                binds
+            )
+        else:
+            self.__execute(cursor, 'execute ' + name, None)
+
+    def __execute_write(self, kind, sql, vals):
+        # Recording the previous chunk of a batch marked the handle idle, so
+        # the keep-alive thread has to be kept away again.
+        self._mark_busy()
+
+        started = time.time()
+
+        cursor = self.__get_cursor()
+
+        self.__execute(cursor, sql, vals)
+
+        self._record_statement(kind, sql, started, cursor.rowcount)
+
+        self._invalidate_tables(self._write_tables(sql))
+
+        row_count = cursor.rowcount
 
         self.__close_cursor()
 
-        return id
+        return row_count
 
-    def delete(self, target, data=tuple()):
-        sql = 'delete from ' + target
+    def _fetch_rows(self, sql, binds, count):
+        # nth(), one() and count() always return dicts.
+        self._result_mode = None
 
-        binds = None
-        if len(data) > 0:
-            sql += ' where ' + self.__convert_to_prepared(', ', data)
-            binds = list(data.values())
+        if self._memcache_key is not None:
+            return self.query(sql, binds)[:count]
+
+        started = time.time()
 
+        sql = self._limit(sql, count)
+
+        self.__use_group(self._route(self._is_read(sql)))
         self.connect()
 
-        cursor = self.__get_cursor()
+        # A named cursor would cost a round trip each to declare and close
+        # it; the result is bounded by the limit when auto limiting is on.
+        cursor = \
+            self.__postgresql.cursor(
+                cursor_factory=psycopg2.extras.RealDictCursor
+            )
 
-        cursor.execute(sql, binds)
+        try:
+            self.__execute(cursor, sql, binds)
 
-        self.__row_count = cursor.rowcount
+            records = cursor.fetchmany(count)
+        finally:
+            cursor.close()
 
-        self.memcache_purge()
+        self.__row_count = len(records)
 
-        self.__close_cursor()
-        self._reset_memcache()
+        self._record_statement('query', sql, started, len(records), records)
 
-        return True
+        return records
 
     def __format_query_execution_error(self, sql, message, binds=tuple()):
         return ('execution of this query:\n\n'
@@ -204,116 +454,314 @@ class PostgreSQL(RDBMSBase):
                 + '\n\nproduced this error:\n\n'
                 + message)
 
-    def __get_binds(self, data=tuple()):
-        if len(data) == 0:
-            return tuple()
-
-        binds = []
-        for value in list(data.values()):
-            str_value = str(value)
+    def __get_active_group(self):
+        if self.__active_group is None:
+            return self._group
 
-            if re.match('current_timestamp', str_value) is not None or \
-               str_value == 'current_date':
-                binds.append(value)
-            else:
-                binds.append('%s')
-
-        return binds
+        return self.__active_group
 
     def __get_cursor(self):
         if self.__cursor is not None:
             return self.__cursor
 
-        self.__cursor = \
-            self.__postgresql.cursor(
-                cursor_factory=psycopg2.extras.RealDictCursor
-            )
+        if self._result_mode is not None:
+            self.__cursor = self.__postgresql.cursor()
+        else:
+            self.__cursor = \
+                self.__postgresql.cursor(
+                    cursor_factory=psycopg2.extras.RealDictCursor
+                )
 
         return self.__cursor
 
     def get_last_row_id(self):
         return self.__last_row_id
 
+    def __get_open_connections(self):
+        connections = []
+        if self.__postgresql:
+            connections.append(self.__postgresql)
+
+        for connection, prepared_names in \
+            self.__inactive_connections.values():
+            if connection:
+                connections.append(connection)
+
+        return connections
+
     def get_row_count(self):
         return self.__row_count
 
-    def __get_values(self, data=tuple()):
-        if len(data) == 0:
-            return tuple()
+    def __insert_many(self, kind, target, rows, chunk_size, clause=None):
+        self.__use_group(self._route(False))
+        self.connect()
 
-        values = []
-        for value in data:
-            str_value = str(value)
+        row_count = 0
+        for keys, chunk in \
+            self._chunk_rows(rows, chunk_size, _MAX_INSERT_BYTES):
+            row_binds = []
+            vals = []
+            for row in chunk:
+                binds, values = \
+                    self._get_binds_and_values([row[key] for key in keys])
 
-            if re.match('current_timestamp', str_value) is None and \
-               str_value != 'current_date':
-                values.append(value)
+                template_key = ('values', tuple(binds))
+                row_bind = self._template_cache.get(template_key)
+                if row_bind is None:
+                    row_bind = \
+                        self._template_cache.put(
+                            template_key, '(' + ', '.join(binds) + ')'
+                        )
 
-        return values
+                row_binds.append(row_bind)
+                vals.extend(values)
 
-    def nth(self, index, sql, binds=tuple()):
-        records = self.query(sql, binds)
+            sql  = 'insert into ' + target + '('
+            sql += ', '.join(keys)
+            sql += ') values '
+            sql += ', '.join(row_binds)
+            if clause is not None:
+                sql += ' ' + clause(keys)
 
-        if index < len(records):
-            return records[index]
-        else:
-            return None
+            self._mark_busy()
+
+            started = time.time()
+
+            cursor = self.__get_cursor()
+
+            self.__execute(cursor, sql, vals)
+
+            self._record_statement(kind, sql, started, cursor.rowcount)
+
+            self._invalidate_tables(self._write_tables(sql))
+
+            row_count += cursor.rowcount
+
+            self.__close_cursor()
+
+        self.__row_count = row_count
+
+        # cursor.lastrowid is the OID of the inserted row, not its key.
+        return (None, row_count)
+
+    def _is_retryable(self, error):
+        return isinstance(error, psycopg2.Error) and \
+               error.pgcode in ('40001', '40P01')
+
+    def __ping(self, connection):
+        '''
+        Make sure the connection still works without ending a transaction
+        the caller has open.
+        '''
+
+        status = connection.get_transaction_status()
+        if status not in (psycopg2.extensions.TRANSACTION_STATUS_IDLE,
+                          psycopg2.extensions.TRANSACTION_STATUS_INTRANS):
+            # A failed transaction rejects every statement and the caller has
+            # to roll it back anyway.
+            return
+
+        cursor = connection.cursor()
+        try:
+            cursor.execute('select 1')
+        finally:
+            cursor.close()
+
+        if status == psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            # The select began a transaction of its own.
+            connection.rollback()
 
     def query(self, sql, binds=tuple()):
-        results_from_cache = self.memcache_retrieve()
-        if results_from_cache is not None:
-            self._reset_memcache()
-            return results_from_cache
+        started = time.time()
+
+        cache_hit = None
+        if self._memcache_key is not None:
+            results_from_cache = self.memcache_retrieve(sql)
+            if results_from_cache is not None:
+                self._reset_memcache()
+                self._result_mode = None
+                self._record_statement(
+                    'query', sql, started, None, results_from_cache, True
+                )
+                return results_from_cache
+
+            cache_hit = False
 
+        self.__use_group(self._route(self._is_read(sql)))
         self.connect()
 
-        is_select = False
-        if re.match('^\(?select ', sql) or re.match('^show ', sql):
-            is_select = True
+        is_select = self._is_select(sql)
 
         cursor = self.__get_cursor()
 
-        try:
-            cursor.execute(sql, binds)
-        except psycopg2.IntegrityError as e:
-            if e.pgcode == '23505':
-                raise DataStoreDuplicateKeyException(e.pgerror)
-            elif e.pgcode == '23503':
-                raise DataStoreForeignKeyException(e.pgerror)
-            else:
-                raise
-        except psycopg2.ProgrammingError as e:
-            raise \
-                DataStoreException(
-                    self.__format_query_execution_error(
-                        sql, e.pgerror, binds
-                    )
-                )
+        self.__execute(cursor, sql, binds)
 
         self.__row_count = cursor.rowcount
         self.__last_row_id = cursor.lastrowid
 
         if is_select:
             results = cursor.fetchall()
-            if results == ():
+            if self._result_mode is not None:
+                results = \
+                    self._shape_results(cursor.description, results)
+            elif results == ():
                 results = []
 
-            self.memcache_store(results)
+            results = self.memcache_store(results)
+
+            self._record_statement(
+                'query', sql, started, self.__row_count, results, cache_hit
+            )
         else:
             results = True
 
+            self._record_statement(
+                'query', sql, started, self.__row_count, None, cache_hit
+            )
+
+            self._invalidate_tables(self._write_tables(sql))
+
         self.__close_cursor()
         self._reset_memcache()
+        self._result_mode = None
 
         return results
 
     def rollback(self, ignore_exceptions=False):
-        if self.__postgresql is None:
-            if not ignore_exceptions:
-                raise DataStoreException(
-                    'transaction cannot be rolled back because a database '
-                    + 'connection has not been established yet'
+        self._mark_busy()
+
+        try:
+            connections = self.__get_open_connections()
+            if len(connections) == 0:
+                if not ignore_exceptions:
+                    raise DataStoreException(
+                        'transaction cannot be rolled back because a database '
+                        + 'connection has not been established yet'
+                    )
+            else:
+                if self.__postgresql:
+                    self.connect()
+
+                for connection in connections:
+                    connection.rollback()
+
+                self._in_transaction = False
+                self._invalidate_written(False)
+        finally:
+            self._mark_idle()
+
+    def update_many(self, target, rows=tuple(), key_cols=tuple(),
+                    chunk_size=1000):
+        self.__use_group(self._route(False))
+        self.connect()
+
+        row_count = 0
+        for keys, chunk in self._chunk_rows(rows, chunk_size):
+            sql, vals = \
+                self._render_update_many(target, keys, key_cols, chunk)
+
+            row_count += self.__execute_write('update', sql, vals)
+
+        self.__row_count = row_count
+
+        return row_count
+
+    def upsert_many(self, target, rows=tuple(), conflict_cols=tuple(),
+                    update_cols=None, chunk_size=1000):
+        first_id, row_count = \
+            self.__insert_many(
+                'upsert', target, rows, chunk_size,
+                lambda keys: self.__upsert_clause(
+                    keys, conflict_cols, update_cols
                 )
-        else:
-            self.connect()
-            self.__postgresql.rollback()
+            )
+
+        return row_count
+
+    def __upsert_clause(self, keys, conflict_cols, update_cols):
+        update_cols = self._upsert_columns(keys, conflict_cols, update_cols)
+
+        clause = 'on conflict (' + ', '.join(conflict_cols) + ') do '
+        if len(update_cols) == 0:
+            return clause + 'nothing'
+
+        return \
+            clause + 'update set ' \
+            + ', '.join(col + ' = excluded.' + col for col in update_cols)
+
+    def __use_group(self, group):
+        active_group = self.__get_active_group()
+        if group == active_group:
+            return
+
+        self.__close_cursor()
+
+        self.__inactive_connections[active_group] = \
+            (self.__postgresql, self.__prepared_names)
+
+        self.__postgresql, self.__prepared_names = \
+            self.__inactive_connections.pop(group, (None, {}))
+        self.__active_group = group
+
+    def stream(self, sql, binds=tuple(), batch_size=1000):
+        self._result_mode = None
+
+        if self._memcache_key is not None:
+            self._reset_memcache()
+            raise DataStoreException(
+                'the results of a streamed query cannot be cached'
+            )
+
+        return self.__stream(sql, binds, batch_size)
+
+    def __stream(self, sql, binds, batch_size):
+        started = time.time()
+
+        self.__use_group(self._route(self._is_read(sql)))
+        self.connect()
+
+        cursor = \
+            self.__postgresql.cursor(
+                'tinyapi_stream_{}'.format(next(_stream_ids)),
+                cursor_factory=psycopg2.extras.RealDictCursor
+            )
+        cursor.itersize = batch_size
+
+        row_count = 0
+        try:
+            self.__execute(cursor, sql, binds)
+
+            for record in cursor:
+                row_count += 1
+                yield record
+        finally:
+            cursor.close()
+
+            # Recorded once the stream ends so that the handle stays busy
+            # while records are still being read.
+            self._record_statement('query', sql, started, row_count)
+
+    def _validate_connections(self):
+        active_group = self.__get_active_group()
+
+        groups = [active_group] + list(self.__inactive_connections.keys())
+        for group in groups:
+            self.__use_group(group)
+
+            if self.__postgresql:
+                try:
+                    self.__ping(self.__postgresql)
+                except Exception:
+                    try:
+                        self.__postgresql.close()
+                    except Exception:
+                        pass
+
+                    self.__postgresql = None
+                    try:
+                        self.__connect()
+                    except Exception:
+                        # The next request will connect and fail over.
+                        pass
+
+        self.__use_group(active_group)
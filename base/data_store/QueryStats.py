@@ -0,0 +1,253 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .TemplateCache import TemplateCache
+from tinyAPI.base.config import ConfigManager
+from tinyAPI.base.stats_logger import StatsLogger
+
+import math
+import re
+import threading
+
+# ----- Private Data ----------------------------------------------------------
+
+_BUCKET_BASE = 0.0001
+_BUCKET_COUNT = 80
+_BUCKET_GROWTH = 1.2
+_NUMBER_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST_PATTERN = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_REPEATED_LIST_PATTERN = re.compile(r'\(\?\+\)(?:\s*,\s*\(\?\+\))+')
+_STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# ----- Private Functions -----------------------------------------------------
+
+def _bucket(elapsed):
+    if elapsed <= _BUCKET_BASE:
+        return 0
+
+    return min(
+        int(math.log(elapsed / _BUCKET_BASE, _BUCKET_GROWTH)) + 1,
+        _BUCKET_COUNT - 1
+    )
+
+
+def _bucket_upper_bound(index):
+    return _BUCKET_BASE * (_BUCKET_GROWTH ** index)
+
+# ----- Public Classes --------------------------------------------------------
+
+class QueryStats(object):
+    '''
+    Records the wall time, rows, bytes and cache usage of every statement
+    executed by a data store handle.  Timings are kept in a histogram per SQL
+    fingerprint so that percentiles can be reported without keeping every
+    sample.
+    '''
+
+    def __init__(self, max_fingerprints=1000):
+        self.max_fingerprints = max_fingerprints
+
+        self.__counters = {}
+        self.__fingerprints = TemplateCache(max_fingerprints)
+        self.__hooks = []
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def add_hook(self, hook):
+        '''
+        Register a callable that receives the dictionary describing each
+        statement as it is recorded.
+        '''
+
+        with self.__lock:
+            self.__hooks = self.__hooks + [hook]
+
+    def count(self, name, amount=1):
+        '''
+        Add amount to the named counter, like the number of transactions
+        retried after a deadlock.
+        '''
+
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + amount
+
+    def counters(self):
+        '''
+        Return the current value of every named counter.
+        '''
+
+        with self.__lock:
+            return dict(self.__counters)
+
+    def __get_stats(self, kind, sql):
+        key = self.__fingerprints.get(sql)
+        if key is None:
+            key = self.__fingerprints.put(sql, fingerprint(sql))
+
+        stats = self.__stats.get(key)
+        if stats is None:
+            if len(self.__stats) >= self.max_fingerprints:
+                key = '[other]'
+                stats = self.__stats.get(key)
+
+            if stats is None:
+                stats = {
+                    'buckets': [0] * _BUCKET_COUNT,
+                    'bytes': 0,
+                    'cache hits': 0,
+                    'cache misses': 0,
+                    'count': 0,
+                    'kind': kind,
+                    'max time': 0,
+                    'rows': 0,
+                    'total time': 0,
+                    'warnings': {}
+                }
+                self.__stats[key] = stats
+
+        return key, stats
+
+    def __percentile(self, buckets, count, percentile):
+        if count == 0:
+            return None
+
+        target = math.ceil(count * percentile)
+
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= target:
+                return _bucket_upper_bound(index)
+
+        return None
+
+    def record(self, kind, sql, elapsed, rows=None, size=None,
+               cache_hit=None):
+        '''
+        Record a single executed statement and write it to the slow query log
+        if it took longer than the "slow query threshold".
+        '''
+
+        with self.__lock:
+            key, stats = self.__get_stats(kind, sql)
+
+            stats['buckets'][_bucket(elapsed)] += 1
+            stats['count'] += 1
+            stats['total time'] += elapsed
+            if elapsed > stats['max time']:
+                stats['max time'] = elapsed
+            if rows is not None:
+                stats['rows'] += rows
+            if size is not None:
+                stats['bytes'] += size
+            if cache_hit is True:
+                stats['cache hits'] += 1
+            elif cache_hit is False:
+                stats['cache misses'] += 1
+
+            hooks = self.__hooks
+
+        threshold = ConfigManager.value('slow query threshold', None)
+        if threshold is not None and elapsed >= threshold:
+            StatsLogger().slow_query(sql, elapsed, rows)
+
+        if len(hooks) > 0:
+            record = {
+                'bytes': size,
+                'cache hit': cache_hit,
+                'elapsed': elapsed,
+                'fingerprint': key,
+                'kind': kind,
+                'rows': rows,
+                'sql': sql
+            }
+
+            for hook in hooks:
+                hook(record)
+
+    def remove_hook(self, hook):
+        '''
+        Unregister a callable previously passed to add_hook.
+        '''
+
+        with self.__lock:
+            self.__hooks = [item for item in self.__hooks if item != hook]
+
+    def reset(self):
+        with self.__lock:
+            self.__counters = {}
+            self.__fingerprints.clear()
+            self.__stats = {}
+
+    def snapshot(self, top=10, order_by='total time'):
+        '''
+        Return the statistics for the top most expensive fingerprints sorted
+        in descending order by order_by.
+        '''
+
+        with self.__lock:
+            stats = [(key,
+                      dict(value,
+                           buckets=list(value['buckets']),
+                           warnings=dict(value['warnings'])))
+                     for key, value in self.__stats.items()]
+
+        results = []
+        for key, value in stats:
+            buckets = value.pop('buckets')
+
+            value['fingerprint'] = key
+            value['avg time'] = \
+                value['total time'] / value['count'] \
+                    if value['count'] > 0 else 0
+            value['p50'] = self.__percentile(buckets, value['count'], 0.50)
+            value['p95'] = self.__percentile(buckets, value['count'], 0.95)
+            value['p99'] = self.__percentile(buckets, value['count'], 0.99)
+
+            results.append(value)
+
+        results.sort(key=lambda value: value[order_by], reverse=True)
+
+        return results[:top]
+
+    def warn(self, sql, warning):
+        '''
+        Count a warning, like one() being used on a query that returns many
+        records, against the fingerprint of the SQL.
+        '''
+
+        with self.__lock:
+            key, stats = self.__get_stats('query', sql)
+
+            stats['warnings'][warning] = stats['warnings'].get(warning, 0) + 1
+
+# ----- Process Data ----------------------------------------------------------
+
+_query_stats = QueryStats()
+
+# ----- Public Functions ------------------------------------------------------
+
+def fingerprint(sql):
+    '''
+    Normalize SQL so that queries differing only in their literal values,
+    placeholders or the length of their value lists share a fingerprint.
+    '''
+
+    sql = _STRING_PATTERN.sub('?', sql)
+    sql = _NUMBER_PATTERN.sub('?', sql.replace('%s', '?'))
+    sql = _WHITESPACE_PATTERN.sub(' ', sql).strip().lower()
+    sql = _PLACEHOLDER_LIST_PATTERN.sub('(?+)', sql)
+
+    return _REPEATED_LIST_PATTERN.sub('(?+)+', sql)
+
+
+def query_stats():
+    '''
+    Return the query statistics shared by every handle in this process.
+    '''
+
+    return _query_stats
@@ -4,12 +4,222 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 
 # ----- Imports ---------------------------------------------------------------
 
+from .Durability import CircuitBreaker
+from .Durability import LatencyAware
+from .Durability import LeastOutstanding
+from .Durability import WeightedRandom
 from .exception import DataStoreException
+from .FallBack import FallBack
+from .QueryStats import query_stats
+from .Randomizer import Randomizer
+from .Rows import Rows
+from .SingleFlight import should_refresh
+from .SingleFlight import single_flight
+from .SQLLiteral import literal_sql
+from .TemplateCache import TemplateCache
+from .Transaction import Transaction
+from tinyAPI.base.config import ConfigManager
+from tinyAPI.base.data_store.memcache import CacheEntry
+from tinyAPI.base.data_store.memcache import freeze
 from tinyAPI.base.data_store.memcache import Memcache
+from tinyAPI.base.data_store.memcache import thaw
 
+import array
+import concurrent.futures
+import contextvars
+import os
+import re
+import threading
 import time
 import tinyAPI.base.context as Context
 
+# ----- Private Data ----------------------------------------------------------
+
+_BULK_LOAD_ESCAPES = {
+    b'\\': b'\\\\',
+    b'\n': b'\\n',
+    b'\r': b'\\r',
+    b'\t': b'\\t'
+}
+_BULK_LOAD_SPECIAL_PATTERN = re.compile(rb'[\\\n\r\t]')
+_DURABILITY = {
+    'circuit breaker': CircuitBreaker,
+    'fall back': FallBack,
+    'latency aware': LatencyAware,
+    'least outstanding': LeastOutstanding,
+    'randomizer': Randomizer,
+    'weighted random': WeightedRandom
+}
+
+# Words that can follow a table name and so cannot be mistaken for its alias
+# or for another table.
+_KEYWORDS = \
+    r'(?:and|as|cross|do|for|force|from|full|group|having|ignore|inner|into|' \
+    + r'join|lateral|left|limit|lock|natural|not|on|or|order|outer|' \
+    + r'partition|returning|right|select|set|straight_join|table|union|' \
+    + r'update|use|using|values?|where|window|with)\b'
+_TABLE = r'(?!' + _KEYWORDS + r')[`"\w.$]+'
+_TABLE_LIST = \
+    _TABLE + r'(?:\s+(?:as\s+)?(?!' + _KEYWORDS + r')\w+)?' \
+    + r'(?:\s*,\s*' + _TABLE + r'(?:\s+(?:as\s+)?(?!' + _KEYWORDS \
+    + r')\w+)?)*'
+
+# Tagged results are also tagged with this so that a write whose tables
+# cannot be determined invalidates all of them.
+_ALL_TABLES = '*'
+
+_LOCKING_READ_PATTERN = \
+    re.compile(
+        r'\sfor\s+update\b|\slock\s+in\s+share\s+mode\b|\sfor\s+share\b',
+        re.IGNORECASE
+    )
+_NON_WRITE_PATTERN = \
+    re.compile(
+        r'\s*\(?\s*(?:select|show|set|begin|start|commit|rollback|savepoint|'
+        + r'release|lock|unlock|use|describe|desc|explain)\b',
+        re.IGNORECASE
+    )
+_READ_TABLES_PATTERN = \
+    re.compile(r'\b(?:from|join)\s+(' + _TABLE_LIST + ')', re.IGNORECASE)
+_REFERENCED_TABLES_PATTERN = \
+    re.compile(
+        r'\b(?:copy|from|join|using|(?<!key )(?<!do )update|into|table)\s+('
+        + _TABLE_LIST + ')',
+        re.IGNORECASE
+    )
+_SELECT_PATTERN = re.compile(r'\(?select |show ')
+_UNLIMITABLE_PATTERN = \
+    re.compile(
+        r';|\blimit\b|\boffset\b|\bfetch\b|\binto\b|\bfor\s+update\b|'
+        + r'\block\s+in\s+share\s+mode\b|\bfor\s+share\b',
+        re.IGNORECASE
+    )
+_WRITE_TABLE_PATTERN = \
+    re.compile(
+        r'\s*(?:(?:insert|replace)(?:\s+(?:low_priority|delayed|'
+        + r'high_priority|ignore))*(?:\s+into)?|update(?:\s+(?:low_priority|'
+        + r'ignore|only))*|delete(?:\s+(?:low_priority|quick|ignore))*\s+from'
+        + r'(?:\s+only)?|truncate(?:\s+table)?)\s+([`"\w.]+)',
+        re.IGNORECASE
+    )
+
+# ----- Process Data ----------------------------------------------------------
+
+_executor = None
+_executor_lock = threading.Lock()
+_executor_pid = None
+_warm_templates = None
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    global _executor, _executor_lock
+
+    # The executor's threads were not copied into this process and its lock
+    # may have been held by one of them.
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+def _bulk_load_escape(data):
+    '''
+    Escape the characters that delimit fields and lines in a bulk load.
+    '''
+
+    return _BULK_LOAD_SPECIAL_PATTERN.sub(
+        lambda match: _BULK_LOAD_ESCAPES[match.group()], data
+    )
+
+
+def _estimate_results_size(results):
+    if isinstance(results, Rows):
+        results = results.records
+    elif isinstance(results, dict):
+        results = results.values()
+
+    size = 0
+    for result in results:
+        if isinstance(result, array.array):
+            size += result.itemsize * len(result)
+        else:
+            for value in \
+                result.values() if hasattr(result, 'values') else result:
+                size += _estimate_size(value)
+
+    return size
+
+
+def _estimate_size(value):
+    # Worst case: every byte is escaped by the driver, which doubles it.
+    if isinstance(value, str):
+        if value.isascii():
+            return (len(value) * 2) + 2
+        return (len(value.encode('utf-8')) * 2) + 2
+    elif isinstance(value, (bytes, bytearray)):
+        return (len(value) * 2) + 10
+    elif value is None:
+        return 4
+    else:
+        return 24
+
+
+def _get_executor():
+    global _executor, _executor_pid
+
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = \
+                concurrent.futures.ThreadPoolExecutor(
+                    32, 'tinyapi-gather'
+                )
+            _executor_pid = os.getpid()
+
+        return _executor
+
+
+def _key_condition(key_cols, key_binds):
+    '''
+    Render a condition matching any of the rows whose key columns are bound
+    by key_binds.
+    '''
+
+    if len(key_cols) == 1:
+        return \
+            key_cols[0] + ' in (' \
+            + ', '.join(binds[0] for binds in key_binds) + ')'
+
+    return \
+        '(' + ', '.join(key_cols) + ') in (' \
+        + ', '.join('(' + ', '.join(binds) + ')' for binds in key_binds) \
+        + ')'
+
+
+def _table_lists(pattern, sql):
+    '''
+    Return every table named in the comma separated lists matched by pattern.
+    '''
+
+    names = []
+    for table_list in pattern.findall(sql):
+        names.extend(item.split()[0] for item in table_list.split(','))
+
+    return names
+
+
+def _table_names(names):
+    '''
+    Normalize table names into Memcache tags by dropping quoting and the
+    schema so that every way of naming a table invalidates the same tag.
+    '''
+
+    tables = []
+    for name in names:
+        name = name.replace('`', '').replace('"', '').lower().split('.')[-1]
+        if name != '' and name not in tables:
+            tables.append(name)
+
+    return tuple(tables)
+
 # ----- Private Classes -------------------------------------------------------
 
 class __DataStoreBase(object):
@@ -25,10 +235,32 @@ class __DataStoreBase(object):
         self._charset = 'utf8'
         self._memcache = None
         self._memcache_key = None
+        self._memcache_read_only = False
         self._memcache_ttl = None
+        self._memcache_tags = None
+        self._memcache_generations = None
+        self._memcache_single_flight = False
+        self._memcache_early_refresh = None
+        self._memcache_started = None
+        self._memcache_flight = None
+        self._memcache_lease = False
+        self._memcache_can_wait = True
+        self._written_tables = set()
         self._ping_interval = 300
         self._inactive_since = time.time()
+        self._busy = False
+        self._busy_lock = threading.Lock()
         self._ordered_dict_cursor = False
+        self._prepared_statements = False
+        self._auto_limit = False
+        self._result_mode = None
+        self._template_cache = \
+            TemplateCache() if _warm_templates is None else \
+            _warm_templates.copy()
+        self._routing = None
+        self._in_transaction = False
+        self._last_write = None
+        self._transaction_depth = 0
 
         self.persistent = True
         if Context.env_cli() is True:
@@ -42,6 +274,139 @@ class RDBMSBase(__DataStoreBase):
     PostgreSQL, etc.).
     '''
 
+    def auto_limit(self, enabled=True):
+        '''
+        Add a limit to simple selects passed to nth(), one() and count() so
+        that the server stops producing records once enough are available.
+        '''
+
+        self._auto_limit = enabled
+        return self
+
+    def bulk_load(self, target, rows=tuple(), columns=tuple()):
+        '''
+        Load rows, each a dict or a sequence of values in the order of the
+        columns, using the data store's native bulk loading.  The rows are
+        streamed to the server as they are produced.  Returns a tuple
+        containing the number of rows loaded and the rows loaded per second.
+        '''
+
+        return (0, 0.0)
+
+    def _bulk_load_binary(self, value):
+        '''
+        Render a binary value for a bulk load.
+        '''
+
+        return _bulk_load_escape(value)
+
+    def _bulk_load_field(self, value):
+        '''
+        Render a value for a bulk load.
+        '''
+
+        if value is None:
+            return b'\\N'
+
+        value_type = type(value)
+        if value_type is int or value_type is float:
+            return str(value).encode('ascii')
+        elif value_type is bool:
+            return b'1' if value else b'0'
+        elif isinstance(value, (bytes, bytearray, memoryview)):
+            return self._bulk_load_binary(bytes(value))
+        else:
+            return _bulk_load_escape(str(value).encode('utf-8'))
+
+    def _bulk_load_line(self, row, columns):
+        '''
+        Render a row as a line of tab separated values in the text format
+        shared by MySQL's LOAD DATA and PostgreSQL's COPY.
+        '''
+
+        if isinstance(row, dict):
+            row = [row[column] for column in columns]
+        elif len(row) != len(columns):
+            raise DataStoreException(
+                'expected {} values to load but received {}'
+                    .format(len(columns), len(row))
+            )
+
+        field = self._bulk_load_field
+        return b'\t'.join([field(value) for value in row]) + b'\n'
+
+    def _bulk_load_lines(self, rows, columns):
+        '''
+        Return a generator rendering each of the rows as it is needed.
+        '''
+
+        if len(columns) == 0:
+            raise DataStoreException('the columns to load must be provided')
+
+        return (self._bulk_load_line(row, columns) for row in rows)
+
+    def _check_settings(self, settings, group):
+        '''
+        Make sure that the group and any groups named by the routing settings
+        are configured.
+        '''
+
+        if group not in settings:
+            raise DataStoreException(
+                'group "{}" not found in settings'
+                    .format(group)
+            )
+
+        routing = settings.get('routing')
+        if routing is not None:
+            for route in ('read', 'write'):
+                if routing.get(route) not in settings:
+                    raise DataStoreException(
+                        '{} group "{}" not found in settings'
+                            .format(route, routing.get(route))
+                    )
+
+    def _chunk_rows(self, rows, chunk_size, max_bytes=None):
+        '''
+        Split rows into lists of at most chunk_size rows whose estimated
+        rendered size stays under max_bytes.  Every row must contain the same
+        columns as the first; the column list is yielded with each chunk.
+        '''
+
+        keys = None
+        chunk = []
+        chunk_bytes = 0
+        for row in rows:
+            if keys is None:
+                keys = list(row.keys())
+                key_set = set(keys)
+                row_overhead = (2 * len(keys)) + 4
+                base_bytes = sum(len(key) + 2 for key in keys) + 64
+            elif len(row) != len(keys) or set(row.keys()) != key_set:
+                raise DataStoreException(
+                    'every row must contain the same columns as the first '
+                    + 'row ({})'.format(', '.join(keys))
+                )
+
+            row_bytes = row_overhead
+            if max_bytes is not None:
+                for value in row.values():
+                    row_bytes += _estimate_size(value)
+
+            if len(chunk) > 0 and \
+               (len(chunk) >= chunk_size or
+                (max_bytes is not None and
+                 base_bytes + chunk_bytes + row_bytes > max_bytes)):
+                yield keys, chunk
+                chunk = []
+                chunk_bytes = 0
+
+            chunk.append(row)
+            chunk_bytes += row_bytes
+
+        if len(chunk) > 0:
+            yield keys, chunk
+
     def close(self):
         '''
         Manually close the database connection.
@@ -61,17 +426,14 @@ class RDBMSBase(__DataStoreBase):
         Configure the connection settings.
         '''
 
-        if group not in settings:
-            raise DataStoreException(
-                'group "{}" not found in settings'
-                    .format(group)
-            )
+        self._check_settings(settings, group)
 
         self.close()
 
         self._settings = settings
         self._db = db
         self._group = group
+        self._routing = settings.get('routing')
         return self
 
     def count(self, sql, binds=tuple()):
@@ -79,7 +441,11 @@ class RDBMSBase(__DataStoreBase):
         Given a count(*) query, only return the resultant count.
         '''
 
-        return None
+        record = self.nth(0, sql, binds)
+        if record is None:
+            return None
+
+        return list(record.values())[0]
 
     def create(target, data=tuple(), return_insert_id=False):
         '''
@@ -88,6 +454,16 @@ class RDBMSBase(__DataStoreBase):
 
         return '' if return_insert_id else None
 
+    def create_many(self, target, rows=tuple(), chunk_size=1000,
+                    return_insert_id=True):
+        '''
+        Create many records in the RDBMS using multi-row inserts.  Returns a
+        tuple containing the first insert ID and the number of rows created.
+        PostgreSQL does not report insert IDs so the first is always None.
+        '''
+
+        return (None, 0)
+
     def delete(target, where=tuple(), binds=tuple()):
         '''
         Delete a record from the RDBMS.
@@ -95,15 +471,381 @@ class RDBMSBase(__DataStoreBase):
 
         return False
 
-    def memcache(self, key, ttl=0):
+    def delete_many(self, target, rows=tuple(), chunk_size=1000):
         '''
-        Specify that the result set should be cached in Memcache.
+        Delete the records identified by rows, each a dict of the same key
+        columns, using one statement per chunk of rows.  Returns the number
+        of records deleted.
         '''
 
+        return 0
+
+    def _fetch_rows(self, sql, binds, count):
+        '''
+        Return at most count records from the result set without fetching
+        the rest of it.
+        '''
+
+        return []
+
+    def gather(self, queries):
+        '''
+        Run independent queries and return their results in order.  Each
+        query is a tuple of SQL and binds optionally followed by the
+        arguments to memcache().  Cached results are served with a single
+        request to Memcache and, when the remaining queries are all reads
+        outside of a transaction on a pooled group, they are run concurrently:
+        the first on this handle and as many of the others as the pool has
+        free connections for on those connections.  The rest are run one at
+        a time on this handle.
+        '''
+
+        results, pending, states = self._gather_from_cache(queries)
+
+        group = None
+        capacity = 0
+
+        # Other connections cannot see what this handle has not committed.
+        if len(pending) > 1 and self._in_transaction is False and \
+           self._transaction_depth == 0 and \
+           all(self._is_read(queries[index][0]) for index in pending):
+            group = self._route(True)
+            capacity = self._gather_capacity(group)
+
+        # Queries the pool has no free connection for run on this handle
+        # rather than waiting for a connection while it holds one itself.
+        remote = pending[1:capacity + 1]
+
+        # Each query runs in a copy of the caller's context so that it is
+        # attributed to the caller's request (see Middleware.py).
+        futures = [
+            _get_executor().submit(
+                contextvars.copy_context().run,
+                self._gather_query, group, queries[index][0], queries[index][1]
+            )
+            for index in remote
+        ]
+
+        try:
+            for index in pending:
+                if index not in remote:
+                    query = queries[index]
+                    results[index] = \
+                        self._gather_store(
+                            query,
+                            self.query(query[0], query[1]),
+                            states.get(index)
+                        )
+        finally:
+            concurrent.futures.wait(futures)
+
+        for index, future in zip(remote, futures):
+            results[index] = \
+                self._gather_store(
+                    queries[index], future.result(), states.get(index)
+                )
+
+        return results
+
+    def _gather_capacity(self, group):
+        '''
+        Return the number of gather() queries for the group that can run
+        concurrently on connections other than the one held by this handle
+        without waiting for one to be freed.
+        '''
+
+        return 0
+
+    def _gather_from_cache(self, queries):
+        '''
+        Return the results of the gather() queries that are cached, the
+        indexes of the queries that are not and, for those that were retrieved
+        individually, the Memcache state needed to store their results.
+        Plain keys are retrieved with a single request to Memcache.
+        '''
+
+        results = [None] * len(queries)
+
+        # Read only results are frozen rather than copied, as they are when
+        # they are retrieved on their own.
+        keys = ([], [])
+        for query in queries:
+            if len(query) > 2 and not self.__retrieve_individually(query):
+                keys[len(query) > 4 and query[4] is True].append(query[2])
+
+        cached = {}
+        for read_only in (False, True):
+            if len(keys[read_only]) > 0:
+                cached.update(self.memcache_many(keys[read_only], read_only))
+
+        pending = []
+        states = {}
+        for index, query in enumerate(queries):
+            if len(query) > 2 and query[2] in cached:
+                results[index] = cached[query[2]]
+                continue
+
+            if self.__retrieve_individually(query):
+                self.memcache(*query[2:])
+                results[index] = self.memcache_retrieve(query[0])
+                states[index] = self.__take_memcache_state()
+                self._reset_memcache()
+
+                if results[index] is not None:
+                    continue
+
+            pending.append(index)
+
+        return results, pending, states
+
+    def _gather_query(self, group, sql, binds):
+        '''
+        Run a read only query for gather() on a connection that is not held by
+        this handle and return its results.
+        '''
+
+        raise NotImplementedError
+
+    def _gather_store(self, query, records, state=None):
+        '''
+        Cache the records a gather() query returned if it has a Memcache key
+        and return them as they should be handed to the caller.
+        '''
+
+        if len(query) <= 2:
+            return records
+
+        self.memcache(*query[2:])
+        if state is not None:
+            self._memcache_generations, self._memcache_started, \
+                self._memcache_flight, self._memcache_lease = state
+        records = self.memcache_store(records)
+        self._reset_memcache()
+
+        return records
+
+    def _get_binds_and_values(self, data=tuple()):
+        '''
+        Return the bind placeholders for the data along with the values that
+        must be bound to them.  SQL keywords like current_timestamp are
+        rendered in place of a placeholder; see literal_sql().
+        '''
+
+        binds = []
+        values = []
+        for value in data:
+            sql = literal_sql(value)
+            if sql is None:
+                binds.append('%s')
+                values.append(value)
+            else:
+                binds.append(sql)
+
+        return binds, values
+
+    @staticmethod
+    def _get_durability(settings):
+        '''
+        Build the durability algorithm configured for a group.  The
+        "durability" key is either the name of the algorithm or a dictionary
+        holding the name under "algorithm" along with its options.
+        '''
+
+        options = settings['durability']
+        if isinstance(options, dict):
+            algorithm = options.get('algorithm')
+        else:
+            algorithm = options
+            options = {}
+
+        if algorithm not in _DURABILITY:
+            raise DataStoreException(
+                'unrecognized durability algorithm "{}"'.format(algorithm)
+            )
+
+        return _DURABILITY[algorithm](settings['hosts'], options)
+
+    def _invalidate_tables(self, tables):
+        '''
+        Invalidate everything cached with tags for the tables a write touched
+        when "memcache tag invalidation" is enabled.  The tables are
+        invalidated again when the transaction commits so that results cached
+        by other handles before the write was visible to them are discarded.
+        '''
+
+        if len(tables) == 0 or Context.env_unit_test() or \
+           not ConfigManager.value('memcache tag invalidation', False):
+            return
+
+        self._written_tables.update(tables)
+
+        if self._memcache is None:
+            self._memcache = Memcache()
+        self._memcache.invalidate_tags(tables)
+
+    def _invalidate_written(self, committed):
+        '''
+        Invalidate the tables written during the transaction that just ended
+        if it was committed.
+        '''
+
+        tables = self._written_tables
+        self._written_tables = set()
+
+        if committed is True and len(tables) > 0:
+            if self._memcache is None:
+                self._memcache = Memcache()
+            self._memcache.invalidate_tags(sorted(tables))
+
+    def _is_read(self, sql):
+        '''
+        Determine whether the SQL only reads data and can therefore be sent
+        to a replica.  Locking reads must go to the write group.
+        '''
+
+        is_read = self._template_cache.get(('is read', sql))
+        if is_read is None:
+            is_read = \
+                self._template_cache.put(
+                    ('is read', sql),
+                    self._is_select(sql) and
+                    _LOCKING_READ_PATTERN.search(sql) is None
+                )
+
+        return is_read
+
+    def _is_retryable(self, error):
+        '''
+        Determine whether an error raised by the driver means that the
+        transaction was chosen as a deadlock victim or could not be
+        serialized and can succeed if it is run again.
+        '''
+
+        return False
+
+    def _is_select(self, sql):
+        '''
+        Determine whether the SQL returns a result set, caching the answer so
+        that the statement is only classified once.
+        '''
+
+        is_select = self._template_cache.get(('is select', sql))
+        if is_select is None:
+            is_select = \
+                self._template_cache.put(
+                    ('is select', sql),
+                    _SELECT_PATTERN.match(sql) is not None
+                )
+
+        return is_select
+
+    def keep_alive(self, idle_after):
+        '''
+        Validate the connections held by the handle if it is idle and has not
+        used them for idle_after seconds, replacing those that fail.  Called
+        by the keep-alive thread; returns False if the handle is in use.
+        '''
+
+        if not self._busy_lock.acquire(False):
+            return False
+
+        try:
+            if self._busy is True:
+                return False
+
+            if time.time() - self._inactive_since >= idle_after:
+                self._validate_connections()
+                self._inactive_since = time.time()
+        finally:
+            self._busy_lock.release()
+
+        return True
+
+    def _limit(self, sql, count):
+        '''
+        Return the SQL with a limit of count added if auto limiting is
+        enabled and the SQL is a select that can safely be limited.
+        '''
+
+        if self._auto_limit is False:
+            return sql
+
+        limited = self._template_cache.get(('limit', sql, count))
+        if limited is None:
+            limited = sql
+            if re.match(r'\s*select\b', sql, re.IGNORECASE) is not None and \
+               _UNLIMITABLE_PATTERN.search(sql) is None:
+                limited = sql.rstrip() + ' limit ' + str(count)
+
+            self._template_cache.put(('limit', sql, count), limited)
+
+        return limited
+
+    def _mark_busy(self):
+        '''
+        Mark the handle as in use so that the keep-alive thread leaves its
+        connections alone, waiting for a validation already under way to
+        finish.
+        '''
+
+        if self._busy is False:
+            with self._busy_lock:
+                self._busy = True
+
+    def _mark_idle(self):
+        self._busy = False
+
+    def memcache(self, key, ttl=0, read_only=False, tags=None,
+                 single_flight=False, early_refresh=None):
+        '''
+        Specify that the result set should be cached in Memcache.  If
+        read_only is True the result set is returned as a tuple of read only
+        mappings that is shared with the local cache instead of being copied
+        on every hit; modifying it raises a TypeError.
+
+        If tags is a list of table names, or True for the tables the query
+        reads, the result set is invalidated whenever any of those tables is
+        written through a data store handle (see "memcache tag invalidation")
+        so that a long TTL can be used safely.
+
+        If single_flight is True only one caller recomputes the result set
+        when it is missing or expired: threads in this process wait for it
+        and other processes are kept out by a lease in Memcache.  While it is
+        being recomputed everyone else is served the expired result set,
+        which is kept for "stale ttl" seconds past the TTL (see "memcache
+        single flight").  If early_refresh is a number greater than 0 the
+        result set is recomputed before it expires with a probability that
+        rises as expiry approaches; 1.0 is a good default.
+        '''
+
+        self._reset_memcache()
+
         self._memcache_key = key
         self._memcache_ttl = ttl
+        self._memcache_read_only = read_only
+        self._memcache_tags = tags
+        self._memcache_single_flight = single_flight
+        self._memcache_early_refresh = early_refresh
         return self
 
+    def memcache_many(self, keys, read_only=False):
+        '''
+        Retrieve the data cached at each of the keys with a single request to
+        Memcache and return the keys that were found.  The values are also
+        held in the local cache so that subsequent memcache(key) queries for
+        the same keys do not go back to the network.  If read_only is True
+        the values are returned frozen, as memcache(..., read_only=True)
+        returns them.
+        '''
+
+        if Context.env_unit_test():
+            return {}
+
+        if self._memcache is None:
+            self._memcache = Memcache()
+
+        return self._memcache.retrieve_multi(keys, read_only)
+
     def memcache_purge(self):
         '''
         If the data has been cached, purge it.
@@ -116,7 +858,7 @@ class RDBMSBase(__DataStoreBase):
             self._memcache = Memcache()
         self._memcache.purge(self._memcache_key)
 
-    def memcache_retrieve(self):
+    def memcache_retrieve(self, sql=None):
         '''
         If the data needs to be cached, cache it.
         '''
@@ -127,39 +869,104 @@ class RDBMSBase(__DataStoreBase):
         if self._memcache is None:
             self._memcache = Memcache()
 
-        return self._memcache.retrieve(self._memcache_key)
+        if self._memcache_single_flight is False and \
+           self._memcache_early_refresh is None:
+            return self.__retrieve_cached(sql)
+
+        return self.__retrieve_protected(sql)
 
     def memcache_store(self, data):
         '''
-        If there is data and it should be cached, cache it.
+        If there is data and it should be cached, cache it.  Returns the data
+        as it should be handed to the caller.
         '''
 
         if self._memcache_key is None or Context.env_unit_test():
-            return
+            if self._memcache_read_only is True:
+                return freeze(data)
+
+            return data
 
         if self._memcache is None:
             self._memcache = Memcache()
 
-        self._memcache.store(
-            self._memcache_key,
-            data,
-            self._memcache_ttl,
-            self._memcache_ttl
-        )
+        protected = self._memcache_single_flight is not False or \
+                    self._memcache_early_refresh is not None
+
+        ttl = self._memcache_ttl
+        if protected:
+            now = time.time()
+
+            data = \
+                CacheEntry(
+                    data,
+                    now + ttl if ttl > 0 else None,
+                    now - (self._memcache_started or now)
+                )
+            if ttl > 0:
+                ttl += \
+                    ConfigManager.value('memcache single flight', {}) \
+                        .get('stale ttl', 300)
+
+        if self._memcache_generations is not None:
+            data = \
+                self._memcache.store_tagged(
+                    self._memcache_key,
+                    data,
+                    self._memcache_generations,
+                    ttl,
+                    self._memcache_read_only
+                )
+        else:
+            data = \
+                self._memcache.store(
+                    self._memcache_key,
+                    data,
+                    ttl,
+                    self._memcache_ttl,
+                    self._memcache_read_only
+                )
+
+        if protected:
+            data = data.data
+
+            if self._memcache_flight is not None:
+                single_flight().finish(
+                    self._memcache_key, self._memcache_flight, data
+                )
+                self._memcache_flight = None
+
+            if self._memcache_lease is True:
+                self._memcache.release_lease(self._memcache_key)
+                self._memcache_lease = False
+
+        return data
 
     def nth(self, index, sql, binds=tuple()):
         '''
-        Return the value at the Nth position of the result set.
+        Return the value at the Nth position of the result set.  Only the
+        records up to and including the Nth are fetched.
         '''
 
-        return None
+        records = self._fetch_rows(sql, binds, index + 1)
+
+        if index < len(records):
+            return records[index]
+        else:
+            return None
 
     def one(self, sql, binds=tuple(), obj=None):
         '''
-        Return the first (and only the first) of the result set.
+        Return the first (and only the first) of the result set.  If more
+        than one record was available a warning is counted against the query
+        in the query statistics.
         '''
 
-        record = self.nth(0, sql, binds)
+        records = self._fetch_rows(sql, binds, 2)
+        if len(records) > 1:
+            query_stats().warn(sql, 'one() had more than one record')
+
+        record = records[0] if len(records) > 0 else None
         if obj is None:
             return record
 
@@ -175,6 +982,17 @@ class RDBMSBase(__DataStoreBase):
         self._ordered_dict_cursor = True
         return self
 
+    def prepared_statements(self, enabled=True):
+        '''
+        Execute the statements rendered by create and delete as server side
+        prepared statements.  Only honored by handles whose driver can
+        prepare statements on the server; others continue to bind on the
+        client using the cached SQL.
+        '''
+
+        self._prepared_statements = enabled
+        return self
+
     def query(self, query, binds = []):
         '''
         Execute an arbitrary query and return all of the results.
@@ -182,9 +1000,277 @@ class RDBMSBase(__DataStoreBase):
 
         return None
 
+    def _read_tables(self, sql):
+        '''
+        Return the tables a query reads from its from and join clauses.
+        '''
+
+        tables = self._template_cache.get(('read tables', sql))
+        if tables is None:
+            tables = \
+                self._template_cache.put(
+                    ('read tables', sql),
+                    _table_names(_table_lists(_READ_TABLES_PATTERN, sql))
+                )
+
+        return tables
+
+    def _record_bulk_load(self, target, sql, started, row_count):
+        '''
+        Record a bulk load into target and return the number of rows loaded
+        along with the rows loaded per second.
+        '''
+
+        elapsed = time.time() - started
+
+        self._record_statement('bulk load', sql, started, row_count)
+
+        self._invalidate_tables(_table_names([target]))
+
+        return (
+            row_count,
+            row_count / elapsed if elapsed > 0 else float(row_count)
+        )
+
+    def _record_statement(self, kind, sql, started, rows=None, results=None,
+                          cache_hit=None):
+        '''
+        Record the time taken since started to execute the SQL along with the
+        number of rows affected or returned and the estimated size of the
+        results.
+        '''
+
+        now = self._record_stats(kind, sql, started, rows, results, cache_hit)
+
+        # A connection that was just used does not need to be pinged.
+        if cache_hit is not True:
+            self._inactive_since = now
+
+        # The statement is complete, so the keep-alive thread may validate
+        # the handle's connections until the next one is routed.
+        self._mark_idle()
+
+    def _record_stats(self, kind, sql, started, rows=None, results=None,
+                      cache_hit=None):
+        '''
+        Record a statement in the query statistics without touching the state
+        of the handle, for statements run on connections it does not hold.
+        Returns the time the statement was recorded at.
+        '''
+
+        size = None
+        if results is not None:
+            size = _estimate_results_size(results)
+
+        now = time.time()
+
+        query_stats().record(kind, sql, now - started, rows, size, cache_hit)
+
+        return now
+
+    def _render_delete_many(self, target, keys, rows):
+        '''
+        Return the SQL and values that delete the records identified by rows.
+        '''
+
+        key_binds = []
+        values = []
+        for row in rows:
+            binds, row_values = \
+                self._get_binds_and_values([row[key] for key in keys])
+
+            key_binds.append(binds)
+            values.extend(row_values)
+
+        sql = \
+            'delete from ' + target + ' where ' \
+            + _key_condition(keys, key_binds)
+
+        return sql, values
+
+    def _render_update_many(self, target, keys, key_cols, rows):
+        '''
+        Return the SQL and values that give every record identified by the
+        key columns of a row the values of the row's other columns.  Each
+        column is set with a case expression whose else branch keeps the
+        current value, which also lets the database infer the type of the
+        bound values from the column.
+        '''
+
+        if len(key_cols) == 0 or any(col not in keys for col in key_cols):
+            raise DataStoreException(
+                'every row must contain the key columns ({})'
+                    .format(', '.join(key_cols))
+            )
+
+        update_cols = [key for key in keys if key not in key_cols]
+        if len(update_cols) == 0:
+            raise DataStoreException(
+                'the rows must contain a column to update besides the key '
+                + 'columns'
+            )
+
+        keyed = []
+        for row in rows:
+            keyed.append(
+                (self._get_binds_and_values([row[col] for col in key_cols]),
+                 row)
+            )
+
+        sets = []
+        values = []
+        for column in update_cols:
+            clause = column + ' = case'
+            for (key_binds, key_values), row in keyed:
+                binds, row_values = self._get_binds_and_values([row[column]])
+
+                clause += \
+                    ' when ' \
+                    + ' and '.join(
+                        col + ' = ' + key_binds[index]
+                        for index, col in enumerate(key_cols)
+                      ) \
+                    + ' then ' + binds[0]
+
+                values.extend(key_values)
+                values.extend(row_values)
+
+            sets.append(clause + ' else ' + column + ' end')
+
+        for (key_binds, key_values), row in keyed:
+            values.extend(key_values)
+
+        sql = \
+            'update ' + target + ' set ' + ', '.join(sets) + ' where ' \
+            + _key_condition(
+                key_cols, [key_binds for (key_binds, key_values), row in keyed]
+              )
+
+        return sql, values
+
     def _reset_memcache(self):
+        if self._memcache_flight is not None:
+            # The result set was never stored, most likely because the query
+            # failed, so let anyone waiting on it compute it themselves.
+            single_flight().finish(self._memcache_key, self._memcache_flight)
+            self._memcache_flight = None
+
+        if self._memcache_lease is True:
+            self._memcache_lease = False
+            self._memcache.release_lease(self._memcache_key)
+
         self._memcache_key = None
+        self._memcache_read_only = False
         self._memcache_ttl = None
+        self._memcache_tags = None
+        self._memcache_generations = None
+        self._memcache_single_flight = False
+        self._memcache_early_refresh = None
+        self._memcache_started = None
+
+    def _reset_routing(self):
+        self._in_transaction = False
+        self._last_write = None
+
+    def result_mode(self, mode):
+        '''
+        Return the results of the next query as a Rows object ("rows") or as
+        a dict of column name to values ("columns") instead of a list of
+        dicts.  Both avoid building a dict for every record.  The mode only
+        applies to the next statement; nth(), one(), count() and stream()
+        ignore it and return dicts.
+        '''
+
+        if mode not in ('columns', 'rows'):
+            raise DataStoreException(
+                'unrecognized result mode "{}"'.format(mode)
+            )
+
+        self._result_mode = mode
+        return self
+
+    def __retrieve_cached(self, sql):
+        if self._memcache_tags is not None:
+            tags = self._memcache_tags
+            if tags is True:
+                tags = self._read_tables(sql)
+            tags = tuple(tags) + (_ALL_TABLES,)
+
+            data, self._memcache_generations = \
+                self._memcache.retrieve_tagged(
+                    self._memcache_key, tags, self._memcache_read_only
+                )
+
+            return data
+
+        return \
+            self._memcache.retrieve(
+                self._memcache_key, self._memcache_read_only
+            )
+
+    def __retrieve_individually(self, query):
+        '''
+        Determine whether a gather() query has to be retrieved on its own
+        rather than with a single request for every plain key.
+        '''
+
+        return any(option not in (None, False) for option in query[5:])
+
+    def __retrieve_protected(self, sql):
+        '''
+        Retrieve data stored as a CacheEntry.  Return None if the caller has
+        to compute the data, in which case it either leads the flight for the
+        key or every other caller gave up waiting for the leader.
+        '''
+
+        self._memcache_started = time.time()
+
+        entry = self.__retrieve_cached(sql)
+        if not isinstance(entry, CacheEntry):
+            entry = None
+
+        if entry is not None and \
+           not should_refresh(
+                entry.expires,
+                entry.delta,
+                self._memcache_early_refresh or 0,
+                self._memcache_started
+           ):
+            return entry.data
+
+        if self._memcache_single_flight is False:
+            return None
+
+        settings = ConfigManager.value('memcache single flight', {})
+        lease_ttl = settings.get('lease ttl', 10)
+        wait_timeout = settings.get('wait timeout', 2)
+
+        stale = entry.data if entry is not None else None
+
+        flight, leader = single_flight().begin(self._memcache_key, lease_ttl)
+        if leader is False:
+            if stale is None and self._memcache_can_wait is True:
+                data = single_flight().wait(flight, wait_timeout)
+                if data is not None:
+                    return freeze(data) \
+                        if self._memcache_read_only is True else thaw(data)
+
+            return stale
+
+        self._memcache_flight = flight
+
+        if self._memcache.acquire_lease(self._memcache_key, lease_ttl):
+            self._memcache_lease = True
+            return None
+
+        if stale is None and self._memcache_can_wait is True:
+            stale = self.__wait_for_entry(sql, flight.started + wait_timeout)
+
+        if stale is not None:
+            single_flight().finish(self._memcache_key, flight, stale)
+            self._memcache_flight = None
+
+        return stale
 
     def rollback(self):
         '''
@@ -193,6 +1279,40 @@ class RDBMSBase(__DataStoreBase):
 
         raise NotImplementedError
 
+    def _route(self, is_read):
+        '''
+        Return the group a statement should execute against.  When the
+        server is configured with "routing", reads go to the read group
+        unless a transaction is open or a write happened within the lag
+        tolerance; everything else goes to the write group.
+        '''
+
+        # Every statement is routed before it touches a connection, so the
+        # keep-alive thread must leave the handle alone from here on.
+        self._mark_busy()
+
+        # A write leaves a transaction open until it is committed or rolled
+        # back, whether or not reads and writes are split.
+        if is_read is False:
+            self._in_transaction = True
+            self._last_write = time.time()
+
+        if self._routing is None:
+            return self._group
+
+        if is_read is False:
+            return self._routing['write']
+
+        if self._in_transaction is True:
+            return self._routing['write']
+
+        if self._last_write is not None and \
+           time.time() - self._last_write < \
+                self._routing.get('lag tolerance', 0):
+            return self._routing['write']
+
+        return self._routing['read']
+
     def set_charset(self, charset):
         '''
         Set the character for the RDBMS.
@@ -205,6 +1325,21 @@ class RDBMSBase(__DataStoreBase):
         self.persistent = persistent
         return self
 
+    def _shape_results(self, description, records):
+        '''
+        Convert records fetched as tuples into the requested result mode.
+        '''
+
+        columns = tuple()
+        if description is not None:
+            columns = tuple(column[0] for column in description)
+
+        rows = Rows(columns, list(records))
+        if self._result_mode == 'columns':
+            return rows.to_columns()
+
+        return rows
+
     def should_ping(self):
         if self.persistent is False:
             return False
@@ -215,3 +1350,181 @@ class RDBMSBase(__DataStoreBase):
             self._inactive_since = time.time()
 
         return should_ping
+
+    def stream(self, sql, binds=tuple(), batch_size=1000):
+        '''
+        Execute a query and yield the results one record at a time, fetching
+        batch_size records from the server at once, so that memory use does
+        not grow with the size of the result set.
+        '''
+
+        return iter([])
+
+    def __take_memcache_state(self):
+        '''
+        Return the state memcache_store() needs to store the data for the
+        last memcache_retrieve() and detach it from this handle.
+        '''
+
+        state = (self._memcache_generations,
+                 self._memcache_started,
+                 self._memcache_flight,
+                 self._memcache_lease)
+
+        self._memcache_flight = None
+        self._memcache_lease = False
+
+        return state
+
+    def template_cache_stats(self):
+        '''
+        Return the hit and miss counters for the rendered SQL cache.
+        '''
+
+        return self._template_cache.stats()
+
+    def transaction(self, retries=0, backoff=0.05):
+        '''
+        Return a Transaction that commits when its with block finishes and
+        rolls back if it raises.  Nested transactions use savepoints.  To
+        retry on a deadlock or serialization failure iterate over it:
+
+            for attempt in dsh.transaction(retries=3):
+                with attempt:
+                    ...
+
+        Attempts are separated by a random delay of up to backoff seconds,
+        doubling with every attempt.
+        '''
+
+        return Transaction(self, retries, backoff)
+
+    def update_many(self, target, rows=tuple(), key_cols=tuple(),
+                    chunk_size=1000):
+        '''
+        Update the records identified by the key columns of each row with
+        the values of its other columns, using one statement per chunk of
+        rows instead of one per row.  Returns the number of records changed.
+        '''
+
+        return 0
+
+    def upsert_many(self, target, rows=tuple(), conflict_cols=tuple(),
+                    update_cols=None, chunk_size=1000):
+        '''
+        Insert rows, updating the update columns of the records they collide
+        with on the conflict columns instead.  If update_cols is None every
+        column that is not a conflict column is updated; if it is empty
+        colliding rows are left as they are.  Returns the number of rows
+        affected as reported by the database.
+        '''
+
+        return 0
+
+    def _upsert_columns(self, keys, conflict_cols, update_cols):
+        '''
+        Validate the columns of an upsert and return the columns to update.
+        '''
+
+        if len(conflict_cols) == 0 or \
+           any(col not in keys for col in conflict_cols):
+            raise DataStoreException(
+                'every row must contain the conflict columns ({})'
+                    .format(', '.join(conflict_cols))
+            )
+
+        if update_cols is None:
+            return [key for key in keys if key not in conflict_cols]
+
+        for col in update_cols:
+            if col not in keys:
+                raise DataStoreException(
+                    'update column "{}" is not in the rows'.format(col)
+                )
+
+        return list(update_cols)
+
+    def _validate_connections(self):
+        '''
+        Ping the connections held by an idle handle and replace the ones
+        that fail.
+        '''
+
+        pass
+
+    def __wait_for_entry(self, sql, deadline):
+        '''
+        Poll Memcache until another process stores the data it holds the
+        lease on or the deadline passes.
+        '''
+
+        while time.time() < deadline:
+            time.sleep(0.05)
+
+            self._memcache.purge_local_cache(self._memcache_key)
+
+            entry = self.__retrieve_cached(sql)
+            if isinstance(entry, CacheEntry):
+                return entry.data
+
+        return None
+
+    def warm_up(self, statements):
+        '''
+        Classify the statements and extract the tables they touch ahead of
+        time so that executing them later only requires cache lookups.
+        '''
+
+        for sql in statements:
+            if self._is_select(sql):
+                self._is_read(sql)
+                self._read_tables(sql)
+            else:
+                self._write_tables(sql)
+
+        return self
+
+    def _write_tables(self, sql):
+        '''
+        Return the tables a write statement may modify.  Every table the
+        statement names is included so that multi-table updates and deletes
+        and writes using common table expressions invalidate too much rather
+        than too little.  A write naming no table that can be recognized,
+        like a stored procedure call, invalidates every tagged result.
+        '''
+
+        tables = self._template_cache.get(('write tables', sql))
+        if tables is None:
+            match = _WRITE_TABLE_PATTERN.match(sql)
+            if match is None and _NON_WRITE_PATTERN.match(sql) is not None:
+                tables = tuple()
+            else:
+                tables = \
+                    _table_names(
+                        ([match.group(1)] if match is not None else [])
+                        + _table_lists(_REFERENCED_TABLES_PATTERN, sql)
+                    )
+                if len(tables) == 0:
+                    tables = (_ALL_TABLES,)
+
+            self._template_cache.put(('write tables', sql), tables)
+
+        return tables
+
+# ----- Public Functions ------------------------------------------------------
+
+def warm_up_templates(statements):
+    '''
+    Compile templates for the statements into the cache every handle created
+    afterwards starts with.  Call it before a prefork server forks its
+    workers so that they do not each compile the same statements.
+    '''
+
+    global _warm_templates
+
+    # A new handle starts with the templates compiled by earlier calls.
+    _warm_templates = RDBMSBase().warm_up(statements)._template_cache
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -4,6 +4,7 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 
 # ----- Imports ---------------------------------------------------------------
 
+from .Durability import Durability
 from .exception import DataStoreException
 
 import copy
@@ -11,12 +12,14 @@ import random
 
 # ----- Public Classes --------------------------------------------------------
 
-class Randomizer(object):
+class Randomizer(Durability):
     '''
     Implements the randomizer durability algorithm.
     '''
 
-    def __init__(self, settings):
+    def __init__(self, settings, options=None, health=None):
+        super(Randomizer, self).__init__(settings, options, health)
+
         self.__selected_host = None
         self.settings = copy.deepcopy(settings)
 
@@ -0,0 +1,127 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+
+import array
+import collections
+import functools
+import sys
+
+# ----- Private Functions -----------------------------------------------------
+
+def _column_values(values):
+    '''
+    Store a column in an array.array when every value is an int or every
+    value is a float so that it takes a fixed 8 bytes per value.
+    '''
+
+    kinds = set(type(value) for value in values)
+    try:
+        if kinds == {int}:
+            return array.array('q', values)
+        elif kinds == {float}:
+            return array.array('d', values)
+    except OverflowError:
+        pass
+
+    return values
+
+
+@functools.lru_cache(maxsize=256)
+def _row_class(columns):
+    return collections.namedtuple('Row', columns, rename=True)
+
+# ----- Public Classes --------------------------------------------------------
+
+class Rows(object):
+    '''
+    Holds a result set as one tuple of column names and a tuple per record
+    rather than a dict per record.  Records are returned as named tuples so
+    they can be accessed by attribute, by position or with row_dict().
+    '''
+
+    __slots__ = ('columns', 'records')
+
+    def __init__(self, columns, records):
+        self.columns = tuple(columns)
+        self.records = records
+
+    def column(self, name):
+        '''
+        Return every value in the named column.
+        '''
+
+        index = self.columns.index(name)
+        return [record[index] for record in self.records]
+
+    def __eq__(self, other):
+        return isinstance(other, Rows) and \
+               self.columns == other.columns and \
+               list(self.records) == list(other.records)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Rows(self.columns, self.records[index])
+
+        return _row_class(self.columns)._make(self.records[index])
+
+    def __iter__(self):
+        return map(_row_class(self.columns)._make, self.records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __repr__(self):
+        return 'Rows({!r}, <{} records>)'.format(
+            self.columns, len(self.records)
+        )
+
+    def row_dict(self, index):
+        '''
+        Return the record at index as a dict.
+        '''
+
+        return dict(zip(self.columns, self.records[index]))
+
+    def __sizeof__(self):
+        return sys.getsizeof(self.records) + \
+               sum(sys.getsizeof(record) for record in self.records)
+
+    def to_columns(self):
+        '''
+        Return a dict of column name to the values in that column.  Columns
+        that hold only ints or only floats are returned as array.arrays.
+        '''
+
+        columns = {}
+        for index, name in enumerate(self.columns):
+            columns[name] = \
+                _column_values([record[index] for record in self.records])
+
+        return columns
+
+    def to_dicts(self):
+        '''
+        Return the records as a list of dicts, the way query() returns them by
+        default.
+        '''
+
+        return [dict(zip(self.columns, record)) for record in self.records]
+
+    def to_numpy(self):
+        '''
+        Return a dict of column name to a NumPy array of the values in that
+        column.  Requires NumPy.
+        '''
+
+        try:
+            import numpy
+        except ImportError:
+            raise DataStoreException('NumPy must be installed to use to_numpy')
+
+        return {name: numpy.array(values)
+                for name, values in self.to_columns().items()}
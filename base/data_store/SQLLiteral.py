@@ -0,0 +1,50 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+__all__ = [
+    'literal_sql',
+    'SQLLiteral'
+]
+
+# ----- Private Data ----------------------------------------------------------
+
+_CURRENT_DATE = 'current_date'
+_CURRENT_TIMESTAMP = 'current_timestamp'
+
+# ----- Public Classes --------------------------------------------------------
+
+class SQLLiteral(str):
+    '''
+    Marks a value as SQL that is rendered into the statement in place of a
+    bind placeholder, for example SQLLiteral('current_timestamp').
+    '''
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'SQLLiteral(' + str.__repr__(self) + ')'
+
+# ----- Public Functions ------------------------------------------------------
+
+def literal_sql(value):
+    '''
+    Return the SQL to render for a value if it is a literal and None if it
+    must be bound.  Besides SQLLiteral, the strings "current_date" and
+    "current_timestamp" (optionally followed by a precision) are literals
+    for compatibility.  Values that are not strings are never converted to
+    text, so checking blobs and other large values costs nothing.
+    '''
+
+    if type(value) is SQLLiteral:
+        return value
+
+    if not isinstance(value, str):
+        return None
+
+    if value.startswith(_CURRENT_TIMESTAMP) or value == _CURRENT_DATE:
+        return value
+
+    return None
@@ -0,0 +1,123 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+import math
+import os
+import random
+import threading
+import time
+
+# ----- Private Classes -------------------------------------------------------
+
+class _Flight(object):
+
+    __slots__ = ('data', 'done', 'started')
+
+    def __init__(self):
+        self.data = None
+        self.done = threading.Event()
+        self.started = time.time()
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    global _single_flight
+
+    # Flights led by threads of the parent process would never finish here.
+    _single_flight = SingleFlight()
+
+# ----- Public Classes --------------------------------------------------------
+
+class SingleFlight(object):
+    '''
+    Coalesces concurrent computations of the same key within a process so
+    that one thread computes the value while the others wait for it instead
+    of repeating the work.
+    '''
+
+    def __init__(self):
+        self.__flights = {}
+        self.__lock = threading.Lock()
+
+    def begin(self, key, timeout):
+        '''
+        Return a flight for the key and whether the caller leads it.  The
+        leader must call finish() once it has the value; everyone else can
+        wait() for it.  A flight that has not finished within timeout seconds
+        is considered abandoned and a new leader is chosen.
+        '''
+
+        with self.__lock:
+            flight = self.__flights.get(key)
+            if flight is not None and \
+               not flight.done.is_set() and \
+               time.time() - flight.started < timeout:
+                return flight, False
+
+            flight = _Flight()
+            self.__flights[key] = flight
+
+            return flight, True
+
+    def finish(self, key, flight, data=None):
+        '''
+        Hand data to every thread waiting on the flight.  None tells them
+        that the leader failed and they have to compute the value themselves.
+        '''
+
+        with self.__lock:
+            if self.__flights.get(key) is flight:
+                del self.__flights[key]
+
+        flight.data = data
+        flight.done.set()
+
+    def wait(self, flight, timeout):
+        '''
+        Wait up to timeout seconds from the start of the flight for its data.
+        Return None if it did not arrive.
+        '''
+
+        flight.done.wait(max(timeout - (time.time() - flight.started), 0))
+
+        return flight.data
+
+# ----- Process Data ----------------------------------------------------------
+
+_single_flight = SingleFlight()
+
+# ----- Public Functions ------------------------------------------------------
+
+def should_refresh(expires, delta, beta=1.0, now=None):
+    '''
+    Decide whether a value computed in delta seconds that expires at expires
+    should be refreshed now.  With beta greater than 0 the decision is made
+    early with a probability that rises as expiry approaches so that a single
+    reader refreshes a hot value before it expires (XFetch).
+    '''
+
+    if expires is None:
+        return False
+
+    if now is None:
+        now = time.time()
+
+    if beta > 0 and delta > 0:
+        now -= delta * beta * math.log(1.0 - random.random())
+
+    return now >= expires
+
+
+def single_flight():
+    '''
+    Return the single flight registry shared by every handle in this process.
+    '''
+
+    return _single_flight
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,77 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from collections import OrderedDict
+
+__all__ = [
+    'TemplateCache'
+]
+
+# ----- Public Classes --------------------------------------------------------
+
+class TemplateCache(object):
+    '''
+    A least recently used cache of rendered SQL and the details about it that
+    would otherwise be recomputed every time a statement is executed.
+    '''
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries = OrderedDict()
+
+    def clear(self):
+        self.__entries.clear()
+        return self
+
+    def copy(self):
+        '''
+        Return a new cache holding the same entries with its counters reset.
+        '''
+
+        cache = TemplateCache(self.max_size)
+        cache.__entries.update(self.__entries)
+
+        return cache
+
+    def get(self, key):
+        '''
+        Return the value cached at key or None if it is not cached.
+        '''
+
+        try:
+            value = self.__entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        '''
+        Cache value at key, evicting the least recently used entry if the
+        cache is full.
+        '''
+
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+
+        if len(self.__entries) > self.max_size:
+            self.__entries.popitem(last=False)
+
+        return value
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__entries)
+        }
@@ -0,0 +1,171 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from .exception import DataStoreException
+from .QueryStats import query_stats
+
+import random
+import time
+
+# ----- Private Classes -------------------------------------------------------
+
+class _Attempt(object):
+    '''
+    Runs one attempt of a retried transaction.  A retryable error is
+    swallowed if another attempt remains so that the loop can try again,
+    unless the attempt is nested in another transaction: the error ended
+    that transaction too, so only the outermost one can be run again.
+    '''
+
+    def __init__(self, transaction, remaining):
+        self.error = None
+
+        self.__transaction = transaction
+        self.__remaining = remaining
+        self.__outermost = False
+
+    def __enter__(self):
+        self.__outermost = self.__transaction.dsh._transaction_depth == 0
+        self.__transaction._begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.__transaction.__exit__(exc_type, exc_value, traceback)
+        except Exception as e:
+            # Committing failed, for example with a serialization failure
+            # detected at commit time, and the transaction was rolled back.
+            if exc_value is not None or not self.__retry(e):
+                raise
+
+            return True
+
+        return exc_value is not None and self.__retry(exc_value)
+
+    def __retry(self, error):
+        if self.__outermost and self.__remaining > 0 and \
+           self.__transaction.is_retryable(error):
+            self.error = error
+            return True
+
+        return False
+
+# ----- Public Classes --------------------------------------------------------
+
+class Transaction(object):
+    '''
+    Scopes a transaction on a data store handle.  Used in a with statement
+    the outermost transaction commits when the block finishes and rolls back
+    if it raises; nested transactions do the same with a savepoint.  A with
+    statement cannot run its block again, so to retry the whole transaction
+    on a deadlock or serialization failure iterate over it instead:
+
+        for attempt in dsh.transaction(retries=3):
+            with attempt:
+                ...
+
+    Only the outermost transaction is retried.  A transaction given retries
+    cannot be used in a with statement directly.
+    '''
+
+    def __init__(self, dsh, retries=0, backoff=0.05, max_backoff=2):
+        self.dsh = dsh
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.__savepoints = []
+
+    def _begin(self):
+        '''
+        Start the transaction, or a savepoint if one is already open.
+        '''
+
+        depth = self.dsh._transaction_depth
+        self.dsh._transaction_depth += 1
+
+        if depth == 0:
+            self.__savepoints.append(None)
+        else:
+            savepoint = 'tinyapi_savepoint_' + str(depth)
+            try:
+                self.dsh.query('savepoint ' + savepoint)
+            except Exception:
+                self.dsh._transaction_depth -= 1
+                raise
+
+            self.__savepoints.append(savepoint)
+
+        return self
+
+    def __enter__(self):
+        if self.retries > 0:
+            raise DataStoreException(
+                'a transaction with retries must be iterated over so that '
+                + 'it can be run again'
+            )
+
+        return self._begin()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        savepoint = self.__savepoints.pop()
+        self.dsh._transaction_depth -= 1
+
+        if savepoint is None:
+            if exc_value is None:
+                try:
+                    self.dsh.commit(True)
+                except Exception:
+                    self.__rollback(lambda: self.dsh.rollback(True))
+                    raise
+            else:
+                self.__rollback(lambda: self.dsh.rollback(True))
+        elif exc_value is None:
+            self.dsh.query('release savepoint ' + savepoint)
+        elif not self.is_retryable(exc_value):
+            # A deadlock or serialization failure may have rolled back the
+            # whole transaction and with it the savepoint; the outermost
+            # transaction deals with it.
+            self.__rollback(
+                lambda: self.dsh.query('rollback to savepoint ' + savepoint)
+            )
+
+        return False
+
+    def is_retryable(self, error):
+        '''
+        Determine whether the error means the transaction can succeed if it
+        is run again.
+        '''
+
+        return self.dsh._is_retryable(error)
+
+    def __iter__(self):
+        attempt = 0
+        while True:
+            current = _Attempt(self, self.retries - attempt)
+            yield current
+
+            if current.error is None:
+                return
+
+            query_stats().count('transaction retries')
+
+            time.sleep(
+                random.uniform(
+                    0, min(self.max_backoff, self.backoff * (2 ** attempt))
+                )
+            )
+
+            attempt += 1
+
+    def __rollback(self, rollback):
+        # The error that ended the transaction is more useful than one raised
+        # by rolling back on a connection that may already be gone.
+        try:
+            rollback()
+        except Exception:
+            pass
@@ -4,146 +4,554 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 
 # ----- Imports ---------------------------------------------------------------
 
+from .Codec import Codec
+from .LocalCache import LocalCache
 from tinyAPI.base.config import ConfigManager
 from tinyAPI.base.stats_logger import StatsLogger
+from types import MappingProxyType
 
+import os
 import pylibmc
+import sys
 import threading
 import time
 
 __all__ = [
-    'Memcache'
+    'CacheEntry',
+    'clear_local_cache',
+    'close_client_pool',
+    'freeze',
+    'FrozenRows',
+    'Memcache',
+    'set_codec',
+    'thaw'
 ]
 
 # ----- Thread Local Data -----------------------------------------------------
 
 _thread_local_data = threading.local()
-_thread_local_data.stats = {
-    'requests': 0,
-    'hits': 0
+
+# ----- Private Data ----------------------------------------------------------
+
+_DEFAULT_BEHAVIORS = {
+    'dead_timeout': 60,
+    'ketama': 1,
+    'remove_failed': 1,
+    'retry_timeout': 1,
+    'tcp_nodelay': True
 }
-_thread_local_data.cache = {}
+
+_DEFAULT_POOL_SIZE = 10
+
+# ----- Process Data ----------------------------------------------------------
+
+_client_pool = None
+_client_pool_lock = threading.Lock()
+_client_pool_pid = None
+_default_codec = None
+_inherited_pools = []
+
+# ----- Public Functions ------------------------------------------------------
+
+def clear_local_cache():
+    '''Empties the local cache of the calling thread and resets its
+       statistics.'''
+    _thread_local_data.stats = {
+        'requests': 0,
+        'hits': 0
+    }
+
+    settings = ConfigManager.value('memcache local cache', {})
+    _thread_local_data.cache = \
+        LocalCache(
+            settings.get('max entries', 1000),
+            settings.get('max bytes', 16777216),
+            settings.get('negative ttl', 5))
+
+
+def close_client_pool():
+    '''Discards the clients shared by this process.  A new pool is created
+       the next time Memcached is used.'''
+    global _client_pool, _client_pool_pid
+
+    with _client_pool_lock:
+        pool = _client_pool
+        _client_pool = None
+        _client_pool_pid = None
+
+    if pool is not None:
+        while True:
+            try:
+                handle = pool.get(False)
+            except Exception:
+                break
+
+            handle.disconnect_all()
+
+
+def freeze(data):
+    '''Converts a result set (a list of dicts) into a read only structure that
+       can be shared without copying.  Any attempt to modify it raises a
+       TypeError.'''
+    if isinstance(data, (FrozenRows, MappingProxyType)):
+        return data
+    elif isinstance(data, CacheEntry):
+        return CacheEntry(freeze(data.data), data.expires, data.delta)
+    elif isinstance(data, (list, tuple)):
+        return FrozenRows(
+            MappingProxyType(dict(row)) if isinstance(row, dict) else row
+            for row in data)
+    elif isinstance(data, dict):
+        return MappingProxyType(dict(data))
+    else:
+        return data
+
+
+def set_codec(codec):
+    '''Replaces the codec used to encode the values stored in Memcached with
+       an object implementing the same methods as Codec.'''
+    global _default_codec
+
+    _default_codec = codec
+
+
+def thaw(data):
+    '''Returns a modifiable copy of data that may have been frozen.'''
+    if isinstance(data, CacheEntry):
+        return CacheEntry(thaw(data.data), data.expires, data.delta)
+    elif isinstance(data, FrozenRows):
+        return [dict(row) if isinstance(row, MappingProxyType) else row
+                for row in data]
+    elif isinstance(data, MappingProxyType):
+        return dict(data)
+    elif hasattr(data, 'copy'):
+        return data.copy()
+    else:
+        return data
 
 # ----- Public Classes --------------------------------------------------------
 
+class CacheEntry(object):
+    '''Wraps cached data with the time it should be refreshed at and how long
+       it took to compute so that readers can refresh it before it expires
+       and serve it while it is being refreshed.'''
+
+    __slots__ = ('data', 'expires', 'delta')
+
+    def __init__(self, data, expires=None, delta=0):
+        self.data = data
+        self.expires = expires
+        self.delta = delta
+
+
+    def copy(self):
+        return thaw(self)
+
+
+    def __getstate__(self):
+        return (self.data, self.expires, self.delta)
+
+
+    def __setstate__(self, state):
+        self.data, self.expires, self.delta = state
+
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.data)
+
+
+class FrozenRows(tuple):
+    '''A result set whose records are read only mappings.'''
+    pass
+
+
 class Memcache(object):
     '''Manages interactions with configured Memcached servers.'''
 
-    def __init__(self):
-        self.__handle = None
+    def acquire_lease(self, key, ttl):
+        '''Attempts to take the lease on recomputing the data at the specified
+           key.  Only one caller holds it until it is released or ttl seconds
+           pass.'''
+        with _reserve() as handle:
+            return handle.add(_lease_key(key), 1, ttl) is True
 
 
     def clear_local_cache(self):
-        _thread_local_data.stats = {
-            'requests': 0,
-            'hits': 0
-        }
-        _thread_local_data.cache = {}
+        clear_local_cache()
 
 
     def __add_to_local_cache(self, key, data=None, ttl=None):
-        if key not in _thread_local_data.cache:
-            _thread_local_data.cache[key] = {
-                'added': (time.time() if data is not None else None),
-                'data': data,
-                'ttl': ttl
-            }
+        _local_cache().set(key, data, ttl)
 
 
     def close(self):
-        '''Closes all connections to Memcached servers.'''
-        if self.__handle is not None:
-            self.__handle.disconnect_all()
-            self.__handle = None
+        '''Kept for compatibility.  Clients belong to a pool shared by the
+           process and stay connected between requests; close_client_pool()
+           disconnects them.'''
+        pass
 
 
-    def __connect(self):
-        if self.__handle is None:
-            self.__handle = \
-                pylibmc.Client(
-                    ConfigManager.value('memcached servers'),
-                    binary = True,
-                    behaviors = {
-                        'dead_timeout': 60,
-                        'ketama': 1,
-                        'remove_failed': 1,
-                        'retry_timeout': 1,
-                        'tcp_nodelay': True
-                    })
+    def __decode_multi(self, handle, blobs):
+        codec = _get_codec()
+
+        chunk_keys = {}
+        for key, blob in blobs.items():
+            chunk_keys[key] = codec.chunk_keys(key, blob)
+
+        wanted = [chunk_key
+                  for keys in chunk_keys.values()
+                  for chunk_key in keys]
+        chunks = handle.get_multi(wanted) if len(wanted) > 0 else {}
+
+        return {
+            key: codec.decode(
+                    blob, [chunks.get(chunk_key)
+                           for chunk_key in chunk_keys[key]])
+            for key, blob in blobs.items()
+        }
 
 
-    def __get_from_local_cache(self, key):
-        if key not in _thread_local_data.cache or \
-           _thread_local_data.cache[key]['data'] is None:
-            return None
+    def __get_from_local_cache(self, key, read_only=False):
+        found, data = _local_cache().lookup(key)
+        if found is True and data is not None:
+            data = freeze(data) if read_only is True else thaw(data)
 
-        added = _thread_local_data.cache[key]['added']
-        ttl = _thread_local_data.cache[key]['ttl']
-        if added is not None and ttl is not None:
-            if time.time() - added >= ttl:
-                return None
+        return found, data
 
-        return _thread_local_data.cache[key]['data'].copy()
+
+    def invalidate_tags(self, tags):
+        '''Moves each tag on to a new generation so that every value stored
+           with store_tagged under the old generation is treated as a miss.
+           This is one round trip no matter how many values are tagged.'''
+        if len(tags) == 0:
+            return
+
+        with _reserve() as handle:
+            try:
+                handle.incr_multi([_tag_key(tag) for tag in tags])
+            except pylibmc.NotFound:
+                # A tag that does not exist has nothing stored under it; it
+                # will start at a new generation when it is next read.
+                pass
+
+
+    def local_cache_stats(self):
+        '''Returns the hit, miss and eviction counters and the current size
+           of the thread local cache.'''
+        cache = _local_cache()
+
+        stats = dict(cache.stats)
+        stats['entries'], stats['bytes'] = cache.size()
+
+        return stats
 
 
     def purge(self, key):
         '''Removes the value stored at the specified key from the cache. '''
-        self.__connect()
+        with _reserve() as handle:
+            handle.delete_multi(
+                [key] + _get_codec().chunk_keys(key, handle.get(key)))
 
-        self.__handle.delete(key)
-        if key in _thread_local_data.cache:
-            del _thread_local_data.cache[key]
+        _local_cache().purge(key)
 
 
-    def retrieve(self, key):
-        '''Retrieves the data stored at the specified key from the cache.'''
+    def purge_local_cache(self, key):
+        '''Removes the value stored at the specified key from the local cache
+           only.'''
+        _local_cache().purge(key)
+
+
+    def release_lease(self, key):
+        '''Releases a lease taken with acquire_lease.'''
+        with _reserve() as handle:
+            handle.delete(_lease_key(key))
+
+
+    def retrieve(self, key, read_only=False):
+        '''Retrieves the data stored at the specified key from the cache.  If
+           read_only is True the data is returned frozen and is not copied.'''
+        stats = _local_stats()
+
         StatsLogger().hit_ratio(
             'Cache Stats',
-            _thread_local_data.stats['requests'],
-            _thread_local_data.stats['hits'])
+            stats['requests'],
+            stats['hits'])
 
-        _thread_local_data.stats['requests'] += 1
+        stats['requests'] += 1
 
-        data = self.__get_from_local_cache(key)
-        if data is not None:
-            _thread_local_data.stats['hits'] += 1
+        found, data = self.__get_from_local_cache(key, read_only)
+        if found is True:
+            stats['hits'] += 1
             return data
 
-        self.__connect()
+        with _reserve() as handle:
+            value = handle.get(key)
+            if value is not None:
+                value = self.__decode_multi(handle, {key: value})[key]
+
+        if read_only is True:
+            value = freeze(value)
+        self.__add_to_local_cache(key, value)
 
-        value = self.__handle.get(key)
-        if value is not None:
-            self.__add_to_local_cache(key, value)
+        if read_only is True:
+            return value if value else None
 
         return value.copy() if value else None
 
 
-    def retrieve_multi(self, keys):
-        '''Retrieves the data stored for a number of keys from the cache.'''
+    def retrieve_multi(self, keys, read_only=False):
+        '''Retrieves the data stored for a number of keys from the cache,
+           requesting only the keys missing from the local cache from
+           Memcached in a single round trip.'''
+        stats = _local_stats()
+
+        StatsLogger().hit_ratio(
+            'Cache Stats',
+            stats['requests'],
+            stats['hits'])
+
+        results = {}
+        misses = []
+        for key in keys:
+            stats['requests'] += 1
+
+            found, data = self.__get_from_local_cache(key, read_only)
+            if found is True:
+                stats['hits'] += 1
+                if data is not None:
+                    results[key] = data
+            else:
+                misses.append(key)
+
+        if len(misses) > 0:
+            with _reserve() as handle:
+                values = \
+                    self.__decode_multi(handle, handle.get_multi(misses))
+
+            for key in misses:
+                value = values.get(key)
+                if read_only is True:
+                    value = freeze(value)
+                self.__add_to_local_cache(key, value)
+
+                if value is not None:
+                    if read_only is True:
+                        results[key] = value
+                    else:
+                        results[key] = value.copy() if value else value
+
+        return results
+
+
+    def retrieve_tagged(self, key, tags, read_only=False):
+        '''Retrieves data stored with store_tagged along with the current
+           generation of each tag in a single round trip.  The data is None
+           if it is missing or any of its tags has been invalidated since it
+           was stored.  Tagged data is never held in the local cache.'''
+        stats = _local_stats()
+
         StatsLogger().hit_ratio(
             'Cache Stats',
-            _thread_local_data.stats['requests'],
-            _thread_local_data.stats['hits'])
+            stats['requests'],
+            stats['hits'])
 
-        _thread_local_data.stats['requests'] += 1
+        stats['requests'] += 1
 
-        data = self.__get_from_local_cache(key)
-        if data is not None:
-            _thread_local_data.stats['hits'] += 1
-            return data
+        tag_keys = [_tag_key(tag) for tag in tags]
+
+        with _reserve() as handle:
+            values = handle.get_multi([key] + tag_keys)
+
+            generations = {}
+            missing = {}
+            for tag_key in tag_keys:
+                if tag_key in values:
+                    generations[tag_key] = values[tag_key]
+                else:
+                    missing[tag_key] = _new_generation()
+
+            if len(missing) > 0:
+                generations.update(missing)
+
+                failed = handle.add_multi(missing)
+                if len(failed) > 0:
+                    generations.update(handle.get_multi(failed))
+
+            value = values.get(key)
+            if value is not None:
+                value = self.__decode_multi(handle, {key: value})[key]
+
+        if value is None or value[0] != generations:
+            return None, generations
+
+        stats['hits'] += 1
 
-        self.__connect()
+        data = value[1]
+        if read_only is True:
+            return freeze(data), generations
 
-        values = self.__handle.get_multi(keys)
-        if values is not None:
-            self.__add_to_local_cache(key, values)
+        return data, generations
 
-        return values.copy() if values else {}
 
+    def __set(self, blobs, ttl):
+        with _reserve() as handle:
+            if len(blobs) == 1:
+                for key, blob in blobs.items():
+                    handle.set(key, blob, ttl)
+            else:
+                handle.set_multi(blobs, ttl)
 
-    def store(self, key, data, ttl=0, local_cache_ttl=None):
-        '''Stores the data at the specified key in the cache.'''
-        self.__connect()
 
-        self.__handle.set(key, data, ttl)
+    def store(self, key, data, ttl=0, local_cache_ttl=None, read_only=False):
+        '''Stores the data at the specified key in the cache.  If read_only is
+           True the data is held frozen in the local cache and the frozen
+           version is returned.'''
+        if isinstance(data, (CacheEntry, FrozenRows, MappingProxyType)):
+            self.__set(_get_codec().encode(key, thaw(data)), ttl)
+        else:
+            self.__set(_get_codec().encode(key, data), ttl)
+
+        if read_only is True:
+            data = freeze(data)
         self.__add_to_local_cache(key, data, local_cache_ttl)
+
+        return data
+
+
+    def store_multi(self, data, ttl=0, local_cache_ttl=None):
+        '''Stores each of the key/value pairs in the cache in a single round
+           trip and returns the keys that could not be stored.'''
+        codec = _get_codec()
+
+        blobs = {}
+        owners = {}
+        for key, value in data.items():
+            for blob_key, blob in codec.encode(key, value).items():
+                blobs[blob_key] = blob
+                owners[blob_key] = key
+
+        with _reserve() as handle:
+            failed = \
+                sorted(set(owners[blob_key]
+                           for blob_key in handle.set_multi(blobs, ttl)))
+
+        for key, value in data.items():
+            if key not in failed:
+                self.__add_to_local_cache(key, value, local_cache_ttl)
+
+        return failed
+
+
+    def store_tagged(self, key, data, generations, ttl=0, read_only=False):
+        '''Stores the data at the specified key along with the tag generations
+           returned by retrieve_tagged.  If any of the tags was invalidated in
+           the meantime the data will not be returned by retrieve_tagged.'''
+        self.__set(_get_codec().encode(key, (generations, thaw(data))), ttl)
+
+        return freeze(data) if read_only is True else data
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    global _client_pool_lock
+
+    _client_pool_lock = threading.Lock()
+    _retire_client_pool()
+
+
+def _get_client_pool():
+    global _client_pool, _client_pool_pid
+
+    # Sockets inherited from a parent process are shared with it, so a child
+    # builds its own pool.
+    pid = os.getpid()
+    if _client_pool is not None and _client_pool_pid == pid:
+        return _client_pool
+
+    with _client_pool_lock:
+        if _client_pool is None or _client_pool_pid != pid:
+            _retire_client_pool()
+
+            master = \
+                pylibmc.Client(
+                    ConfigManager.value('memcached servers'),
+                    binary = True,
+                    behaviors = ConfigManager.value(
+                        'memcache behaviors', _DEFAULT_BEHAVIORS))
+
+            # Clients are not handed to each thread because a thread that
+            # exits would take its client with it, so the pool is bounded and
+            # threads wait for a free client instead.
+            _client_pool = \
+                pylibmc.ClientPool(
+                    master,
+                    ConfigManager.value(
+                        'memcache pool size', _DEFAULT_POOL_SIZE))
+
+            _client_pool_pid = pid
+
+        return _client_pool
+
+
+def _get_codec():
+    global _default_codec
+
+    if _default_codec is None:
+        settings = ConfigManager.value('memcache codec', {})
+        _default_codec = \
+            Codec(
+                settings.get('compression', 'zlib'),
+                settings.get('compress threshold', 16384),
+                settings.get('compression level', 1),
+                settings.get('chunk size', 1000000))
+
+    return _default_codec
+
+
+def _lease_key(key):
+    return 'tinyapi:lease:' + key
+
+
+def _local_cache():
+    if not hasattr(_thread_local_data, 'cache'):
+        clear_local_cache()
+
+    return _thread_local_data.cache
+
+
+def _local_stats():
+    if not hasattr(_thread_local_data, 'stats'):
+        clear_local_cache()
+
+    return _thread_local_data.stats
+
+
+def _new_generation():
+    # A tag that was never stored or has been evicted starts at the current
+    # time so that it cannot return to a generation that values were stored
+    # under before the eviction.
+    return int(time.time() * 1000000)
+
+
+def _reserve():
+    return _get_client_pool().reserve(True)
+
+
+def _retire_client_pool():
+    global _client_pool, _client_pool_pid
+
+    # A pool created by a parent process shares its sockets with the parent.
+    # Freeing a client sends Memcached a quit command over those sockets, so
+    # the pool is kept referenced and simply never used again.
+    if _client_pool is not None and _client_pool_pid != os.getpid():
+        _inherited_pools.append(_client_pool)
+        _client_pool = None
+        _client_pool_pid = None
+
+
+def _tag_key(tag):
+    return 'tinyapi:tag:' + tag
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -11,7 +11,9 @@ from .exception import DataStoreForeignKeyException
 from .exception import IllegalMixOfCollationsException
 from tinyAPI.base.config import ConfigManager
 from tinyAPI.base.stats_logger import StatsLogger
+from tinyAPI.base.data_store.memcache import clear_local_cache
 from tinyAPI.base.data_store.memcache import Memcache
+from tinyAPI.base.data_store.SQLLiteral import literal_sql
 
 import os
 import pymysql
@@ -34,6 +36,21 @@ __all__ = [
 
 _thread_local_data = threading.local()
 
+# ----- Process Data ----------------------------------------------------------
+
+_inherited_handles = []
+
+# ----- Private Functions -----------------------------------------------------
+
+def _after_fork_in_child():
+    # Handles inherited from the parent share its sockets.  They are kept
+    # referenced, because closing them here would end the parent's sessions,
+    # and new handles are created when they are next requested.
+    _inherited_handles.extend(_thread_local_data.__dict__.values())
+    _thread_local_data.__dict__.clear()
+
+    DataStoreProvider._retire_inherited()
+
 # ----- Public Functions ------------------------------------------------------
 
 def assert_is_dsh(dsh):
@@ -230,7 +247,7 @@ class DataStoreMySQL(RDBMSBase):
     def close(self):
         '''Close the active database connection.'''
         self.__close_cursor()
-        Memcache().clear_local_cache()
+        clear_local_cache()
 
         if self.__mysql:
             if self.persistent is False:
@@ -435,11 +452,9 @@ class DataStoreMySQL(RDBMSBase):
 
         binds = []
         for key, value in data.items():
-            str_value = str(value)
-
-            if re.match('current_timestamp', str_value) is not None or \
-               str_value == 'current_date':
-                binds.append(value)
+            sql = literal_sql(value)
+            if sql is not None:
+                binds.append(sql)
             else:
                 if re.search('^_binary ', key):
                     binds.append('_binary %s')
@@ -472,10 +487,7 @@ class DataStoreMySQL(RDBMSBase):
 
         values = []
         for value in data:
-            str_value = str(value)
-
-            if re.match('current_timestamp', str_value) is None and \
-               str_value != 'current_date':
+            if literal_sql(value) is None:
                 values.append(value)
 
         return values
@@ -653,3 +665,16 @@ class DataStoreProvider(object):
         else:
             raise DataStoreException(
                 'configured data store is not currently supported')
+
+
+    @classmethod
+    def _retire_inherited(cls):
+        '''Stops handing out the persistent handles of other processes.'''
+        pid = os.getpid()
+        for handles in cls.__persistent.values():
+            for owner in [owner for owner in handles if owner != pid]:
+                _inherited_handles.append(handles.pop(owner))
+
+# ----- Instructions ----------------------------------------------------------
+
+os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,174 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.AsyncMySQL import AsyncMySQL
+from tinyAPI.base.data_store.AsyncPostgreSQL import AsyncPostgreSQL
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.Rows import Rows
+
+import asyncio
+import threading
+import tinyAPI
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class FakePool(object):
+
+    async def acquire(self):
+        return object()
+
+    async def release(self, connection):
+        pass
+
+
+class RecordingAsyncMySQL(AsyncMySQL):
+
+    def __init__(self):
+        super(RecordingAsyncMySQL, self).__init__()
+
+        self.modes = []
+        self.memcache_threads = []
+
+    async def _begin(self, connection):
+        pass
+
+    async def _create_pool(self, host, db, settings):
+        return FakePool()
+
+    async def _end(self, connection, commit):
+        pass
+
+    async def _execute(self, connection, sql, binds, fetch):
+        self.modes.append(self._result_mode)
+
+        if self._result_mode is not None:
+            return self._shape_results((('c',),), [(3,)]), 1, None
+
+        return [{'c': 3}], 1, None
+
+    def memcache_retrieve(self, sql=None):
+        self.memcache_threads.append(threading.current_thread())
+        return super(RecordingAsyncMySQL, self).memcache_retrieve(sql)
+
+    def memcache_store(self, data):
+        self.memcache_threads.append(threading.current_thread())
+        return super(RecordingAsyncMySQL, self).memcache_store(data)
+
+# ----- Tests -----------------------------------------------------------------
+
+class AsyncRDBMSBaseTestCase(unittest.TestCase):
+
+    def test_configure_missing_group(self):
+        for handle in (AsyncMySQL, AsyncPostgreSQL):
+            try:
+                handle().configure({'a': {}}, 'db', 'b')
+
+                self.fail('Was able to configure a missing group.')
+            except DataStoreException as e:
+                self.assertEqual('group "b" not found in settings', e.message)
+
+    def test_commit_without_connection(self):
+        dsh = AsyncMySQL().configure({'a': {}}, 'db', 'a')
+
+        try:
+            asyncio.run(dsh.commit())
+
+            self.fail('Was able to commit without a connection.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'transaction cannot be committed because a database '
+                + 'connection has not been established yet',
+                e.message
+            )
+
+        asyncio.run(dsh.commit(True))
+
+    def test_rollback_without_connection(self):
+        dsh = AsyncPostgreSQL().configure({'a': {}}, 'db', 'a')
+
+        try:
+            asyncio.run(dsh.rollback())
+
+            self.fail('Was able to roll back without a connection.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'transaction cannot be rolled back because a database '
+                + 'connection has not been established yet',
+                e.message
+            )
+
+    def test_result_mode_applies_to_one_statement(self):
+        dsh = \
+            RecordingAsyncMySQL().configure(
+                {'a': {'durability': 'randomizer',
+                       'hosts': [['result-mode', 'user', 'password']]}},
+                'db',
+                'a'
+            )
+
+        async def run():
+            counted = await dsh.result_mode('rows').count('select count(*)')
+            first = await dsh.query('select c from t')
+            shaped = await dsh.result_mode('rows').query('select c from t')
+            last = await dsh.query('select c from t')
+            await dsh.close()
+
+            return counted, first, shaped, last
+
+        counted, first, shaped, last = asyncio.run(run())
+
+        self.assertEqual(3, counted)
+        self.assertEqual([{'c': 3}], first)
+        self.assertEqual(Rows(('c',), [(3,)]), shaped)
+        self.assertEqual([{'c': 3}], last)
+        self.assertEqual([None, None, 'rows', None], dsh.modes)
+
+    def test_memcache_runs_in_executor(self):
+        dsh = \
+            RecordingAsyncMySQL().configure(
+                {'a': {'durability': 'randomizer',
+                       'hosts': [['memcache', 'user', 'password']]}},
+                'db',
+                'a'
+            )
+
+        async def run():
+            results = await dsh.memcache('key', 60).query('select c from t')
+            await dsh.close()
+
+            return results
+
+        self.assertEqual([{'c': 3}], asyncio.run(run()))
+        self.assertEqual(2, len(dsh.memcache_threads))
+        self.assertNotIn(threading.current_thread(), dsh.memcache_threads)
+
+    def test_unsupported_methods(self):
+        dsh = AsyncMySQL().configure({'a': {}}, 'db', 'a')
+
+        for name, args in (('bulk_load', ('t', [(1,)], ('a',))),
+                           ('create_many', ('t', [{'a': 1}])),
+                           ('delete_many', ('t', [{'a': 1}])),
+                           ('stream', ('select a from t',)),
+                           ('update_many', ('t', [{'a': 1}], ('a',))),
+                           ('upsert_many', ('t', [{'a': 1}], ('a',)))):
+            try:
+                getattr(dsh, name)(*args)
+
+                self.fail('Was able to call {}().'.format(name))
+            except DataStoreException as e:
+                self.assertEqual(
+                    name + '() is not supported by asynchronous handles',
+                    e.message
+                )
+
+    def test_close_without_connection(self):
+        asyncio.run(AsyncMySQL().configure({'a': {}}, 'db', 'a').close())
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
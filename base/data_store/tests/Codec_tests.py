@@ -0,0 +1,130 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from collections import OrderedDict
+from tinyAPI.base.data_store.Codec import Codec
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.memcache import CacheEntry
+
+import pickle
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class CodecTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        codec = Codec()
+
+        for value in ([{'a': 1, 'b': 'x'}, {'a': 2, 'b': 'y'}],
+                      [{'a': 1}, {'b': 2}],
+                      [OrderedDict([('a', 1)]), OrderedDict([('a', 2)])],
+                      [],
+                      ({'tag': 1}, [{'a': 1}, {'a': 2}]),
+                      'string',
+                      12):
+            blobs = codec.encode('key', value)
+            self.assertEqual(['key'], list(blobs.keys()))
+
+            decoded = codec.decode(blobs['key'])
+            self.assertEqual(value, decoded)
+            self.assertEqual(type(value), type(decoded))
+
+        entry = \
+            codec.decode(
+                codec.encode(
+                    'key', CacheEntry([{'a': 1}, {'a': 2}], 10, 1)
+                )['key']
+            )
+        self.assertEqual(([{'a': 1}, {'a': 2}], 10, 1),
+                         (entry.data, entry.expires, entry.delta))
+
+    def test_columns_are_smaller(self):
+        rows = [{'identifier': i, 'description': 'x'} for i in range(1000)]
+
+        self.assertTrue(
+            len(Codec(None).encode('key', rows)['key'])
+            < len(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+        )
+
+    def test_compression_threshold(self):
+        rows = [{'a': 'x' * 100} for i in range(100)]
+
+        small = Codec('zlib', 1000000).encode('key', rows)['key']
+        compressed = Codec('zlib', 100).encode('key', rows)['key']
+
+        self.assertTrue(len(compressed) < len(small))
+        self.assertEqual(rows, Codec().decode(compressed))
+
+    def test_chunking(self):
+        codec = Codec(None, chunk_size=100)
+
+        value = list(range(1000))
+        blobs = codec.encode('key', value)
+        self.assertTrue(len(blobs) > 2)
+
+        chunk_keys = codec.chunk_keys('key', blobs['key'])
+        self.assertEqual(len(blobs) - 1, len(chunk_keys))
+        self.assertEqual([], codec.chunk_keys('key', b'legacy'))
+
+        chunks = [blobs[chunk_key] for chunk_key in chunk_keys]
+        self.assertEqual(value, codec.decode(blobs['key'], chunks))
+
+        chunks[1] = None
+        self.assertIsNone(codec.decode(blobs['key'], chunks))
+
+    def test_chunks_are_overwritten(self):
+        codec = Codec(None, chunk_size=100)
+
+        old = codec.encode('key', list(range(1000, 2000)))
+        new = codec.encode('key', list(range(2000, 3000)))
+        self.assertEqual(sorted(old), sorted(new))
+
+        chunk_keys = codec.chunk_keys('key', new['key'])
+        chunks = [new[chunk_key] for chunk_key in chunk_keys]
+        self.assertEqual(list(range(2000, 3000)),
+                         codec.decode(new['key'], chunks))
+
+        chunks[1] = old[chunk_keys[1]]
+        self.assertIsNone(codec.decode(new['key'], chunks))
+
+    def test_chunking_long_key(self):
+        codec = Codec(None, chunk_size=100)
+
+        key = 'k' * 240
+        value = list(range(1000))
+        blobs = codec.encode(key, value)
+
+        chunk_keys = codec.chunk_keys(key, blobs[key])
+        self.assertEqual(sorted(set(blobs) - {key}), sorted(chunk_keys))
+        for chunk_key in chunk_keys:
+            self.assertTrue(len(chunk_key.encode('utf-8')) <= 250)
+
+        chunks = [blobs[chunk_key] for chunk_key in chunk_keys]
+        self.assertEqual(value, codec.decode(blobs[key], chunks))
+
+    def test_versions(self):
+        codec = Codec()
+
+        self.assertEqual(b'legacy', codec.decode(b'legacy'))
+        self.assertEqual([{'a': 1}], codec.decode([{'a': 1}]))
+
+        blob = codec.encode('key', [1])['key']
+        self.assertIsNone(codec.decode(blob[:3] + b'\x63' + blob[4:]))
+
+    def test_unrecognized_compression(self):
+        try:
+            Codec('gzip')
+
+            self.fail('Was able to create a codec with unrecognized '
+                      + 'compression.')
+        except DataStoreException as e:
+            self.assertEqual('unrecognized compression "gzip"', e.message)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+
+import builtins
+import mock
+import os
+import tinyAPI
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class ConnectionManagerTestCase(unittest.TestCase):
+
+    def test_forked_child_gets_new_handles(self):
+        dsh = builtins._ds('my server', 'tinyAPI', 'read write', True)
+        self.assertIs(
+            dsh, builtins._ds('my server', 'tinyAPI', 'read write', True)
+        )
+
+        pid = os.fork()
+        if pid == 0:
+            child_dsh = \
+                builtins._ds('my server', 'tinyAPI', 'read write', True)
+            os._exit(
+                0 if child_dsh is not dsh and
+                     child_dsh is builtins._ds(
+                        'my server', 'tinyAPI', 'read write', True
+                     ) else
+                1
+            )
+
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+        self.assertIs(
+            dsh, builtins._ds('my server', 'tinyAPI', 'read write', True)
+        )
+
+    def test_warm_up(self):
+        patcher_1 = \
+            mock.patch('tinyAPI.base.data_store.ConnectionManager.gc')
+        patcher_2 = \
+            mock.patch(
+                'tinyAPI.base.data_store.RDBMSBase._warm_templates', None
+            )
+
+        gc = patcher_1.start()
+        patcher_2.start()
+
+        builtins._dscm.warm_up(['select a from b', 'delete from c'])
+        self.assertEqual(1, gc.freeze.call_count)
+
+        dsh = RDBMSBase()
+        self.assertEqual(('b',), dsh._read_tables('select a from b'))
+        self.assertEqual(('c',), dsh._write_tables('delete from c'))
+        self.assertTrue(dsh._is_read('select a from b'))
+        self.assertEqual(
+            {'hits': 3, 'misses': 0, 'size': 5},
+            dsh.template_cache_stats()
+        )
+
+        patcher_1.stop()
+        patcher_2.stop()
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
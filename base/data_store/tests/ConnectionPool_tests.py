@@ -0,0 +1,222 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.ConnectionPool import ConnectionPool
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.MySQL import MySQL
+
+import gc
+import mock
+import threading
+import time
+import tinyAPI
+import unittest
+import weakref
+
+# ----- Private Classes -------------------------------------------------------
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+# ----- Tests -----------------------------------------------------------------
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def test_invalid_sizes(self):
+        try:
+            ConnectionPool(FakeConnection, max_size=0)
+
+            self.fail('Was able to create a pool with a max size of 0.')
+        except DataStoreException as e:
+            self.assertEqual('pool "max size" must be at least 1', e.message)
+
+        try:
+            ConnectionPool(FakeConnection, min_size=3, max_size=2)
+
+            self.fail('Was able to create a pool with min size greater than '
+                      + 'max size.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'pool "min size" must be between 0 and "max size"',
+                e.message
+            )
+
+    def test_checkout_reuses_connection(self):
+        pool = ConnectionPool(FakeConnection, max_size=2)
+
+        connection = pool.checkout()
+        pool.checkin(connection)
+
+        self.assertIs(connection, pool.checkout())
+
+        stats = pool.stats()
+        self.assertEqual(1, stats['created'])
+        self.assertEqual(2, stats['checkouts'])
+        self.assertEqual(1, stats['in use'])
+        self.assertEqual(0, stats['idle'])
+
+    def test_checkin_discard(self):
+        pool = ConnectionPool(FakeConnection, max_size=1)
+
+        connection = pool.checkout()
+        pool.checkin(connection, True)
+
+        self.assertTrue(connection.closed)
+        self.assertIsNot(connection, pool.checkout())
+        self.assertEqual(1, pool.stats()['discarded'])
+
+    def test_wait_timeout(self):
+        pool = ConnectionPool(FakeConnection, max_size=1, wait_timeout=0.01)
+        pool.checkout()
+
+        try:
+            pool.checkout()
+
+            self.fail('Was able to check out more connections than the pool '
+                      + 'allows.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'timed out after 0.01 seconds waiting for a connection from '
+                + 'the pool',
+                e.message
+            )
+
+        self.assertEqual(1, pool.stats()['timeouts'])
+
+        self.assertEqual(10, ConnectionPool(FakeConnection).wait_timeout)
+
+    def test_threads_share_connections(self):
+        pool = ConnectionPool(FakeConnection, max_size=4)
+        connections = set()
+        lock = threading.Lock()
+
+        def worker():
+            for i in range(20):
+                connection = pool.checkout()
+                with lock:
+                    connections.add(connection)
+                time.sleep(0.0005)
+                pool.checkin(connection)
+
+        threads = [threading.Thread(target=worker) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = pool.stats()
+        self.assertTrue(len(connections) <= 4)
+        self.assertEqual(320, stats['checkouts'])
+        self.assertEqual(0, stats['in use'])
+        self.assertTrue(stats['waits'] > 0)
+
+    def test_idle_eviction_keeps_min_size(self):
+        pool = ConnectionPool(FakeConnection, min_size=1, max_size=3,
+                              max_idle=0)
+
+        connections = [pool.checkout() for i in range(3)]
+        for connection in connections:
+            pool.checkin(connection)
+
+        self.assertEqual(2, pool.evict())
+        self.assertEqual(1, pool.stats()['size'])
+        self.assertEqual(
+            2, len([connection for connection in connections
+                    if connection.closed]))
+
+    def test_failed_validation_replaces_connection(self):
+        def validate(connection):
+            raise RuntimeError('gone away')
+
+        pool = ConnectionPool(FakeConnection, max_size=1, validate=validate)
+
+        connection = pool.checkout()
+        pool.checkin(connection)
+
+        replacement = pool.checkout()
+
+        self.assertIsNot(connection, replacement)
+        self.assertTrue(connection.closed)
+        self.assertEqual(1, pool.stats()['size'])
+
+    def test_validate_idle(self):
+        validated = []
+
+        def validate(connection):
+            validated.append(connection)
+            if connection is first:
+                raise RuntimeError('gone away')
+
+        pool = \
+            ConnectionPool(
+                FakeConnection, max_size=2, validate=validate,
+                validate_after=60
+            )
+
+        first = pool.checkout()
+        second = pool.checkout()
+        pool.checkin(first)
+        pool.checkin(second)
+
+        self.assertEqual(1, pool.validate_idle(0))
+        self.assertEqual([first, second], validated)
+        self.assertTrue(first.closed)
+
+        stats = pool.stats()
+        self.assertEqual(2, stats['idle'])
+        self.assertEqual(3, stats['created'])
+        self.assertEqual(1, stats['discarded'])
+
+        self.assertEqual(0, pool.validate_idle(60))
+        self.assertEqual(2, len(validated))
+
+        self.assertIs(second, pool.checkout())
+        self.assertEqual(2, len(validated))
+
+    def test_fill(self):
+        pool = ConnectionPool(FakeConnection, min_size=2, max_size=4).fill()
+
+        stats = pool.stats()
+        self.assertEqual(2, stats['size'])
+        self.assertEqual(2, stats['idle'])
+
+    def test_pool_does_not_keep_handle(self):
+        settings = {
+            'rw': {
+                'durability': 'randomizer',
+                'hosts': [['pool-owner', 'user', 'password']],
+                'pool': {'max size': 1}
+            }
+        }
+
+        with mock.patch('pymysql.connect') as connect:
+            connect.return_value.open = True
+
+            dsh = MySQL().configure(settings, 'db', 'rw')
+            dsh.connect()
+            dsh.close()
+
+            handle = weakref.ref(dsh)
+            del dsh
+            gc.collect()
+
+            self.assertIsNone(handle())
+
+            dsh = MySQL().configure(settings, 'db', 'rw')
+            dsh.connect()
+            dsh.close()
+
+        self.assertEqual(1, connect.call_count)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
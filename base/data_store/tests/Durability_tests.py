@@ -0,0 +1,153 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.Durability import CircuitBreaker
+from tinyAPI.base.data_store.Durability import LatencyAware
+from tinyAPI.base.data_store.Durability import LeastOutstanding
+from tinyAPI.base.data_store.Durability import WeightedRandom
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.HostHealth import HostHealth
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+
+import tinyAPI
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class Connection(object):
+    pass
+
+# ----- Tests -----------------------------------------------------------------
+
+class DurabilityTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts = [['a', 'b', 'c'], ['d', 'e', 'f']]
+
+    def test_every_host_is_tried_once(self):
+        durability = CircuitBreaker(self.hosts, health=HostHealth())
+
+        self.assertEqual(
+            ['a', 'd'],
+            sorted([durability.next()[0], durability.next()[0]])
+        )
+
+        try:
+            durability.next()
+
+            self.fail('Was able to get next even though no more hosts remain.')
+        except DataStoreException as e:
+            self.assertEqual('no more hosts remain', e.message)
+
+    def test_dead_hosts_are_tried_last(self):
+        health = HostHealth()
+
+        durability = CircuitBreaker(self.hosts, {'failures': 2}, health)
+        durability.failed(['a'])
+        durability.failed(['a'])
+
+        self.assertFalse(health.available('a'))
+        for i in range(10):
+            durability = CircuitBreaker(self.hosts, health=health)
+            self.assertEqual('d', durability.next()[0])
+            self.assertEqual('a', durability.next()[0])
+
+    def test_cooldown(self):
+        health = HostHealth()
+
+        health.failed('a', 1, 0)
+
+        self.assertTrue(health.available('a'))
+
+    def test_success_revives_host(self):
+        health = HostHealth()
+
+        health.failed('a', 1, 30)
+        health.succeeded('a', Connection(), 0.1)
+
+        self.assertTrue(health.available('a'))
+
+    def test_weighted_random(self):
+        durability = \
+            WeightedRandom(self.hosts, {'weights': [1, 0]}, HostHealth())
+
+        self.assertEqual('a', durability.next()[0])
+
+    def test_weighted_random_weight_count(self):
+        try:
+            WeightedRandom(self.hosts, {'weights': [1]}, HostHealth())
+
+            self.fail('Was able to configure fewer weights than hosts.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'exactly one weight must be configured for each host',
+                e.message
+            )
+
+    def test_least_outstanding(self):
+        health = HostHealth()
+
+        connection = Connection()
+        health.succeeded('a', connection, 0.1)
+
+        self.assertEqual(1, health.outstanding('a'))
+        self.assertEqual(
+            'd', LeastOutstanding(self.hosts, health=health).next()[0]
+        )
+
+        del connection
+
+        self.assertEqual(0, health.outstanding('a'))
+
+    def test_latency_aware(self):
+        health = HostHealth()
+
+        health.succeeded('a', Connection(), 0.5)
+        health.succeeded('d', Connection(), 0.1)
+
+        self.assertEqual(
+            'd', LatencyAware(self.hosts, health=health).next()[0]
+        )
+
+    def test_latency_moving_average(self):
+        health = HostHealth(0.5)
+
+        health.succeeded('a', Connection(), 1.0)
+        health.succeeded('a', Connection(), 0.0)
+
+        self.assertEqual(0.5, health.latency('a'))
+
+    def test_get_durability(self):
+        dsh = RDBMSBase()
+
+        self.assertIsInstance(
+            dsh._get_durability(
+                {'durability': 'latency aware', 'hosts': self.hosts}
+            ),
+            LatencyAware
+        )
+        self.assertEqual(
+            5,
+            dsh._get_durability(
+                {'durability': {'algorithm': 'circuit breaker',
+                                'cooldown': 5},
+                 'hosts': self.hosts}
+            ).cooldown
+        )
+
+        try:
+            dsh._get_durability({'durability': 'abc', 'hosts': self.hosts})
+
+            self.fail('Was able to get an unrecognized durability algorithm.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'unrecognized durability algorithm "abc"', e.message
+            )
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.KeepAlive import KeepAlive
+from tinyAPI.base.data_store.MySQL import MySQL
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+
+import mock
+import threading
+import time
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class PingingRDBMS(RDBMSBase):
+
+    def __init__(self):
+        super(PingingRDBMS, self).__init__()
+
+        self.pings = 0
+
+    def query(self, sql, binds=tuple()):
+        started = time.time()
+
+        self._route(True)
+        self._record_statement('query', sql, started)
+
+        return True
+
+    def _validate_connections(self):
+        self.pings += 1
+
+# ----- Tests -----------------------------------------------------------------
+
+class KeepAliveTestCase(unittest.TestCase):
+
+    def test_idle_handles_are_validated(self):
+        keep_alive = KeepAlive()
+
+        dsh = PingingRDBMS()
+        keep_alive.watch(dsh)
+
+        dsh._inactive_since = time.time() - 120
+        keep_alive.validate(60)
+        self.assertEqual(1, dsh.pings)
+
+        keep_alive.validate(60)
+        self.assertEqual(1, dsh.pings)
+
+    def test_busy_handles_are_skipped(self):
+        keep_alive = KeepAlive()
+
+        dsh = PingingRDBMS()
+        keep_alive.watch(dsh)
+
+        dsh._mark_busy()
+        dsh._inactive_since = time.time() - 120
+        keep_alive.validate(60)
+        self.assertEqual(0, dsh.pings)
+
+        dsh._mark_idle()
+        keep_alive.validate(60)
+        self.assertEqual(1, dsh.pings)
+
+    def test_handles_are_idle_between_statements(self):
+        keep_alive = KeepAlive()
+
+        dsh = PingingRDBMS()
+        keep_alive.watch(dsh)
+
+        dsh.query('select 1')
+
+        dsh._inactive_since = time.time() - 120
+        keep_alive.validate(60)
+        self.assertEqual(1, dsh.pings)
+
+        # A statement that has been routed but has not finished yet.
+        dsh._route(True)
+
+        dsh._inactive_since = time.time() - 120
+        keep_alive.validate(60)
+        self.assertEqual(1, dsh.pings)
+
+    def test_handles_are_busy_between_chunks(self):
+        busy = []
+
+        with mock.patch('pymysql.connect') as connect:
+            connection = connect.return_value
+            connection.max_allowed_packet = 16777216
+
+            cursor = connection.cursor.return_value
+            cursor.fetchone.return_value = (16777216,)
+            cursor.rowcount = 1
+            cursor.execute.side_effect = \
+                lambda sql, binds=None: busy.append(dsh._busy)
+
+            dsh = \
+                MySQL().configure(
+                    {'rw': {'durability': 'randomizer',
+                            'hosts': [['chunks', 'user', 'password']]}},
+                    'db',
+                    'rw'
+                )
+
+            rows = [{'id': 1}, {'id': 2}, {'id': 3}]
+            self.assertEqual(3, dsh.create_many('t', rows, 1)[1])
+            self.assertEqual(3, dsh.delete_many('t', rows, 1))
+            dsh.close()
+
+        self.assertEqual(7, len(busy))
+        self.assertTrue(all(busy))
+
+    def test_use_waits_for_validation(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        class SlowRDBMS(PingingRDBMS):
+
+            def _validate_connections(self):
+                started.set()
+                release.wait(5)
+                super(SlowRDBMS, self)._validate_connections()
+
+        dsh = SlowRDBMS()
+        dsh._inactive_since = time.time() - 120
+
+        validation = threading.Thread(target=lambda: dsh.keep_alive(60))
+        validation.start()
+        started.wait(5)
+
+        marked = []
+        user = \
+            threading.Thread(
+                target=lambda: marked.append(dsh._mark_busy() or dsh.pings)
+            )
+        user.start()
+
+        time.sleep(0.05)
+        self.assertEqual([], marked)
+
+        release.set()
+        validation.join()
+        user.join()
+
+        self.assertEqual([1], marked)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
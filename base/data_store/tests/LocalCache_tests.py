@@ -0,0 +1,87 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.LocalCache import LocalCache
+
+import time
+import tinyAPI
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class LocalCacheTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        cache = LocalCache()
+        cache.set('a', [1])
+
+        self.assertEqual((True, [1]), cache.lookup('a'))
+        self.assertEqual((False, None), cache.lookup('b'))
+        self.assertEqual(1, cache.stats['hits'])
+        self.assertEqual(1, cache.stats['misses'])
+
+
+    def test_negative_caching(self):
+        cache = LocalCache(negative_ttl=60)
+        cache.set('a', None)
+
+        self.assertEqual((True, None), cache.lookup('a'))
+        self.assertEqual(1, cache.stats['negative hits'])
+
+        cache.set('a', [1])
+        self.assertEqual((True, [1]), cache.lookup('a'))
+
+
+    def test_ttl_expiry(self):
+        cache = LocalCache()
+        cache.set('a', [1], 0.01)
+        cache.set('b', [2])
+
+        time.sleep(0.02)
+
+        cache.set('c', [3])
+        self.assertEqual(2, cache.size()[0])
+        self.assertEqual(1, cache.stats['expirations'])
+        self.assertEqual((False, None), cache.lookup('a'))
+
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', [1])
+        cache.set('b', [2])
+        cache.lookup('a')
+        cache.set('c', [3])
+
+        self.assertEqual((True, [1]), cache.lookup('a'))
+        self.assertEqual((False, None), cache.lookup('b'))
+        self.assertEqual(1, cache.stats['evictions'])
+
+
+    def test_max_bytes(self):
+        cache = LocalCache(max_bytes=2048)
+        for i in range(10):
+            cache.set(i, ['x' * 500])
+
+        entries, size = cache.size()
+        self.assertTrue(entries < 10)
+        self.assertTrue(size <= 2048)
+
+        cache.set('too big', ['x' * 4096])
+        self.assertEqual((False, None), cache.lookup('too big'))
+
+
+    def test_purge(self):
+        cache = LocalCache()
+        cache.set('a', [1])
+        cache.purge('a')
+        cache.purge('b')
+
+        self.assertEqual((0, 0), cache.size())
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.Middleware import AsyncDataStoreMiddleware
+from tinyAPI.base.data_store.Middleware import DataStoreMiddleware
+from tinyAPI.base.data_store.Middleware import request_metrics
+from tinyAPI.base.data_store.MySQL import MySQL
+from tinyAPI.base.data_store.QueryStats import query_stats
+
+import asyncio
+import mock
+import tinyAPI
+import unittest
+
+# ----- Private Functions -----------------------------------------------------
+
+def _run_queries(cache_hits=(None,)):
+    for cache_hit in cache_hits:
+        query_stats().record(
+            'query', 'select 1', 0.25, 1, cache_hit=cache_hit
+        )
+
+# ----- Tests -----------------------------------------------------------------
+
+class MiddlewareTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patcher = \
+            mock.patch(
+                'tinyAPI.base.data_store.Middleware.ConnectionManager'
+            )
+        self.manager = self.patcher.start().return_value
+
+    def tearDown(self):
+        self.patcher.stop()
+
+    def __call_wsgi(self, app, persistent=True):
+        dsh = self.manager.acquire.return_value
+        dsh.persistent = persistent
+
+        responses = []
+        middleware = \
+            DataStoreMiddleware(app, 'my server', 'db', 'g', persistent)
+
+        result = \
+            middleware(
+                {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'},
+                lambda status, headers, exc_info=None:
+                    responses.append((status, dict(headers)))
+            )
+        self.ended_before_body = dsh.commit.called or dsh.rollback.called
+        self.status = responses[0][0]
+        try:
+            body = list(result)
+        finally:
+            result.close()
+
+        return dsh, responses[0][1], body
+
+    def test_wsgi_commits(self):
+        def app(environ, start_response):
+            self.assertIs(self.manager.acquire.return_value,
+                          environ['tinyapi.dsh'])
+
+            _run_queries((None, True, False, True))
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'ok']
+
+        dsh, headers, body = self.__call_wsgi(app)
+
+        self.manager.acquire.assert_called_once_with(
+            'my server', 'db', 'g', True
+        )
+        self.assertEqual([b'ok'], body)
+        self.assertEqual('text/plain', headers['Content-Type'])
+        self.assertEqual('db;dur=500.000', headers['Server-Timing'])
+        self.assertEqual('2', headers['X-DB-Queries'])
+        self.assertEqual('0.67', headers['X-Cache-Hit-Ratio'])
+
+        dsh.commit.assert_called_once_with(True)
+        self.assertFalse(dsh.rollback.called)
+        dsh.close.assert_called_once_with()
+        self.assertTrue(self.ended_before_body)
+        self.assertIsNone(request_metrics())
+
+    def test_wsgi_commits_before_generated_body(self):
+        def app(environ, start_response):
+            start_response('200 OK', [])
+            yield b'o'
+            yield b'k'
+
+        dsh, headers, body = self.__call_wsgi(app)
+
+        self.assertEqual([b'o', b'k'], body)
+        self.assertTrue(self.ended_before_body)
+        dsh.commit.assert_called_once_with(True)
+
+    def test_wsgi_failed_commit(self):
+        self.manager.acquire.return_value.commit.side_effect = \
+            RuntimeError('commit failed')
+
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/html')])
+            return [b'saved']
+
+        dsh, headers, body = self.__call_wsgi(app)
+
+        self.assertEqual('500 Internal Server Error', self.status)
+        self.assertEqual('text/plain; charset=utf-8', headers['Content-Type'])
+        self.assertEqual([], body)
+        dsh.rollback.assert_called_once_with(True)
+        dsh.close.assert_called_once_with()
+
+    def test_wsgi_resets_persistent_handles(self):
+        dsh = \
+            MySQL().configure(
+                {'g': {'durability': 'randomizer',
+                       'hosts': [['host', 'user', 'password']]}},
+                'db',
+                'g'
+            )
+        self.manager.acquire.return_value = dsh
+
+        def app(environ, start_response):
+            dsh._route(False)
+            dsh.result_mode('rows').memcache('key', 60)
+
+            start_response('200 OK', [])
+            return [b'ok']
+
+        middleware = DataStoreMiddleware(app, 'my server', 'db', 'g')
+
+        result = middleware({}, lambda status, headers, exc_info=None: None)
+        list(result)
+        result.close()
+
+        self.manager.acquire.assert_called_once_with('my server', 'db', 'g',
+                                                     False)
+
+        self.assertFalse(dsh._busy)
+        self.assertFalse(dsh._in_transaction)
+        self.assertIsNone(dsh._last_write)
+        self.assertIsNone(dsh._result_mode)
+        self.assertIsNone(dsh._memcache_key)
+
+    def test_wsgi_rolls_back_and_closes(self):
+        def app(environ, start_response):
+            start_response('500 Internal Server Error', [])
+            return [b'error']
+
+        dsh, headers, body = self.__call_wsgi(app, False)
+
+        self.assertEqual('0', headers['X-DB-Queries'])
+        self.assertNotIn('X-Cache-Hit-Ratio', headers)
+        dsh.rollback.assert_called_once_with(True)
+        self.assertFalse(dsh.commit.called)
+        dsh.close.assert_called_once_with()
+
+        def failing_app(environ, start_response):
+            raise RuntimeError('failed')
+
+        try:
+            self.__call_wsgi(failing_app)
+
+            self.fail('The error raised by the application was lost.')
+        except RuntimeError:
+            pass
+
+        self.assertEqual(2, dsh.rollback.call_count)
+        self.assertIsNone(request_metrics())
+
+    def test_asgi(self):
+        dsh = self.manager.acquire_async.return_value
+        dsh.commit = mock.AsyncMock()
+        dsh.rollback = mock.AsyncMock()
+        dsh.close = mock.AsyncMock()
+
+        async def app(scope, receive, send):
+            self.assertIs(dsh, scope['tinyapi.dsh'])
+
+            _run_queries()
+            await send({'type': 'http.response.start',
+                        'status': scope['status'],
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        middleware = AsyncDataStoreMiddleware(app, 'my server', 'db', 'g')
+
+        asyncio.run(
+            middleware({'type': 'http', 'status': 200}, None, send)
+        )
+
+        self.assertEqual(
+            [(b'content-type', b'text/plain'),
+             (b'server-timing', b'db;dur=250.000'),
+             (b'x-db-queries', b'1')],
+            messages[0]['headers']
+        )
+        dsh.commit.assert_awaited_once_with(True)
+        dsh.close.assert_awaited_once_with()
+
+        asyncio.run(
+            middleware({'type': 'http', 'status': 503}, None, send)
+        )
+
+        dsh.rollback.assert_awaited_once_with(True)
+        self.assertEqual(2, dsh.close.await_count)
+
+    def test_asgi_failed_commit(self):
+        dsh = self.manager.acquire_async.return_value
+        dsh.commit = mock.AsyncMock(side_effect=RuntimeError('failed'))
+        dsh.rollback = mock.AsyncMock()
+        dsh.close = mock.AsyncMock()
+
+        messages = []
+
+        async def app(scope, receive, send):
+            await send({'type': 'http.response.start',
+                        'status': 200,
+                        'headers': []})
+            self.assertEqual([], messages)
+
+            await send({'type': 'http.response.body', 'body': b'saved'})
+
+        async def send(message):
+            messages.append(message)
+
+        middleware = \
+            AsyncDataStoreMiddleware(
+                app, 'my server', 'db', 'g', headers=False
+            )
+
+        asyncio.run(middleware({'type': 'http'}, None, send))
+
+        self.assertEqual(500, messages[0]['status'])
+        self.assertEqual(b'', messages[1]['body'])
+        dsh.rollback.assert_awaited_once_with(True)
+        dsh.close.assert_awaited_once_with()
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
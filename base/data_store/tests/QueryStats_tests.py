@@ -0,0 +1,196 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.MySQL import MySQL
+from tinyAPI.base.data_store.QueryStats import fingerprint
+from tinyAPI.base.data_store.QueryStats import query_stats
+from tinyAPI.base.data_store.QueryStats import QueryStats
+
+import mock
+import tinyAPI
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class QueryStatsTestCase(unittest.TestCase):
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            'select * from t where a = ? and b = ?',
+            fingerprint("SELECT *\n  FROM t\n WHERE a = 12 AND b = 'x''y'")
+        )
+        self.assertEqual(
+            'select * from t where a in (?+)',
+            fingerprint('select * from t where a in (%s, %s, %s)')
+        )
+        self.assertEqual(
+            'insert into t(a, b) values (?+)+',
+            fingerprint('insert into t(a, b) values (%s, %s), (%s, %s)')
+        )
+        self.assertEqual(
+            fingerprint('select * from t1 where a = 1'),
+            fingerprint('select * from t1 where a = 2')
+        )
+
+    def test_snapshot(self):
+        stats = QueryStats()
+
+        for i in range(98):
+            stats.record('query', 'select 1', 0.001, 1, 10, False)
+        stats.record('query', 'select 2', 0.5, 1, 10, True)
+        stats.record('query', 'select 3', 1.0)
+        stats.record('query', 'select a from t', 0.1)
+
+        snapshot = stats.snapshot(2)
+
+        self.assertEqual(2, len(snapshot))
+        self.assertEqual('select a from t', snapshot[1]['fingerprint'])
+        self.assertEqual('select ?', snapshot[0]['fingerprint'])
+        self.assertEqual(100, snapshot[0]['count'])
+        self.assertEqual(99, snapshot[0]['rows'])
+        self.assertEqual(990, snapshot[0]['bytes'])
+        self.assertEqual(1, snapshot[0]['cache hits'])
+        self.assertEqual(98, snapshot[0]['cache misses'])
+        self.assertEqual(1.0, snapshot[0]['max time'])
+        self.assertTrue(0.001 <= snapshot[0]['p50'] < 0.0013)
+        self.assertTrue(0.5 <= snapshot[0]['p99'] < 0.6)
+
+    def test_snapshot_order_by(self):
+        stats = QueryStats()
+
+        stats.record('query', 'select a from t', 1.0)
+        for i in range(10):
+            stats.record('query', 'select b from t', 0.01)
+
+        self.assertEqual(
+            'select b from t', stats.snapshot(1, 'count')[0]['fingerprint']
+        )
+        self.assertEqual(
+            'select a from t', stats.snapshot(1, 'max time')[0]['fingerprint']
+        )
+
+    def test_max_fingerprints(self):
+        stats = QueryStats(2)
+
+        stats.record('query', 'select a from t', 0.1)
+        stats.record('query', 'select b from t', 0.1)
+        stats.record('query', 'select c from t', 0.1)
+        stats.record('query', 'select d from t', 0.1)
+
+        snapshot = stats.snapshot(10, 'count')
+
+        self.assertEqual(3, len(snapshot))
+        self.assertEqual('[other]', snapshot[0]['fingerprint'])
+        self.assertEqual(2, snapshot[0]['count'])
+
+    def test_hooks(self):
+        stats = QueryStats()
+        records = []
+
+        stats.add_hook(records.append)
+        stats.record('create', 'insert into t(a) values (%s)', 0.1, 1)
+        stats.remove_hook(records.append)
+        stats.record('create', 'insert into t(a) values (%s)', 0.1, 1)
+
+        self.assertEqual(1, len(records))
+        self.assertEqual('create', records[0]['kind'])
+        self.assertEqual('insert into t(a) values (?+)',
+                         records[0]['fingerprint'])
+        self.assertEqual(1, records[0]['rows'])
+
+    def test_stream_is_recorded(self):
+        records = []
+
+        with mock.patch('pymysql.connect') as connect:
+            cursor = connect.return_value.cursor.return_value
+            cursor.fetchmany.side_effect = \
+                [[{'a': 1}, {'a': 2}], [{'a': 3}], []]
+
+            dsh = \
+                MySQL().configure(
+                    {'rw': {'durability': 'randomizer',
+                            'hosts': [['stream', 'user', 'password']]}},
+                    'db',
+                    'rw'
+                )
+
+            query_stats().add_hook(records.append)
+            try:
+                stream = dsh.result_mode('rows').stream('select a from t', 2)
+
+                self.assertEqual({'a': 1}, next(stream))
+                self.assertEqual(0, len(records))
+
+                self.assertEqual([{'a': 2}, {'a': 3}], list(stream))
+            finally:
+                query_stats().remove_hook(records.append)
+
+        self.assertIsNone(dsh._result_mode)
+        self.assertEqual(1, len(records))
+        self.assertEqual('select a from t', records[0]['fingerprint'])
+        self.assertEqual(3, records[0]['rows'])
+
+    def test_abandoned_stream_is_closed(self):
+        records = []
+        events = []
+
+        with mock.patch('pymysql.connect') as connect:
+            stream_cursor = mock.Mock()
+            stream_cursor.fetchmany.side_effect = [[{'a': 1}, {'a': 2}], []]
+            stream_cursor.close.side_effect = \
+                lambda: events.append('close stream')
+
+            query_cursor = mock.Mock()
+            query_cursor.rowcount = 1
+            query_cursor.execute.side_effect = \
+                lambda sql, binds=None: events.append(sql)
+
+            connect.return_value.cursor.side_effect = \
+                [stream_cursor, query_cursor]
+
+            dsh = \
+                MySQL().configure(
+                    {'rw': {'durability': 'randomizer',
+                            'hosts': [['abandoned', 'user', 'password']]}},
+                    'db',
+                    'rw'
+                )
+
+            query_stats().add_hook(records.append)
+            try:
+                stream = dsh.stream('select a from t')
+                self.assertEqual({'a': 1}, next(stream))
+
+                dsh.query('update t set a = 1')
+
+                try:
+                    next(stream)
+
+                    self.fail('Was able to read a stream after another '
+                              + 'statement was run.')
+                except DataStoreException as e:
+                    self.assertEqual(
+                        'the stream was closed because another statement was '
+                        + 'run before it was read to its end',
+                        e.message
+                    )
+            finally:
+                query_stats().remove_hook(records.append)
+
+            dsh.close()
+
+        self.assertEqual(['close stream', 'update t set a = 1'], events)
+        self.assertEqual(
+            ['select a from t', 'update t set a = ?'],
+            [record['fingerprint'] for record in records]
+        )
+        self.assertEqual(1, records[0]['rows'])
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,492 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.QueryStats import query_stats
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+from tinyAPI.base.data_store.SQLLiteral import SQLLiteral
+
+import threading
+import time
+import tinyAPI
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class FetchingRDBMS(RDBMSBase):
+
+    def _fetch_rows(self, sql, binds, count):
+        self.fetched = count
+        return [{'a': 1}, {'a': 2}, {'a': 3}][:count]
+
+
+class GatheringRDBMS(RDBMSBase):
+
+    def __init__(self, capacity):
+        super(GatheringRDBMS, self).__init__()
+
+        self.capacity = capacity
+        self.retrieved = []
+        self.threads = set()
+
+    def close(self):
+        pass
+
+    def commit(self, ignore_exceptions=False):
+        self._in_transaction = False
+
+    def _gather_capacity(self, group):
+        return self.capacity
+
+    def _gather_query(self, group, sql, binds):
+        self.threads.add(threading.current_thread().name)
+        return [sql, binds, group]
+
+    def memcache_many(self, keys, read_only=False):
+        self.retrieved.append((keys, read_only))
+        return {}
+
+    def query(self, sql, binds=tuple()):
+        self.threads.add(threading.current_thread().name)
+        return [sql, binds]
+
+
+class RoutedRDBMS(RDBMSBase):
+
+    def close(self):
+        pass
+
+# ----- Tests -----------------------------------------------------------------
+
+class RDBMSBaseTestCase(unittest.TestCase):
+
+    def test_chunk_rows_by_count(self):
+        rows = [{'a': i, 'b': str(i)} for i in range(5)]
+
+        chunks = list(RDBMSBase()._chunk_rows(rows, 2))
+
+        self.assertEqual(3, len(chunks))
+        self.assertEqual(['a', 'b'], chunks[0][0])
+        self.assertEqual([2, 2, 1], [len(chunk) for keys, chunk in chunks])
+
+    def test_chunk_rows_by_size(self):
+        rows = [{'a': 'x' * 100} for i in range(10)]
+
+        chunks = list(RDBMSBase()._chunk_rows(rows, 1000, 400))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(10, sum(len(chunk) for keys, chunk in chunks))
+
+        rows = [{'a': '\u00e9' * 100} for i in range(10)]
+
+        chunks = list(RDBMSBase()._chunk_rows(rows, 1000, 1000))
+
+        self.assertEqual(10, sum(len(chunk) for keys, chunk in chunks))
+        for keys, chunk in chunks:
+            self.assertTrue(
+                sum(len(row['a'].encode('utf-8')) for row in chunk) * 2
+                < 1000
+            )
+
+    def test_chunk_rows_oversized_row(self):
+        rows = [{'a': 'x' * 1000}, {'a': 'y'}]
+
+        chunks = list(RDBMSBase()._chunk_rows(rows, 1000, 100))
+
+        self.assertEqual([1, 1], [len(chunk) for keys, chunk in chunks])
+
+    def test_chunk_rows_column_mismatch(self):
+        try:
+            list(RDBMSBase()._chunk_rows([{'a': 1}, {'b': 2}], 10))
+
+            self.fail('Was able to chunk rows with different columns.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'every row must contain the same columns as the first row '
+                + '(a)',
+                e.message
+            )
+
+    def test_chunk_rows_column_order(self):
+        chunks = list(RDBMSBase()._chunk_rows([{'a': 1, 'b': 2},
+                                               {'b': 3, 'a': 4}], 10))
+
+        self.assertEqual(1, len(chunks))
+
+    def test_routing_groups_must_exist(self):
+        try:
+            RoutedRDBMS().configure(
+                {'w': {}, 'routing': {'read': 'r', 'write': 'w'}}, 'db', 'w'
+            )
+
+            self.fail('Was able to configure routing to a missing group.')
+        except DataStoreException as e:
+            self.assertEqual('read group "r" not found in settings', e.message)
+
+    def test_route_without_routing(self):
+        dsh = RoutedRDBMS().configure({'w': {}}, 'db', 'w')
+
+        self.assertEqual('w', dsh._route(True))
+        self.assertEqual('w', dsh._route(False))
+
+    def test_route_reads_and_writes(self):
+        dsh = \
+            RoutedRDBMS().configure(
+                {'r': {}, 'w': {}, 'routing': {'read': 'r', 'write': 'w'}},
+                'db',
+                'w'
+            )
+
+        self.assertEqual('r', dsh._route(dsh._is_read('select 1')))
+        self.assertEqual('w', dsh._route(dsh._is_read('update t set a = 1')))
+        self.assertEqual('w', dsh._route(dsh._is_read('select 1')))
+
+        dsh._in_transaction = False
+        self.assertEqual('r', dsh._route(dsh._is_read('select 1')))
+        self.assertEqual(
+            'w',
+            dsh._route(dsh._is_read('select a\n  from t\n   for update'))
+        )
+
+    def test_route_lag_tolerance(self):
+        dsh = \
+            RoutedRDBMS().configure(
+                {'r': {},
+                 'w': {},
+                 'routing': {'read': 'r', 'write': 'w', 'lag tolerance': 0.05}},
+                'db',
+                'w'
+            )
+
+        dsh._route(False)
+        dsh._in_transaction = False
+
+        self.assertEqual('w', dsh._route(True))
+        time.sleep(0.06)
+        self.assertEqual('r', dsh._route(True))
+
+    def test_gather_on_pool(self):
+        dsh = GatheringRDBMS(4).configure({'g': {}}, 'db', 'g')
+
+        self.assertEqual(
+            [['select 1', (1,)], ['select 2', (2,), 'g']],
+            dsh.gather([('select 1', (1,)), ('select 2', (2,))])
+        )
+        self.assertEqual(2, len(dsh.threads))
+
+    def test_gather_capped_by_pool(self):
+        dsh = GatheringRDBMS(1).configure({'g': {}}, 'db', 'g')
+
+        self.assertEqual(
+            [['select 1', ()], ['select 2', (), 'g'], ['select 3', ()]],
+            dsh.gather([('select 1', ()), ('select 2', ()), ('select 3', ())])
+        )
+
+    def test_gather_in_transaction_serially(self):
+        dsh = GatheringRDBMS(4).configure({'g': {}}, 'db', 'g')
+        queries = [('select 1', ()), ('select 2', ())]
+
+        dsh._route(False)
+        dsh.gather(queries)
+        self.assertEqual({threading.current_thread().name}, dsh.threads)
+
+        dsh.commit()
+        dsh.gather(queries)
+        self.assertEqual(2, len(dsh.threads))
+
+        dsh.threads.clear()
+        with dsh.transaction():
+            dsh.gather(queries)
+        self.assertEqual({threading.current_thread().name}, dsh.threads)
+
+    def test_gather_stats_leave_handle_busy(self):
+        dsh = RDBMSBase()
+
+        dsh._route(True)
+        dsh._record_stats('query', 'select 1', time.time(), 1)
+        self.assertTrue(dsh._busy)
+
+        dsh._record_statement('query', 'select 1', time.time(), 1)
+        self.assertFalse(dsh._busy)
+
+    def test_gather_read_only_from_cache(self):
+        dsh = GatheringRDBMS(0).configure({'g': {}}, 'db', 'g')
+
+        dsh.gather([('select 1', (), 'a', 60),
+                    ('select 2', (), 'b', 60, True),
+                    ('select 3', (), 'c', 60, False)])
+
+        self.assertEqual([(['a', 'c'], False), (['b'], True)], dsh.retrieved)
+
+    def test_get_binds_and_values(self):
+        blob = b'\x00' * 1024
+
+        self.assertEqual(
+            (['%s', 'current_timestamp', 'now()', '%s', 'current_date'],
+             [blob, 1]),
+            RDBMSBase()._get_binds_and_values(
+                [blob,
+                 'current_timestamp',
+                 SQLLiteral('now()'),
+                 1,
+                 'current_date']
+            )
+        )
+
+    def test_bulk_load_lines(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual(
+            [b'1\ta\\tb\\\\c\\nd\t\\N\t1\n',
+             b'2\t\xc3\xa9\t\x00\\r\t0\n'],
+            list(
+                dsh._bulk_load_lines(
+                    [{'id': 1, 'x': 'a\tb\\c\nd', 'y': None, 'z': True},
+                     (2, '\u00e9', b'\x00\r', False)],
+                    ('id', 'x', 'y', 'z')
+                )
+            )
+        )
+
+        try:
+            list(dsh._bulk_load_lines([(1, 2)], ('id',)))
+
+            self.fail('Was able to load a row with too many values.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'expected 1 values to load but received 2', e.message
+            )
+
+        try:
+            dsh._bulk_load_lines([(1,)], tuple())
+
+            self.fail('Was able to load without columns.')
+        except DataStoreException as e:
+            self.assertEqual('the columns to load must be provided', e.message)
+
+    def test_gather_serially(self):
+        dsh = GatheringRDBMS(0).configure({'g': {}}, 'db', 'g')
+
+        self.assertEqual(
+            [['select 1', (1,)], ['select 2', (2,)]],
+            dsh.gather([('select 1', (1,)), ('select 2', (2,))])
+        )
+        self.assertEqual({threading.current_thread().name}, dsh.threads)
+
+    def test_gather_writes_serially(self):
+        dsh = GatheringRDBMS(4).configure({'g': {}}, 'db', 'g')
+
+        dsh.gather([('select 1', ()), ('update t set a = 1', ())])
+
+        self.assertEqual({threading.current_thread().name}, dsh.threads)
+
+    def test_fetch_only_what_is_needed(self):
+        dsh = FetchingRDBMS()
+
+        self.assertEqual({'a': 3}, dsh.nth(2, 'select a from t'))
+        self.assertEqual(3, dsh.fetched)
+
+        self.assertIsNone(dsh.nth(5, 'select a from t'))
+
+        self.assertEqual(1, dsh.count('select count(*) from t'))
+        self.assertEqual(1, dsh.fetched)
+
+    def test_one_warns_about_extra_records(self):
+        sql = 'select a from t where warned = 1'
+
+        self.assertEqual({'a': 1}, FetchingRDBMS().one(sql))
+
+        warnings = \
+            [stats['warnings']
+             for stats in query_stats().snapshot(1000)
+             if stats['fingerprint'] == 'select a from t where warned = ?']
+        self.assertEqual([{'one() had more than one record': 1}], warnings)
+
+    def test_limit(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual('select 1', dsh._limit('select 1', 2))
+
+        dsh.auto_limit()
+
+        self.assertEqual(
+            'select a from t limit 2', dsh._limit('select a from t  ', 2)
+        )
+        for sql in ('select a from t limit 5',
+                    'select a from t for update',
+                    'select a into @a from t',
+                    'select 1; select 2',
+                    'show tables',
+                    'update t set a = 1'):
+            self.assertEqual(sql, dsh._limit(sql, 2))
+
+    def test_read_tables(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual(
+            ('a', 'b', 'c'),
+            dsh._read_tables(
+                '''select *
+                     from db.a
+                          join `b` on b.id = a.b_id
+                          left outer join "C" on c.id = a.c_id
+                    where a.id in (select a_id from b)'''
+            )
+        )
+        self.assertEqual(
+            ('users', 'orders', 'c'),
+            dsh._read_tables(
+                '''select *
+                     from users u, orders as o
+                          join c using (id)
+                    where o.user_id = u.id'''
+            )
+        )
+        self.assertEqual(tuple(), dsh._read_tables('select 1'))
+
+    def test_render_delete_many(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual(
+            ('delete from t where id in (%s, %s)', [1, 2]),
+            dsh._render_delete_many('t', ('id',), [{'id': 1}, {'id': 2}])
+        )
+        self.assertEqual(
+            ('delete from t where (a, b) in ((%s, %s), (%s, %s))',
+             [1, 2, 3, 4]),
+            dsh._render_delete_many(
+                't', ('a', 'b'), [{'a': 1, 'b': 2}, {'a': 3, 'b': 4}]
+            )
+        )
+
+    def test_render_update_many(self):
+        dsh = RDBMSBase()
+
+        sql, values = \
+            dsh._render_update_many(
+                't',
+                ('id', 'x', 'y'),
+                ('id',),
+                [{'id': 1, 'x': 'a', 'y': 'b'}, {'id': 2, 'x': 'c', 'y': 'd'}]
+            )
+        self.assertEqual(
+            'update t set '
+            + 'x = case when id = %s then %s when id = %s then %s '
+            + 'else x end, '
+            + 'y = case when id = %s then %s when id = %s then %s '
+            + 'else y end '
+            + 'where id in (%s, %s)',
+            sql
+        )
+        self.assertEqual([1, 'a', 2, 'c', 1, 'b', 2, 'd', 1, 2], values)
+
+        sql, values = \
+            dsh._render_update_many(
+                't', ('a', 'b', 'x'), ('a', 'b'), [{'a': 1, 'b': 2, 'x': 3}]
+            )
+        self.assertEqual(
+            'update t set x = case when a = %s and b = %s then %s else x end '
+            + 'where (a, b) in ((%s, %s))',
+            sql
+        )
+        self.assertEqual([1, 2, 3, 1, 2], values)
+
+        for keys, key_cols in ((('id', 'x'), ('z',)), (('id',), ('id',))):
+            try:
+                dsh._render_update_many('t', keys, key_cols, [{}])
+
+                self.fail('Was able to update without valid columns.')
+            except DataStoreException:
+                pass
+
+    def test_upsert_columns(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual(
+            ['x', 'y'], dsh._upsert_columns(('id', 'x', 'y'), ('id',), None)
+        )
+        self.assertEqual(
+            ['y'], dsh._upsert_columns(('id', 'x', 'y'), ('id',), ('y',))
+        )
+        self.assertEqual([], dsh._upsert_columns(('id', 'x'), ('id',), []))
+
+        try:
+            dsh._upsert_columns(('id', 'x'), ('z',), None)
+
+            self.fail('Was able to upsert without the conflict columns.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'every row must contain the conflict columns (z)', e.message
+            )
+
+        try:
+            dsh._upsert_columns(('id', 'x'), ('id',), ('z',))
+
+            self.fail('Was able to upsert a column that is not in the rows.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'update column "z" is not in the rows', e.message
+            )
+
+    def test_write_tables(self):
+        dsh = RDBMSBase()
+
+        self.assertEqual(
+            ('a',), dsh._write_tables('insert into a (id) values (1)')
+        )
+        self.assertEqual(
+            ('a',), dsh._write_tables('replace into db.`a` set id = 1')
+        )
+        self.assertEqual(
+            ('a',), dsh._write_tables('insert ignore a (id) values (1)')
+        )
+        self.assertEqual(
+            ('a', 'b'),
+            dsh._write_tables(
+                'update a join b on b.id = a.b_id set a.x = b.x'
+            )
+        )
+        self.assertEqual(
+            ('a', 'b'),
+            dsh._write_tables(
+                'delete from a where id in (select a_id from b)'
+            )
+        )
+        self.assertEqual(('a',), dsh._write_tables('truncate table a'))
+        self.assertEqual(
+            ('t1', 't2'),
+            dsh._write_tables('update t1, t2 set t1.a = t2.a')
+        )
+        self.assertEqual(
+            ('t1', 't2'),
+            dsh._write_tables('delete t1 from t1 join t2 on t2.id = t1.id')
+        )
+        self.assertEqual(
+            ('a', 'b'),
+            dsh._write_tables('delete from a using a, b where b.id = a.id')
+        )
+        self.assertEqual(
+            ('a', 'b', 'x'),
+            dsh._write_tables(
+                'with x as (select id from a) update b set c = 1 '
+                + 'where id in (select id from x)'
+            )
+        )
+        self.assertEqual(
+            ('t',),
+            dsh._write_tables(
+                'insert into t (a) values (1) '
+                + 'on duplicate key update a = values(a)'
+            )
+        )
+        self.assertEqual(('*',), dsh._write_tables('call refresh_totals()'))
+        self.assertEqual(tuple(), dsh._write_tables('select * from a'))
+        self.assertEqual(tuple(), dsh._write_tables('savepoint s'))
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+from tinyAPI.base.data_store.Rows import Rows
+
+import array
+import pickle
+import tinyAPI
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class RowsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = Rows(('id', 'name', 'score'),
+                         [(1, 'a', 1.5), (2, 'b', 2.5), (3, None, 3.5)])
+
+    def test_access(self):
+        self.assertEqual(3, len(self.rows))
+        self.assertEqual(2, self.rows[1].id)
+        self.assertEqual('b', self.rows[1][1])
+        self.assertEqual({'id': 3, 'name': None, 'score': 3.5},
+                         self.rows.row_dict(2))
+        self.assertEqual([1, 2, 3], [row.id for row in self.rows])
+        self.assertEqual(['a', 'b', None], self.rows.column('name'))
+        self.assertEqual(Rows(self.rows.columns, [(2, 'b', 2.5)]),
+                         self.rows[1:2])
+
+    def test_invalid_column_names(self):
+        rows = Rows(('count(*)', 'class'), [(5, 'x')])
+
+        self.assertEqual(5, rows[0][0])
+        self.assertEqual({'count(*)': 5, 'class': 'x'}, rows.to_dicts()[0])
+
+    def test_to_columns(self):
+        columns = self.rows.to_columns()
+
+        self.assertEqual(array.array('q', [1, 2, 3]), columns['id'])
+        self.assertEqual(['a', 'b', None], columns['name'])
+        self.assertEqual(array.array('d', [1.5, 2.5, 3.5]), columns['score'])
+
+    def test_to_columns_overflow(self):
+        columns = Rows(('a',), [(2 ** 70,), (1,)]).to_columns()
+
+        self.assertEqual([2 ** 70, 1], columns['a'])
+
+    def test_pickle(self):
+        self.assertEqual(self.rows, pickle.loads(pickle.dumps(self.rows)))
+
+    def test_result_mode(self):
+        dsh = RDBMSBase()
+
+        dsh.result_mode('rows')
+        self.assertEqual(
+            Rows(('a', 'b'), [(1, 2)]),
+            dsh._shape_results((('a',), ('b',)), ((1, 2),))
+        )
+
+        dsh.result_mode('columns')
+        self.assertEqual(
+            {'a': array.array('q', [1]), 'b': array.array('q', [2])},
+            dsh._shape_results((('a',), ('b',)), ((1, 2),))
+        )
+
+        try:
+            dsh.result_mode('tuples')
+
+            self.fail('Was able to set an unrecognized result mode.')
+        except DataStoreException as e:
+            self.assertEqual('unrecognized result mode "tuples"', e.message)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
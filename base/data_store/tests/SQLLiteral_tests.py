@@ -0,0 +1,52 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.SQLLiteral import literal_sql
+from tinyAPI.base.data_store.SQLLiteral import SQLLiteral
+
+import datetime
+import tinyAPI
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class _Unprintable(object):
+
+    def __str__(self):
+        raise AssertionError('the value was converted to text')
+
+# ----- Tests -----------------------------------------------------------------
+
+class SQLLiteralTestCase(unittest.TestCase):
+
+    def test_literals(self):
+        self.assertEqual('now()', literal_sql(SQLLiteral('now()')))
+        self.assertEqual(
+            'current_timestamp', literal_sql(SQLLiteral('current_timestamp'))
+        )
+        self.assertEqual(
+            'current_timestamp(6)', literal_sql('current_timestamp(6)')
+        )
+        self.assertEqual('current_date', literal_sql('current_date'))
+
+        self.assertIsInstance(tinyAPI.SQLLiteral('now()'), str)
+
+    def test_values(self):
+        for value in ('now()',
+                      'current_dates',
+                      'the current_timestamp',
+                      b'current_timestamp',
+                      bytearray(b'current_date'),
+                      1,
+                      None,
+                      datetime.date.today(),
+                      _Unprintable()):
+            self.assertIsNone(literal_sql(value))
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
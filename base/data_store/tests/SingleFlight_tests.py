@@ -0,0 +1,66 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.SingleFlight import should_refresh
+from tinyAPI.base.data_store.SingleFlight import SingleFlight
+
+import threading
+import time
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_one_leader_per_key(self):
+        flights = SingleFlight()
+
+        flight, leader = flights.begin('a', 10)
+        self.assertTrue(leader)
+        self.assertIs(flight, flights.begin('a', 10)[0])
+        self.assertFalse(flights.begin('a', 10)[1])
+        self.assertTrue(flights.begin('b', 10)[1])
+
+        results = []
+        waiter = \
+            threading.Thread(
+                target=lambda: results.append(flights.wait(flight, 10))
+            )
+        waiter.start()
+
+        flights.finish('a', flight, [1])
+        waiter.join()
+
+        self.assertEqual([[1]], results)
+        self.assertTrue(flights.begin('a', 10)[1])
+
+    def test_abandoned_flight(self):
+        flights = SingleFlight()
+
+        flight, leader = flights.begin('a', 0.05)
+
+        self.assertIsNone(flights.wait(flight, 0.05))
+        self.assertTrue(flights.begin('a', 0.05)[1])
+
+        flights.finish('a', flight, [1])
+        self.assertFalse(flights.begin('a', 0.05)[1])
+
+    def test_should_refresh(self):
+        now = time.time()
+
+        self.assertFalse(should_refresh(None, 1, 1.0, now))
+        self.assertFalse(should_refresh(now + 1, 0, 1.0, now))
+        self.assertTrue(should_refresh(now, 0, 1.0, now))
+        self.assertFalse(should_refresh(now + 1, 1, 0, now))
+
+        refreshed = \
+            sum(should_refresh(now + 1, 1, 1.0, now) for i in range(1000))
+        self.assertTrue(300 < refreshed < 450)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.TemplateCache import TemplateCache
+
+import tinyAPI
+import unittest
+
+# ----- Tests -----------------------------------------------------------------
+
+class TemplateCacheTestCase(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = TemplateCache()
+
+        self.assertIsNone(cache.get(('create', 't', ('a',), ('%s',))))
+        cache.put(('create', 't', ('a',), ('%s',)), 'insert into t(a) ...')
+        self.assertEqual(
+            'insert into t(a) ...',
+            cache.get(('create', 't', ('a',), ('%s',)))
+        )
+
+        self.assertEqual(
+            {'hits': 1, 'misses': 1, 'size': 1},
+            cache.stats()
+        )
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TemplateCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_false_values_are_cached(self):
+        cache = TemplateCache()
+        cache.put('is select', False)
+
+        self.assertIs(False, cache.get('is select'))
+
+    def test_copy(self):
+        cache = TemplateCache(2)
+        cache.put('a', 1)
+        cache.get('a')
+
+        copy = cache.copy()
+        copy.put('b', 2)
+
+        self.assertEqual(1, copy.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(
+            {'hits': 1, 'misses': 0, 'size': 2},
+            copy.stats()
+        )
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
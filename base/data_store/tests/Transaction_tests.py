@@ -0,0 +1,222 @@
+# ----- Info ------------------------------------------------------------------
+
+__author__ = 'Michael Montero <mcmontero@gmail.com>'
+
+# ----- Imports ---------------------------------------------------------------
+
+from tinyAPI.base.data_store.exception import DataStoreException
+from tinyAPI.base.data_store.QueryStats import query_stats
+from tinyAPI.base.data_store.RDBMSBase import RDBMSBase
+
+import unittest
+
+# ----- Private Classes -------------------------------------------------------
+
+class DeadlockException(Exception):
+    pass
+
+
+class RecordingRDBMS(RDBMSBase):
+
+    def __init__(self):
+        super(RecordingRDBMS, self).__init__()
+
+        self.calls = []
+        self.commit_failures = 0
+
+    def commit(self, ignore_exceptions=False):
+        self.calls.append('commit')
+
+        if self.commit_failures > 0:
+            self.commit_failures -= 1
+            raise DeadlockException()
+
+    def _is_retryable(self, error):
+        return isinstance(error, DeadlockException)
+
+    def query(self, sql, binds=tuple()):
+        self.calls.append(sql)
+        return True
+
+    def rollback(self, ignore_exceptions=False):
+        self.calls.append('rollback')
+
+# ----- Tests -----------------------------------------------------------------
+
+class TransactionTestCase(unittest.TestCase):
+
+    def test_commit_and_rollback(self):
+        dsh = RecordingRDBMS()
+
+        with dsh.transaction():
+            dsh.query('update a')
+
+        try:
+            with dsh.transaction():
+                dsh.query('update b')
+                raise ValueError('failed')
+        except ValueError:
+            pass
+
+        self.assertEqual(
+            ['update a', 'commit', 'update b', 'rollback'], dsh.calls
+        )
+        self.assertEqual(0, dsh._transaction_depth)
+
+    def test_savepoints(self):
+        dsh = RecordingRDBMS()
+
+        with dsh.transaction():
+            with dsh.transaction():
+                dsh.query('update a')
+
+            try:
+                with dsh.transaction():
+                    with dsh.transaction():
+                        dsh.query('update b')
+                    raise ValueError('failed')
+            except ValueError:
+                pass
+
+        self.assertEqual(
+            ['savepoint tinyapi_savepoint_1',
+             'update a',
+             'release savepoint tinyapi_savepoint_1',
+             'savepoint tinyapi_savepoint_1',
+             'savepoint tinyapi_savepoint_2',
+             'update b',
+             'release savepoint tinyapi_savepoint_2',
+             'rollback to savepoint tinyapi_savepoint_1',
+             'commit'],
+            dsh.calls
+        )
+
+    def test_retry_on_deadlock(self):
+        query_stats().reset()
+        dsh = RecordingRDBMS()
+
+        attempts = 0
+        for attempt in dsh.transaction(retries=3, backoff=0):
+            with attempt:
+                attempts += 1
+                with dsh.transaction():
+                    dsh.query('update a')
+                    if attempts < 3:
+                        raise DeadlockException()
+
+        self.assertEqual(3, attempts)
+        self.assertEqual(
+            {'transaction retries': 2}, query_stats().counters()
+        )
+        self.assertEqual(
+            ['savepoint tinyapi_savepoint_1',
+             'update a',
+             'rollback'] * 2
+            + ['savepoint tinyapi_savepoint_1',
+               'update a',
+               'release savepoint tinyapi_savepoint_1',
+               'commit'],
+            dsh.calls
+        )
+
+    def test_retry_on_failed_commit(self):
+        dsh = RecordingRDBMS()
+        dsh.commit_failures = 1
+
+        attempts = 0
+        for attempt in dsh.transaction(retries=2, backoff=0):
+            with attempt:
+                attempts += 1
+                dsh.query('update a')
+
+        self.assertEqual(2, attempts)
+        self.assertEqual(
+            ['update a', 'commit', 'rollback', 'update a', 'commit'],
+            dsh.calls
+        )
+        self.assertEqual(0, dsh._transaction_depth)
+
+        dsh.commit_failures = 1
+        try:
+            with dsh.transaction():
+                dsh.query('update b')
+
+            self.fail('The error raised by commit was lost.')
+        except DeadlockException:
+            pass
+
+        self.assertEqual(['rollback'], dsh.calls[-1:])
+
+    def test_retries_require_iteration(self):
+        dsh = RecordingRDBMS()
+
+        try:
+            with dsh.transaction(retries=3):
+                dsh.query('update a')
+
+            self.fail('Was able to ignore the retries of a transaction.')
+        except DataStoreException as e:
+            self.assertEqual(
+                'a transaction with retries must be iterated over so that '
+                + 'it can be run again',
+                e.message
+            )
+
+        self.assertEqual([], dsh.calls)
+        self.assertEqual(0, dsh._transaction_depth)
+
+    def test_nested_retry_is_not_retried(self):
+        dsh = RecordingRDBMS()
+
+        attempts = 0
+        try:
+            with dsh.transaction():
+                dsh.query('update a')
+
+                for attempt in dsh.transaction(retries=3, backoff=0):
+                    with attempt:
+                        attempts += 1
+                        raise DeadlockException()
+
+            self.fail('Was able to commit a transaction that deadlocked.')
+        except DeadlockException:
+            pass
+
+        self.assertEqual(1, attempts)
+        self.assertEqual(
+            ['update a', 'savepoint tinyapi_savepoint_1', 'rollback'],
+            dsh.calls
+        )
+        self.assertEqual(0, dsh._transaction_depth)
+
+    def test_retries_exhausted(self):
+        dsh = RecordingRDBMS()
+
+        attempts = 0
+        try:
+            for attempt in dsh.transaction(retries=1, backoff=0):
+                with attempt:
+                    attempts += 1
+                    raise DeadlockException()
+
+            self.fail('Was able to finish a transaction that deadlocked.')
+        except DeadlockException:
+            pass
+
+        self.assertEqual(2, attempts)
+
+        attempts = 0
+        try:
+            for attempt in dsh.transaction(retries=3, backoff=0):
+                with attempt:
+                    attempts += 1
+                    raise ValueError('failed')
+        except ValueError:
+            pass
+
+        self.assertEqual(1, attempts)
+
+# ----- Main ------------------------------------------------------------------
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,8 +5,17 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 # ----- Imports ---------------------------------------------------------------
 
 from tinyAPI.base.config import ConfigManager
+from tinyAPI.base.data_store.Codec import Codec
+from tinyAPI.base.data_store.memcache import close_client_pool
+from tinyAPI.base.data_store.memcache import freeze
+from tinyAPI.base.data_store.memcache import FrozenRows
+from tinyAPI.base.data_store.memcache import Memcache
+from tinyAPI.base.data_store.memcache import thaw
 
 import mock
+import os
+import pylibmc
+import threading
 import tinyAPI
 import unittest
 
@@ -18,6 +27,21 @@ class MemcacheTestCase(unittest.TestCase):
         if ConfigManager().value('data store') == 'mysql':
             tinyAPI.dsh.select_db('local', 'tinyAPI')
 
+        close_client_pool()
+
+
+    def tearDown(self):
+        close_client_pool()
+
+
+    def __mock_client(self, memcache):
+        client = mock.Mock()
+        client.clone.return_value = client
+        memcache.Client.return_value = client
+        memcache.ClientPool = pylibmc.ClientPool
+
+        return client
+
 
     def test_cached_data(self):
         patcher_1 = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
@@ -26,8 +50,7 @@ class MemcacheTestCase(unittest.TestCase):
         memcache = patcher_1.start()
         context = patcher_2.start()
 
-        client = mock.Mock()
-        memcache.Client.return_value = client
+        client = self.__mock_client(memcache)
         context.env_unit_test.return_value = False
 
         for i in range(2):
@@ -53,6 +76,283 @@ class MemcacheTestCase(unittest.TestCase):
         patcher_1.stop()
         patcher_2.stop()
 
+
+    def test_retrieve_multi_only_requests_misses(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        client = self.__mock_client(memcache)
+        client.set_multi.return_value = []
+        client.get_multi.return_value = {'c': [3]}
+
+        cache = Memcache()
+        cache.clear_local_cache()
+        cache.store_multi({'a': [1], 'b': [2]}, 180)
+
+        self.assertEqual(
+            {'a': [1], 'b': [2], 'c': [3]},
+            cache.retrieve_multi(['a', 'b', 'c', 'd'])
+        )
+        client.get_multi.assert_called_once_with(['c', 'd'])
+
+        self.assertEqual({'c': [3]}, cache.retrieve_multi(['c']))
+        self.assertEqual(1, client.get_multi.call_count)
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+
+    def test_store_multi_failed_keys_not_cached_locally(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        client = self.__mock_client(memcache)
+        client.set_multi.return_value = ['b']
+        client.get_multi.return_value = {}
+
+        cache = Memcache()
+        cache.clear_local_cache()
+
+        self.assertEqual(['b'], cache.store_multi({'a': [1], 'b': [2]}))
+        self.assertEqual({'a': [1]}, cache.retrieve_multi(['a', 'b']))
+        client.get_multi.assert_called_once_with(['b'])
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+
+    def test_read_only_results_are_shared_and_frozen(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        client = self.__mock_client(memcache)
+        client.get.return_value = [{'id': 1}, {'id': 2}]
+
+        cache = Memcache()
+        cache.clear_local_cache()
+
+        first = cache.retrieve('rows', True)
+        second = cache.retrieve('rows', True)
+
+        self.assertIs(first, second)
+        self.assertIsInstance(first, FrozenRows)
+        self.assertEqual(1, client.get.call_count)
+        self.assertEqual(2, first[1]['id'])
+
+        try:
+            first[0]['id'] = 3
+
+            self.fail('Was able to modify a read only record.')
+        except TypeError:
+            pass
+
+        copy = cache.retrieve('rows')
+        copy[0]['id'] = 3
+        self.assertEqual(1, first[0]['id'])
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+
+    def test_store_read_only_sends_plain_data(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        client = self.__mock_client(memcache)
+
+        cache = Memcache()
+        cache.clear_local_cache()
+
+        frozen = cache.store('rows', [{'id': 1}], 180, 180, True)
+
+        self.assertEqual(freeze([{'id': 1}]), frozen)
+        self.assertEqual(1, client.set.call_count)
+
+        key, blob, ttl = client.set.call_args[0]
+        self.assertEqual(('rows', 180), (key, ttl))
+        self.assertEqual([{'id': 1}], Codec().decode(blob))
+        self.assertEqual([{'id': 1}], thaw(frozen))
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+
+    def test_tagged_data_invalidated_by_generation(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        values = {}
+
+        def add_multi(mapping):
+            failed = [key for key in mapping if key in values]
+            for key, value in mapping.items():
+                values.setdefault(key, value)
+            return failed
+
+        def incr_multi(keys):
+            for key in keys:
+                if key in values:
+                    values[key] += 1
+            if any(key not in values for key in keys):
+                raise memcache.NotFound
+
+        client = self.__mock_client(memcache)
+        memcache.NotFound = KeyError
+        client.add_multi.side_effect = add_multi
+        client.get_multi.side_effect = \
+            lambda keys: {key: values[key] for key in keys if key in values}
+        client.incr_multi.side_effect = incr_multi
+        client.set.side_effect = \
+            lambda key, value, ttl: values.__setitem__(key, value)
+
+        cache = Memcache()
+
+        data, generations = cache.retrieve_tagged('rows', ['a', 'b'])
+        self.assertIsNone(data)
+        self.assertEqual(
+            ['tinyapi:tag:a', 'tinyapi:tag:b'], sorted(generations.keys())
+        )
+
+        cache.store_tagged('rows', [{'id': 1}], generations, 3600)
+        self.assertEqual(
+            [{'id': 1}], cache.retrieve_tagged('rows', ['a', 'b'])[0]
+        )
+
+        cache.invalidate_tags(['b'])
+        data, generations = cache.retrieve_tagged('rows', ['a', 'b'])
+        self.assertIsNone(data)
+
+        cache.store_tagged('rows', [{'id': 2}], generations, 3600)
+        cache.invalidate_tags(['c'])
+        self.assertEqual(
+            [{'id': 2}], cache.retrieve_tagged('rows', ['a', 'b'])[0]
+        )
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+
+    def test_large_values_are_chunked(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        values = {}
+
+        client = self.__mock_client(memcache)
+        client.get.side_effect = values.get
+        client.get_multi.side_effect = \
+            lambda keys: {key: values[key] for key in keys if key in values}
+        client.set_multi.side_effect = \
+            lambda blobs, ttl: values.update(blobs) or []
+        client.delete_multi.side_effect = \
+            lambda keys: [values.pop(key, None) for key in keys]
+
+        cache = Memcache()
+        cache.clear_local_cache()
+
+        rows = [{'id': i, 'data': os.urandom(200)} for i in range(12000)]
+        cache.store('rows', rows, 180)
+
+        self.assertTrue(len(values) > 2)
+        self.assertTrue(all(len(blob) <= 1000000 for blob in values.values()))
+
+        cache.clear_local_cache()
+        self.assertEqual(rows, cache.retrieve('rows'))
+
+        del values['rows:chunk:1']
+
+        cache.clear_local_cache()
+        self.assertIsNone(cache.retrieve('rows'))
+
+        keys = set(values)
+        cache.store('rows', rows[1:], 180)
+        self.assertEqual(keys | {'rows:chunk:1'}, set(values))
+
+        cache.purge('rows')
+        self.assertEqual({}, values)
+
+        cache.clear_local_cache()
+        patcher.stop()
+
+    def test_clients_are_pooled_per_process(self):
+        patcher_1 = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        patcher_2 = mock.patch('tinyAPI.base.data_store.memcache.os')
+
+        memcache = patcher_1.start()
+        os_module = patcher_2.start()
+
+        client = self.__mock_client(memcache)
+        client.get.return_value = None
+        os_module.getpid.return_value = 100
+
+        Memcache().retrieve('a')
+        Memcache().retrieve('b')
+        self.assertEqual(1, memcache.Client.call_count)
+        self.assertEqual(10, client.clone.call_count)
+
+        threads = \
+            [threading.Thread(target=Memcache().retrieve, args=('t',))
+             for i in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(10, client.clone.call_count)
+
+        os_module.getpid.return_value = 101
+        Memcache().retrieve('c')
+        self.assertEqual(2, memcache.Client.call_count)
+
+        Memcache().clear_local_cache()
+        patcher_1.stop()
+        patcher_2.stop()
+
+
+    def test_forked_child_builds_own_pool(self):
+        patcher = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        memcache = patcher.start()
+
+        client = self.__mock_client(memcache)
+        client.get.return_value = None
+
+        Memcache().retrieve('a')
+
+        pid = os.fork()
+        if pid == 0:
+            Memcache().retrieve('b')
+            os._exit(0 if memcache.Client.call_count == 2 else 1)
+
+        self.assertEqual(0, os.waitpid(pid, 0)[1])
+
+        Memcache().retrieve('c')
+        self.assertEqual(1, memcache.Client.call_count)
+
+        Memcache().clear_local_cache()
+        patcher.stop()
+
+
+    def test_fixed_size_pool(self):
+        patcher_1 = mock.patch('tinyAPI.base.data_store.memcache.pylibmc')
+        patcher_2 = \
+            mock.patch.dict(
+                'tinyAPI_config.values', {'memcache pool size': 2})
+
+        memcache = patcher_1.start()
+        patcher_2.start()
+
+        client = self.__mock_client(memcache)
+        client.get.return_value = None
+
+        cache = Memcache()
+        cache.retrieve('a')
+        cache.retrieve('b')
+        self.assertEqual(2, client.clone.call_count)
+        self.assertEqual(2, client.get.call_count)
+
+        cache.clear_local_cache()
+        patcher_1.stop()
+        patcher_2.stop()
+
 # ----- Main ------------------------------------------------------------------
 
 if __name__ == '__main__':
@@ -7,6 +7,7 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 from tinyAPI.base.config import ConfigManager
 
 import logging
+import os
 import random
 import tinyAPI
 
@@ -47,3 +48,50 @@ class StatsLogger(object):
                 logging.basicConfig(filename = log_file)
                 logging.critical('\n'.join(lines))
                 logging.shutdown()
+
+    def request(self, name, status, metrics):
+        if tinyAPI.env_unit_test() is False:
+            log_file = ConfigManager.value('app log file')
+            if log_file is not None:
+                hit_ratio = metrics.cache_hit_ratio()
+
+                lines = [
+                    '\n----- Request (start) -----',
+                    'PID #{}'.format(os.getpid()),
+                    name,
+                    'Status: ' + ('NA' if status is None else str(status)),
+                    'DB Time: {0:.6f}s'.format(metrics.db_time),
+                    'Queries: ' + '{0:,}'.format(metrics.queries),
+                    'Cache Hit Ratio: '
+                        + ('NA'
+                           if hit_ratio is None else
+                           str(hit_ratio * 100) + '%'),
+                    '----- Request (stop) ------'
+                ]
+
+                logging.basicConfig(filename = log_file)
+                logging.critical('\n'.join(lines))
+                logging.shutdown()
+
+
+    def slow_query(self, sql, elapsed, rows=None):
+        if tinyAPI.env_unit_test() is False:
+            log_file = ConfigManager.value('app log file')
+            if log_file is not None:
+                lines = [
+                    '\n----- Slow Query (start) -----',
+                    'PID #{}'.format(os.getpid()),
+                    'Time: {0:.6f}s'.format(elapsed)
+                ]
+
+                if rows is not None:
+                    lines.append('Rows: ' + '{0:,}'.format(rows))
+
+                lines.extend([
+                    sql,
+                    '----- Slow Query (stop) ------'
+                ])
+
+                logging.basicConfig(filename = log_file)
+                logging.critical('\n'.join(lines))
+                logging.shutdown()
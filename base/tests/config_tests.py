@@ -25,6 +25,13 @@ class ConfigTestCase(unittest.TestCase):
                 '"no-such-option" is not configured in tinyAPI_config',
                 e.get_message())
 
+
+    def test_getting_a_value_with_default(self):
+        self.assertIsNone(ConfigManager.value('no-such-option', None))
+        self.assertEqual(
+            {'a': 1},
+            ConfigManager.value('no-such-option', {'a': 1}))
+
 # ----- Main ------------------------------------------------------------------
 
 if __name__ == '__main__':
@@ -63,11 +63,75 @@ values = {
     # but there is no limit to the number that can be configured.
     #
     # durability:
-    #   randomizer      A host is selected from the list at random
+    #   randomizer          A host is selected from the list at random
+    #   fall back           The first of exactly 2 hosts is selected and the
+    #                       second is used if it cannot be reached
+    #   circuit breaker     A host is selected at random from those that have
+    #                       not been marked dead
+    #   weighted random     A host is selected at random in proportion to its
+    #                       weight
+    #   least outstanding   The host with the fewest connections open from
+    #                       this process is selected
+    #   latency aware       The faster of two randomly chosen hosts to
+    #                       connect to is selected
     #
     # Fail over is built into all durability algorithms where appropriate.  If
     # the connection to the chosen host fails another will be selected both at
     # the time of initial connection and usage.
+    #
+    # Every handle in a process shares one table of host health.  A host that
+    # cannot be connected to several times in a row is marked dead for a
+    # cooldown period and is only tried again when every other host has
+    # failed.  Options are given by replacing the algorithm name with a
+    # dictionary:
+    #
+    #   'durability': {
+    #       'algorithm': 'weighted random',
+    #       'weights': [3, 1],      one per host (weighted random only)
+    #       'failures': 3,          consecutive failures before a host is
+    #                               marked dead
+    #       'cooldown': 30          seconds a host stays marked dead
+    #   }
+    #
+    # A MySQL group can optionally share a bounded pool of connections across
+    # all of the threads in a process by adding a "pool" key to the group:
+    #
+    #   'pool': {
+    #       'min size': 0,          connections kept open even when idle
+    #       'max size': 16,         connections the pool will ever open
+    #       'max idle': 300,        seconds before an idle connection closes
+    #       'wait timeout': 10,     seconds to wait for a free connection
+    #                               (None waits forever)
+    #       'validate after': 297   seconds idle before a connection is
+    #                               pinged on checkout
+    #   }
+    #
+    # A pooled connection is checked out on first use and returned to the pool
+    # (after rolling back anything that was not committed) when the handle is
+    # closed.
+    #
+    # bulk_load() on a MySQL group requires "'local infile': True" in the
+    # group (and local_infile enabled on the server).  It is off by default
+    # because it lets the server ask for any file the process can read.
+    #
+    # Reads and writes can be split across groups by adding a "routing" key
+    # to the server:
+    #
+    #   'routing': {
+    #       'read': '[group name]',     select and show statements
+    #       'write': '[group name]',    everything else
+    #       'lag tolerance': 2          seconds after a write during which
+    #                                   reads stay on the write group
+    #   }
+    #
+    # Once a write has been executed, every statement goes to the write group
+    # until the transaction is committed or rolled back.  Locking reads
+    # (for update, lock in share mode) always go to the write group.
+    #
+    # ConnectionManager().acquire_async() returns a handle whose methods are
+    # coroutines (requires aiomysql or aiopg).  It uses the same settings;
+    # "min size", "max size", "max idle" and "wait timeout" apply to the pool
+    # it opens on each event loop.
     ##
     'data store config': {
         'my server': {
@@ -81,6 +145,20 @@ values = {
         }
     },
 
+    ##
+    # If set, a background thread wakes up every "interval" seconds and pings
+    # the pooled and persistent connections that have been idle at least that
+    # long, replacing the ones that fail, so that requests neither pay for
+    # the ping nor receive a dead connection.  The interval should be shorter
+    # than the database server's idle timeout.  Optional; the thread does not
+    # run if this is None.
+    #
+    #   'data store keep alive': {
+    #       'interval': 60
+    #   }
+    ##
+    'data store keep alive': None,
+
     ##
     # tinyAPI comes with various libraries that can install data structures
     # into an RDBMS.  The schema defined here is where the objects will be
@@ -104,6 +182,76 @@ values = {
         'server': '[user]:[password]@[host]'
     },
 
+    ##
+    # The pylibmc behaviors of the clients shared by each process.  Optional;
+    # the defaults are shown.
+    ##
+    'memcache behaviors': {
+        'dead_timeout': 60,
+        'ketama': 1,
+        'remove_failed': 1,
+        'retry_timeout': 1,
+        'tcp_nodelay': True
+    },
+
+    ##
+    # Controls how values are encoded before they are stored in Memcached.
+    # Values at least "compress threshold" bytes long are compressed with
+    # "compression" ('zlib', 'lz4' or None; lz4 must be installed) at
+    # "compression level" and values longer than "chunk size" bytes are split
+    # across several keys to stay under Memcached's item size limit.
+    # Optional; the defaults are shown.
+    ##
+    'memcache codec': {
+        'chunk size': 1000000,
+        'compress threshold': 16384,
+        'compression': 'zlib',
+        'compression level': 1
+    },
+
+    ##
+    # Bounds the thread local cache that sits in front of Memcached.  Entries
+    # are evicted least recently used first once either limit is reached and
+    # keys that were not found in Memcached are remembered as missing for
+    # "negative ttl" seconds.  Optional; the defaults are shown.
+    ##
+    'memcache local cache': {
+        'max entries': 1000,
+        'max bytes': 16777216,
+        'negative ttl': 5
+    },
+
+    ##
+    # The number of Memcached clients shared by the threads of a process.
+    # Threads wait for a free client when all of them are in use.  Optional;
+    # the default is shown.
+    ##
+    'memcache pool size': 10,
+
+    ##
+    # Tunes memcache(..., single_flight=True).  The caller recomputing a
+    # missing or expired result set holds a lease for at most "lease ttl"
+    # seconds, callers with nothing stale to serve wait up to "wait timeout"
+    # seconds for it and expired result sets are kept "stale ttl" seconds
+    # past their TTL so they can be served in the meantime.  Optional; the
+    # defaults are shown.
+    ##
+    'memcache single flight': {
+        'lease ttl': 10,
+        'stale ttl': 300,
+        'wait timeout': 2
+    },
+
+    ##
+    # If True, every create, delete and write query executed through a data
+    # store handle invalidates the results cached with
+    # memcache(..., tags=...) for the tables it touches.  Each tag is a
+    # generation counter in Memcached so invalidating it is a single
+    # increment regardless of how many results are cached under it.
+    # Optional; defaults to False.
+    ##
+    'memcache tag invalidation': False,
+
     ##
     # An array of Memcached servers to use for caching.  The array should be
     # in the following format:
@@ -144,5 +292,13 @@ values = {
     # with them.  If this value is None, reference definitions will not be
     # compiled.
     ##
-    'reference definition file': None
+    'reference definition file': None,
+
+    ##
+    # Statements executed through a data store handle that take at least this
+    # many seconds are written to the "app log file".  If set to None, slow
+    # statements are not logged.  Timings for every statement are always
+    # available through ConnectionManager().query_stats().
+    ##
+    'slow query threshold': None
 }
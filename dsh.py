@@ -7,6 +7,7 @@ __author__ = 'Michael Montero <mcmontero@gmail.com>'
 from tinyAPI.base.data_store.provider import DataStoreNOOP
 from tinyAPI.base.data_store.provider import DataStoreProvider
 
+import os
 import tinyAPI
 
 __all__ = [
@@ -19,9 +20,16 @@ class __DSH(object):
 
     def __init__(self):
         self.__provider = None
+        self.__selected = None
+        self.__pid = None
 
 
     def __call__(self):
+        if self.__selected is not None and self.__pid != os.getpid():
+            # The handle was selected before this process was forked and
+            # belongs to the parent.
+            self.select_db(*self.__selected)
+
         return \
             (self.__provider
                 if self.__provider is not None else
@@ -36,6 +44,8 @@ class __DSH(object):
                     db,
                     tinyAPI.env_cli() is not True and persistent
                 )
+        self.__selected = (connection, db, persistent)
+        self.__pid = os.getpid()
         return self
 
 dsh = __DSH()